@@ -0,0 +1,596 @@
+"""
+Async GraphQL transport for qr.mojavez.ir
+نسخه asyncio کراولر: چند درخواست همزمان با سقف قابل تنظیم به ازای هر host
+"""
+
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from datetime import datetime
+from typing import Dict, List, Optional, Any, Tuple
+from urllib.parse import urlparse
+
+import aiohttp
+
+from graphql_queries import (
+    DEFAULT_HEADERS,
+    TRACK_PAGE_URL,
+    COUNT_QUERY,
+    FILTER_LICENSES_QUERY,
+    PROVINCES_QUERY,
+    TOWNSHIPS_QUERY,
+    LICENSE_DETAILS_QUERY,
+    EMPTY_PAGINATION,
+    build_details_batch_query,
+    build_filter_input,
+    details_batch_variables,
+    parse_count_response,
+    parse_filter_response,
+    parse_reference_list,
+    parse_detail_payload,
+    parse_details_batch_response,
+)
+from date_utils import SUBDAY_FORMATS, day_bounds, format_datetime_for_api, split_time_range, subday_resolution
+from transport import HttpTransport
+from rate_limit import is_throttle_status
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+
+logger = logging.getLogger(__name__)
+
+
+class BatchSizeTuner:
+    """
+    تنظیم خودکار اندازه دسته به روش AIMD
+
+    هر دسته موفق اندازه را step واحد بزرگ‌تر می‌کند و هر timeout/خطا آن را نصف می‌کند.
+    """
+
+    def __init__(self, initial: int, minimum: int = 1, maximum: int = 50, step: int = 1):
+        self.minimum = minimum
+        self.maximum = max(minimum, maximum)
+        self.step = step
+        self.size = min(max(initial, minimum), self.maximum)
+
+    def success(self):
+        self.size = min(self.maximum, self.size + self.step)
+
+    def failure(self):
+        self.size = max(self.minimum, self.size // 2)
+
+
+class AsyncMojavezCrawler:
+    """
+    کلاینت asyncio برای qr.mojavez.ir با همان API کراولر sync
+
+    تعداد درخواست‌های در حال اجرا به ازای هر host با یک Semaphore مشترک پروسه محدود می‌شود
+    (get_host_semaphore)، پس سقف بین همه نمونه‌ها و تسک‌های روی یک event loop تقسیم می‌شود.
+    """
+
+    GRAPHQL_ENDPOINT = "https://qr.mojavez.ir/graphql"
+    MAX_RECORDS_PER_REQUEST = 2100
+    DEFAULT_MAX_CONCURRENCY = 8
+    # تعداد alias در هر query دسته‌ای جزئیات (شروع و سقف؛ بین این دو خودکار تنظیم می‌شود)
+    DEFAULT_DETAIL_BATCH_SIZE = 10
+    MAX_DETAIL_BATCH_SIZE = 50
+    # timeout هر query دسته‌ای؛ timeout یعنی دسته برای سرور بزرگ است
+    DETAIL_BATCH_TIMEOUT = 60
+
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        timeout: int = 180,
+        max_retries: Optional[int] = None,
+        rate_limiter=None,
+        detail_batch_size: Optional[int] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[HttpTransport] = None
+    ):
+        """
+        Args:
+            endpoint: آدرس GraphQL endpoint (اختیاری)
+            max_concurrency: حداکثر درخواست همزمان به ازای هر host در کل پروسه (اولین نمونه تعیین می‌کند)
+            timeout: timeout هر درخواست (ثانیه)
+            max_retries: حداکثر تعداد تلاش برای هر query (پیش‌فرض: max_attempts سیاست retry)
+            rate_limiter: نمونه RateLimiter برای سقف درخواست در ثانیه (اختیاری)
+            detail_batch_size: سقف تعداد مجوز در هر query دسته‌ای جزئیات
+            retry_policy: سیاست retry (پیش‌فرض: RetryPolicy())
+            circuit_breaker: CircuitBreaker مشترک endpoint (اختیاری)
+            transport: HttpTransport مشترک پروسه؛ بدون آن هر نمونه session خودش را می‌سازد
+        """
+        self.endpoint = endpoint or self.GRAPHQL_ENDPOINT
+        self.max_concurrency = max_concurrency or self.DEFAULT_MAX_CONCURRENCY
+        self.timeout = timeout
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=max_retries or 5)
+        self.circuit_breaker = circuit_breaker
+        self.transport = transport
+        self.rate_limiter = rate_limiter
+        self.detail_batch_tuner = BatchSizeTuner(
+            initial=min(self.DEFAULT_DETAIL_BATCH_SIZE, detail_batch_size or self.MAX_DETAIL_BATCH_SIZE),
+            maximum=detail_batch_size or self.MAX_DETAIL_BATCH_SIZE
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """ساخت lazy session (باید داخل event loop صدا زده شود)"""
+        if self.transport is not None:
+            return self.transport.get_async_session()
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit_per_host=self.max_concurrency)
+            self._session = aiohttp.ClientSession(
+                headers=DEFAULT_HEADERS,
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    def _get_semaphore(self, url: str) -> asyncio.Semaphore:
+        """Semaphore مشترک host آدرس روی event loop جاری"""
+        return get_host_semaphore(urlparse(url).netloc, self.max_concurrency)
+
+    async def close(self):
+        """بستن session (session مشترک transport باز می‌ماند)"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _record_response(self, status: Optional[int] = None, latency: Optional[float] = None, failed: bool = False):
+        """گزارش نتیجه درخواست به rate limiter تا نرخ را (AIMD) تنظیم کند"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_response(status, latency, timeout=failed)
+        if self.circuit_breaker is not None:
+            if failed or is_throttle_status(status):
+                self.circuit_breaker.record_failure()
+            else:
+                self.circuit_breaker.record_success()
+
+    async def _record_response_async(self, status: Optional[int] = None, latency: Optional[float] = None, failed: bool = False):
+        """
+        _record_response روی event loop
+
+        اگر rate limiter یا circuit breaker وضعیت را در Redis می‌نویسند (اسکریپت ADJUST، SET/DELETE
+        circuit) گزارش در thread جدا اجرا می‌شود تا رفت‌وبرگشت Redis حلقه را بلاک نکند.
+        """
+        if any(getattr(shared, 'redis_client', None) is not None for shared in (self.rate_limiter, self.circuit_breaker)):
+            await asyncio.to_thread(self._record_response, status, latency, failed)
+        else:
+            self._record_response(status, latency, failed)
+
+    async def execute_query(
+        self,
+        query: str,
+        variables: Optional[Dict] = None,
+        max_retries: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
+        """
+        اجرای یک query در GraphQL
+
+        Args:
+            query: رشته GraphQL query
+            variables: متغیرهای query
+            max_retries: تعداد تلاش برای همین query (پیش‌فرض max_attempts سیاست retry)
+            timeout: timeout همین درخواست (ثانیه؛ پیش‌فرض timeout session)
+
+        Returns:
+            پاسخ JSON از سرور
+        """
+        payload = {
+            'query': query,
+            'variables': variables or {}
+        }
+
+        semaphore = self._get_semaphore(self.endpoint)
+        policy = self.retry_policy
+        max_attempts = max_retries or policy.max_attempts
+        request_timeout = aiohttp.ClientTimeout(total=timeout or self.timeout)
+
+        for attempt in range(1, max_attempts + 1):
+            probe = await self.circuit_breaker.before_request_async() if self.circuit_breaker is not None else None
+            try:
+                if self.rate_limiter is not None:
+                    await self.rate_limiter.acquire_async()
+                async with semaphore:
+                    session = self._get_session()
+                    started = time.monotonic()
+                    async with session.post(self.endpoint, json=payload, timeout=request_timeout) as response:
+                        await self._record_response_async(response.status, time.monotonic() - started)
+                        response.raise_for_status()
+                        return await response.json(content_type=None)
+            except asyncio.TimeoutError as e:
+                await self._record_response_async(failed=True)
+                if not policy.should_retry(attempt, max_attempts):
+                    logger.error(f"⏱️ Query timeout after {attempt} attempts: {e}")
+                    raise
+                delay = policy.delay(attempt)
+                logger.warning(f"⏱️ Query timeout (attempt {attempt}/{max_attempts}): {e}. Retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+            except aiohttp.ClientError as e:
+                if isinstance(e, aiohttp.ClientConnectionError):
+                    # خطای اتصال (نه پاسخ HTTP) هم نشانه فشار روی سرور است
+                    await self._record_response_async(failed=True)
+                elif isinstance(e, aiohttp.ClientResponseError) and not is_throttle_status(e.status):
+                    # خطای 4xx با تکرار درست نمی‌شود
+                    logger.error(f"❌ Query error: {e}")
+                    raise
+                if not policy.should_retry(attempt, max_attempts):
+                    logger.error(f"❌ Query error after {attempt} attempts: {e}")
+                    raise
+                delay = policy.delay(attempt)
+                logger.warning(f"❌ Query error (attempt {attempt}/{max_attempts}): {e}. Retrying in {delay:.1f}s...")
+                await asyncio.sleep(delay)
+            finally:
+                # درخواست آزمایشی cancel‌شده (مثلاً future.cancel در iter_pages) circuit را قفل نگه ندارد
+                if probe is not None:
+                    self.circuit_breaker.release_probe(probe)
+
+    async def get_records_count(
+        self,
+        start_date: str,
+        end_date: str,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None,
+        default: Optional[int] = 0,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Optional[int]:
+        """
+        دریافت تعداد رکوردها برای بازه زمانی مشخص (معادل MojavezCrawler.get_records_count)
+
+        در صورت خطا default برگردانده می‌شود.
+        """
+        variables = {
+            'input': build_filter_input(start_date, end_date, province_id, township_id, filters=filters)
+        }
+
+        try:
+            result = await self.execute_query(COUNT_QUERY, variables)
+            total = parse_count_response(result)
+            logger.info(f"📊 Total records count: {total}")
+            return total
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error getting records count: {e}")
+            return default
+
+    async def detect_subday_format(
+        self,
+        day: datetime,
+        total: int,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None
+    ) -> Tuple[Optional[str], bool]:
+        """
+        پیدا کردن فرمت زیرروزی که last_op_start_date / last_op_end_date واقعاً اعمال می‌کنند
+
+        هر فرمت SUBDAY_FORMATS با شمردن دو نیمه روز امتحان می‌شود: فرمتی پذیرفته است که جمع دو نیمه
+        دقیقاً برابر total (تعداد کل روز) باشد. اگر سرور ساعت را نادیده بگیرد هر نیمه کل روز را
+        برمی‌گرداند (جمع 2 × total) و اگر فرمت را نفهمد خطا یا صفر.
+        هر probe فقط یک بار تلاش می‌شود.
+
+        Args:
+            day: روز پرتراکم (total > 0)
+            total: تعداد رکوردهای کل روز
+
+        Returns:
+            (template از SUBDAY_FORMATS یا None، conclusive). None فقط وقتی قطعی است که سرور به همه
+            probeها جواب داد (شمارش یا خطای GraphQL)؛ اگر probeای خطای شبکه / HTTP خورد conclusive=False است
+        """
+        transient_failures = []
+
+        async def count_once(start: str, end: str) -> Optional[int]:
+            variables = {'input': build_filter_input(start, end, province_id, township_id)}
+            try:
+                return parse_count_response(await self.execute_query(COUNT_QUERY, variables, max_retries=1))
+            except CircuitOpenError:
+                raise
+            except ValueError as e:
+                # خطای GraphQL: سرور جواب داد و این فرمت را نپذیرفت
+                logger.info(f"🕒 Sub-day probe {start} - {end} rejected: {e}")
+                return None
+            except Exception as e:
+                logger.warning(f"⚠️ Sub-day probe {start} - {end} failed: {e}")
+                transient_failures.append(e)
+                return None
+
+        for template in SUBDAY_FORMATS:
+            resolution = subday_resolution(template)
+            halves = split_time_range(*day_bounds(day, resolution), resolution)
+            counts = await asyncio.gather(*[
+                count_once(format_datetime_for_api(start, template), format_datetime_for_api(end, template))
+                for start, end in halves
+            ])
+            logger.info(f"🕒 Sub-day format {template!r}: halves {counts}, whole day {total}")
+            if total > 0 and None not in counts and sum(counts) == total:
+                return template, True
+        return None, not transient_failures
+
+    async def fetch_records(
+        self,
+        start_date: str,
+        end_date: str,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None,
+        page: int = 1,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """دریافت یک صفحه رکورد (معادل MojavezCrawler.fetch_records)"""
+        variables = {
+            'input': build_filter_input(start_date, end_date, province_id, township_id, page=page, filters=filters)
+        }
+
+        try:
+            result = await self.execute_query(FILTER_LICENSES_QUERY, variables)
+            parsed = parse_filter_response(result)
+            pagination_info = parsed['pagination']
+            if parsed['has_pagination']:
+                logger.info(f"📄 Page {pagination_info['current_page']}/{pagination_info['total_pages']} - Total: {pagination_info['total']}, Per page: {pagination_info['per_page']}")
+            else:
+                logger.warning("⚠️ No pagination info in response")
+            return {
+                'records': parsed['records'],
+                'pagination': pagination_info
+            }
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error fetching records (page {page}): {e}")
+            return {'records': [], 'pagination': dict(EMPTY_PAGINATION), 'error': str(e)}
+
+    async def fetch_pages(
+        self,
+        start_date: str,
+        end_date: str,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None,
+        pages: Optional[List[int]] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        دریافت همزمان چند صفحه
+
+        Returns:
+            لیست نتایج fetch_records به ترتیب pages
+        """
+        return await asyncio.gather(*[
+            self.fetch_records(start_date, end_date, province_id, township_id, page=page, filters=filters)
+            for page in (pages or [])
+        ])
+
+    async def get_provinces(self) -> List[Dict[str, Any]]:
+        """دریافت لیست استان‌ها"""
+        try:
+            result = await self.execute_query(PROVINCES_QUERY)
+            return parse_reference_list(result, 'provinces')
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error getting provinces list: {e}")
+            return []
+
+    async def get_cities(self, province_id: int) -> List[Dict[str, Any]]:
+        """دریافت لیست شهرهای یک استان"""
+        try:
+            result = await self.execute_query(TOWNSHIPS_QUERY, {'provinceId': province_id})
+            return parse_reference_list(result, 'townships')
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error getting cities list: {e}")
+            return []
+
+    async def count_many(
+        self,
+        ranges: List[Tuple[str, str]],
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None,
+        default: Optional[int] = None
+    ) -> List[Optional[int]]:
+        """شمارش همزمان چند بازه تاریخ: لیست count به ترتیب ranges (default برای probeهای ناموفق)"""
+        return await asyncio.gather(*[
+            self.get_records_count(start, end, province_id, township_id, default=default)
+            for start, end in ranges
+        ])
+
+    async def fetch_cities_many(self, province_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """دریافت همزمان شهرهای چند استان: {province_id: لیست شهرها}"""
+        results = await asyncio.gather(*[self.get_cities(province_id) for province_id in province_ids])
+        return dict(zip(province_ids, results))
+
+    async def fetch_detail_via_graphql(self, request_number: str) -> Optional[Dict[str, Any]]:
+        """دریافت جزئیات مجوز از GraphQL (معادل MojavezCrawler.fetch_detail_via_graphql)"""
+        try:
+            result = await self.execute_query(LICENSE_DETAILS_QUERY, {"id": request_number})
+            if "errors" in result:
+                logger.warning(f"⚠️ GraphQL detail errors for {request_number}: {result['errors']}")
+                return None
+
+            details = (result.get("data") or {}).get("licenseRequestDetails")
+            return parse_detail_payload(request_number, details)
+        except CircuitOpenError:
+            raise
+        except Exception as e:
+            logger.error(f"❌ Error fetching GraphQL detail for {request_number}: {e}")
+            return None
+
+    async def fetch_details(self, request_numbers: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """دریافت همزمان جزئیات چند مجوز؛ نتایج به ترتیب ورودی"""
+        return await asyncio.gather(*[
+            self.fetch_detail_via_graphql(request_number)
+            for request_number in request_numbers
+        ])
+
+    async def fetch_details_batch(self, request_numbers: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        دریافت جزئیات چند مجوز با queryهای aliasدار (چند مجوز در هر درخواست HTTP)
+
+        اندازه هر query را detail_batch_tuner تعیین می‌کند؛ اگر یک query کامل شکست بخورد
+        (timeout یا خطای HTTP)، اندازه کوچک می‌شود و همان مجوزها در دو نیمه دوباره خواسته
+        می‌شوند. خطاهای جزئی GraphQL فقط مجوز مربوط به خودشان را None می‌کنند.
+
+        Returns:
+            لیست نتایج به ترتیب request_numbers (None برای موارد ناموفق)
+        """
+        results: Dict[int, Optional[Dict[str, Any]]] = {}
+
+        async def run(indexes: List[int]):
+            numbers = [request_numbers[i] for i in indexes]
+            try:
+                response = await self.execute_query(
+                    build_details_batch_query(len(numbers)),
+                    details_batch_variables(numbers),
+                    max_retries=1,
+                    timeout=self.DETAIL_BATCH_TIMEOUT
+                )
+                if response.get('errors') and not response.get('data'):
+                    # خطای کل query (مثلاً سقف پیچیدگی)؛ مثل timeout با دسته کوچک‌تر تکرار می‌شود
+                    raise ValueError(response['errors'])
+            except CircuitOpenError:
+                raise
+            except Exception as e:
+                self.detail_batch_tuner.failure()
+                if len(indexes) == 1:
+                    logger.error(f"❌ Error fetching GraphQL detail for {numbers[0]}: {e}")
+                    results[indexes[0]] = None
+                    return
+                logger.warning(f"⚠️ Detail batch of {len(indexes)} failed ({e}); retrying as {self.detail_batch_tuner.size}-sized batches")
+                middle = len(indexes) // 2
+                await asyncio.gather(run(indexes[:middle]), run(indexes[middle:]))
+                return
+
+            self.detail_batch_tuner.success()
+            for index, detail in zip(indexes, parse_details_batch_response(response, numbers)):
+                results[index] = detail
+
+        size = self.detail_batch_tuner.size
+        chunks = [list(range(i, min(i + size, len(request_numbers)))) for i in range(0, len(request_numbers), size)]
+        await asyncio.gather(*[run(chunk) for chunk in chunks])
+        failed = sum(1 for detail in results.values() if not detail)
+        if failed:
+            logger.warning(f"⚠️ {failed}/{len(request_numbers)} details missing from batched GraphQL queries")
+        return [results.get(i) for i in range(len(request_numbers))]
+
+    async def fetch_detail_with_fallback(self, request_number: str) -> Dict[str, Any]:
+        """
+        جزئیات از GraphQL و در صورت شکست، HTML صفحه track
+
+        Returns:
+            {'detail': دیکشنری GraphQL یا None, 'html': HTML صفحه track یا None}
+        """
+        detail = await self.fetch_detail_via_graphql(request_number)
+        if detail:
+            return {'detail': detail, 'html': None}
+        return {'detail': None, 'html': await self.fetch_track_page(request_number)}
+
+    async def fetch_details_with_fallback(self, request_numbers: List[str]) -> List[Dict[str, Any]]:
+        """جزئیات چند مجوز با fetch_details_batch و صفحه track فقط برای موارد ناموفق؛ نتایج به ترتیب ورودی"""
+        details = await self.fetch_details_batch(request_numbers)
+        htmls = await asyncio.gather(*[
+            self.fetch_track_page(request_number)
+            for request_number, detail in zip(request_numbers, details)
+            if not detail
+        ])
+        htmls = iter(htmls)
+        return [
+            {'detail': detail, 'html': None} if detail else {'detail': None, 'html': next(htmls)}
+            for detail in details
+        ]
+
+    async def fetch_track_page(self, request_number: str) -> Optional[str]:
+        """دریافت HTML صفحه track بر اساس request_number"""
+        url = TRACK_PAGE_URL.format(request_number=request_number)
+        probe = await self.circuit_breaker.before_request_async() if self.circuit_breaker is not None else None
+        try:
+            if self.rate_limiter is not None:
+                await self.rate_limiter.acquire_async()
+            async with self._get_semaphore(url):
+                session = self._get_session()
+                started = time.monotonic()
+                async with session.get(url, timeout=aiohttp.ClientTimeout(total=30)) as response:
+                    await self._record_response_async(response.status, time.monotonic() - started)
+                    response.raise_for_status()
+                    return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            if isinstance(e, (aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+                await self._record_response_async(failed=True)
+            logger.error(f"❌ Error fetching track page for {request_number}: {e}")
+            return None
+        finally:
+            if probe is not None:
+                self.circuit_breaker.release_probe(probe)
+
+
+class AsyncLoopThread:
+    """
+    یک event loop دائمی در thread جداگانه
+
+    کد sync (مثل تسک‌های Celery با pool=threads) coroutineها را با submit به این loop
+    می‌سپارد و یک concurrent.futures.Future می‌گیرد.
+    """
+
+    def __init__(self):
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        with self._lock:
+            if self._loop is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(
+                    target=self._loop.run_forever,
+                    name='mojavez-async-loop',
+                    daemon=True
+                )
+                self._thread.start()
+            return self._loop
+
+    def submit(self, coro) -> Future:
+        """اجرای coroutine روی loop و برگرداندن Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout: Optional[float] = None):
+        """اجرای coroutine و انتظار برای نتیجه"""
+        return self.submit(coro).result(timeout)
+
+
+_loop_thread: Optional[AsyncLoopThread] = None
+_loop_thread_lock = threading.Lock()
+
+
+# Semaphore هر host به ازای هر event loop (Semaphore به loop خودش بسته است)
+_host_semaphores: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Semaphore]]' = \
+    weakref.WeakKeyDictionary()
+
+
+def get_host_semaphore(host: str, limit: int) -> asyncio.Semaphore:
+    """
+    Semaphore مشترک پروسه برای host روی event loop جاری (باید داخل loop صدا زده شود)
+
+    limit اولین درخواست‌دهنده سقف host را تعیین می‌کند؛ نمونه‌های بعدی همان را به اشتراک می‌گذارند.
+    """
+    semaphores = _host_semaphores.setdefault(asyncio.get_running_loop(), {})
+    semaphore = semaphores.get(host)
+    if semaphore is None:
+        semaphore = semaphores[host] = asyncio.Semaphore(limit)
+    return semaphore
+
+
+def get_loop_thread() -> AsyncLoopThread:
+    """event loop پس‌زمینه مشترک در کل پروسه"""
+    global _loop_thread
+    with _loop_thread_lock:
+        if _loop_thread is None:
+            _loop_thread = AsyncLoopThread()
+        return _loop_thread
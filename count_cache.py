@@ -0,0 +1,161 @@
+"""
+Count cache for countFilteredLicenses
+کش تعداد رکوردها بر اساس (بازه تاریخ، استان، شهر)
+
+بازه‌هایی که تاریخ پایانشان بیش از immutable_after_days روز گذشته است دیگر تغییر نمی‌کنند
+و بدون انقضا نگه داشته می‌شوند؛ بقیه پس از ttl ثانیه منقضی می‌شوند.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any
+
+from date_utils import parse_api_date
+
+
+def count_cache_key(
+    start_date: str,
+    end_date: str,
+    province_id: Optional[int] = None,
+    township_id: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None
+) -> str:
+    """کلید یکتای کش برای یک پنجره (فیلترهای partition در انتهای کلید، به ترتیب نام)"""
+    key = f"{start_date}|{end_date}|{province_id or ''}|{township_id or ''}"
+    if filters:
+        key += '|' + ','.join(f"{field}={filters[field]}" for field in sorted(filters))
+    return key
+
+
+class CountCache:
+    """
+    کش in-memory تعداد رکوردها با شمارنده hit/miss
+
+    زیرکلاس‌ها برای ذخیره پایدار _load_many و _store_many را پیاده می‌کنند.
+    """
+
+    def __init__(self, ttl: int = 6 * 60 * 60, immutable_after_days: int = 7):
+        """
+        Args:
+            ttl: عمر ورودی‌های بازه‌های اخیر (ثانیه)
+            immutable_after_days: بازه‌هایی که این تعداد روز از پایانشان گذشته تغییرناپذیرند
+        """
+        self.ttl = ttl
+        self.immutable_after_days = immutable_after_days
+        self.hits = 0
+        self.misses = 0
+        self._memory: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def is_immutable(self, end_date: str) -> bool:
+        """آیا بازه‌ای با این تاریخ پایان دیگر تغییر نمی‌کند؟"""
+        end = parse_api_date(end_date)
+        if not end:
+            return False
+        return end < datetime.now() - timedelta(days=self.immutable_after_days)
+
+    def expires_at(self, end_date: str) -> Optional[float]:
+        """timestamp انقضا؛ None برای بازه‌های تغییرناپذیر"""
+        if self.is_immutable(end_date):
+            return None
+        return time.time() + self.ttl
+
+    def get(
+        self,
+        start_date: str,
+        end_date: str,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Optional[int]:
+        """تعداد کش‌شده یا None"""
+        key = count_cache_key(start_date, end_date, province_id, township_id, filters)
+        return self.get_many([key]).get(key)
+
+    def set(
+        self,
+        start_date: str,
+        end_date: str,
+        province_id: Optional[int],
+        township_id: Optional[int],
+        total: int,
+        filters: Optional[Dict[str, Any]] = None
+    ):
+        """ذخیره تعداد یک پنجره"""
+        self.set_many([{
+            'start_date': start_date,
+            'end_date': end_date,
+            'province_id': province_id,
+            'township_id': township_id,
+            'filters': filters,
+            'total': total,
+        }])
+
+    def get_many(self, keys: List[str]) -> Dict[str, int]:
+        """
+        جستجوی چند کلید با یک رفت‌وبرگشت به ذخیره پایدار
+
+        Returns:
+            {key: total} فقط برای کلیدهای معتبر (منقضی‌نشده)
+        """
+        now = time.time()
+        found: Dict[str, int] = {}
+        missing: List[str] = []
+
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key)
+                if entry and (entry[1] is None or entry[1] > now):
+                    found[key] = entry[0]
+                else:
+                    missing.append(key)
+
+        if missing:
+            loaded = self._load_many(missing)
+            with self._lock:
+                for key, (total, expires_at) in loaded.items():
+                    if expires_at is None or expires_at > now:
+                        self._memory[key] = (total, expires_at)
+                        found[key] = total
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, entries: List[Dict[str, Any]]):
+        """
+        ذخیره چند ورودی
+
+        Args:
+            entries: دیکشنری‌هایی با start_date, end_date, province_id, township_id, total (و filters اختیاری)
+        """
+        if not entries:
+            return
+        for entry in entries:
+            entry['key'] = count_cache_key(
+                entry['start_date'], entry['end_date'], entry.get('province_id'), entry.get('township_id'),
+                entry.get('filters')
+            )
+            entry['expires_at'] = self.expires_at(entry['end_date'])
+        with self._lock:
+            for entry in entries:
+                self._memory[entry['key']] = (entry['total'], entry['expires_at'])
+        self._store_many(entries)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / total, 3) if total else 0.0,
+        }
+
+    def _load_many(self, keys: List[str]) -> Dict[str, tuple]:
+        """بارگذاری از ذخیره پایدار: {key: (total, expires_at_timestamp یا None)}"""
+        return {}
+
+    def _store_many(self, entries: List[Dict[str, Any]]):
+        """ذخیره در ذخیره پایدار"""
+        pass
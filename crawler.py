@@ -5,12 +5,38 @@ Crawler for qr.mojavez.ir
 
 import requests
 import json
+from collections import deque
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, Iterator, List, Optional, Any, Tuple
 import time
 import logging
+import threading
 from bs4 import BeautifulSoup
-from date_utils import format_date_for_api
+from date_utils import (
+    day_bounds,
+    format_date_for_api,
+    format_datetime_for_api,
+    split_time_range,
+    subday_resolution,
+)
+from graphql_queries import (
+    DEFAULT_HEADERS,
+    TRACK_PAGE_URL,
+    COUNT_QUERY,
+    FILTER_LICENSES_QUERY,
+    PROVINCES_QUERY,
+    TOWNSHIPS_QUERY,
+    LICENSE_DETAILS_QUERY,
+    EMPTY_PAGINATION,
+    build_filter_input,
+    parse_count_response,
+    parse_filter_response,
+    parse_reference_list,
+    parse_detail_payload,
+)
+from rate_limit import is_throttle_status
+from resilience import CircuitBreaker, CircuitOpenError, RetryPolicy
+from transport import HttpTransport
 
 # تنظیمات لاگ
 logging.basicConfig(
@@ -24,6 +50,14 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class PageFetchError(Exception):
+    """دریافت یک صفحه (بعد از همه retryها) خطا داد؛ با صفحه واقعاً خالی فرق دارد"""
+
+    def __init__(self, page: int, error: str):
+        self.page = page
+        super().__init__(f"Page {page} could not be fetched: {error}")
+
+
 class MojavezCrawler:
     """کراولر برای سایت qr.mojavez.ir"""
     
@@ -33,21 +67,83 @@ class MojavezCrawler:
     # حداکثر تعداد رکورد در هر درخواست
     MAX_RECORDS_PER_REQUEST = 2100
     
-    def __init__(self, endpoint: Optional[str] = None):
+    # تعداد رکورد هر صفحه filterLicenses (سرور pageSize را نمی‌پذیرد)
+    PAGE_SIZE = 21
+    
+    # تقسیم تراکم‌محور: هر تکه تا این نسبت از سقف پر می‌شود تا خطای پیش‌بینی جا داشته باشد
+    DENSITY_FILL_RATIO = 0.8
+    
+    # حداکثر تعداد درخواست همزمان به ازای هر host (برای مسیر async)
+    DEFAULT_MAX_CONCURRENCY = 8
+    
+    # نتیجه تشخیص فرمت زیرروزی به ازای هر endpoint: (template، زمان انقضا) مشترک در کل پروسه
+    _detected_subday_formats: Dict[str, Tuple[Optional[str], float]] = {}
+    _subday_lock = threading.Lock()
+    
+    # اعتبار نتیجه قطعی تشخیص زیرروزی، و فاصله probe دوباره وقتی بعضی probeها خطا دادند (ثانیه)
+    SUBDAY_FORMAT_TTL = 24 * 60 * 60
+    SUBDAY_RETRY_INTERVAL = 10 * 60
+    
+    def __init__(
+        self,
+        endpoint: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        count_cache=None,
+        reference_data=None,
+        rate_limiter=None,
+        detail_batch_size: Optional[int] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        transport: Optional[HttpTransport] = None,
+        subday_format: Optional[str] = None
+    ):
         """
         Initialize crawler
         
         Args:
             endpoint: آدرس GraphQL endpoint (اختیاری)
+            max_concurrency: حداکثر درخواست همزمان در متدهای دسته‌ای (fetch_pages / fetch_details)
+            count_cache: نمونه CountCache برای کش get_records_count (اختیاری)
+            reference_data: نمونه ReferenceDataCache برای get_provinces / get_cities (اختیاری)
+            rate_limiter: نمونه RateLimiter مشترک برای سقف درخواست در ثانیه (اختیاری)
+            detail_batch_size: سقف تعداد مجوز در هر query دسته‌ای جزئیات (اختیاری)
+            retry_policy: سیاست retry هر query (پیش‌فرض: RetryPolicy())
+            circuit_breaker: CircuitBreaker مشترک endpoint (اختیاری)
+            transport: HttpTransport مشترک پروسه برای استفاده دوباره از اتصال‌ها بین تسک‌ها (اختیاری)
+            subday_format: فرمت زیرروزی تاریخ (یکی از SUBDAY_FORMATS)؛ None = تشخیص خودکار، '' = غیرفعال
         """
         self.endpoint = endpoint or self.GRAPHQL_ENDPOINT
-        self.session = requests.Session()
-        self.session.headers.update({
-            'Content-Type': 'application/json',
-            'Accept': 'application/json',
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        self.max_concurrency = max_concurrency or self.DEFAULT_MAX_CONCURRENCY
+        self.count_cache = count_cache
+        self.reference_data = reference_data
+        self.rate_limiter = rate_limiter
+        self.detail_batch_size = detail_batch_size
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.circuit_breaker = circuit_breaker
+        self.transport = transport
+        self.subday_format = subday_format
+        if transport is not None:
+            self.session = transport.session
+        else:
+            self.session = requests.Session()
+            self.session.headers.update(DEFAULT_HEADERS)
+        self._async_client = None
         
+    def _record_response(self, status: Optional[int] = None, latency: Optional[float] = None, failed: bool = False):
+        """گزارش نتیجه درخواست به rate limiter تا نرخ را (AIMD) تنظیم کند"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.on_response(status, latency, timeout=failed)
+        self._record_circuit(success=not (failed or is_throttle_status(status)))
+    
+    def _record_circuit(self, success: bool):
+        """گزارش موفقیت / خرابی سرور به circuit breaker"""
+        if self.circuit_breaker is None:
+            return
+        if success:
+            self.circuit_breaker.record_success()
+        else:
+            self.circuit_breaker.record_failure()
+    
     def execute_query(self, query: str, variables: Optional[Dict] = None) -> Dict[str, Any]:
         """
         اجرای یک query در GraphQL
@@ -64,103 +160,97 @@ class MojavezCrawler:
             'variables': variables or {}
         }
         
-        max_retries = 10
-        retry_delay = 2  # seconds
-        
-        for attempt in range(1, max_retries + 1):
+        policy = self.retry_policy
+        for attempt in range(1, policy.max_attempts + 1):
+            probe = self.circuit_breaker.before_request() if self.circuit_breaker is not None else None
             try:
+                if self.rate_limiter is not None:
+                    self.rate_limiter.acquire()
+                started = time.monotonic()
                 response = self.session.post(
                     self.endpoint,
                     json=payload,
                     timeout=180  # 3 minutes timeout for slow server
                 )
+                self._record_response(response.status_code, time.monotonic() - started)
                 response.raise_for_status()
                 return response.json()
             except requests.exceptions.Timeout as e:
-                if attempt < max_retries:
-                    logger.warning(f"⏱️ Query timeout (attempt {attempt}/{max_retries}): {e}. Retrying in {retry_delay}s...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                    continue
-                else:
-                    logger.error(f"⏱️ Query timeout after {max_retries} attempts: {e}")
+                self._record_response(failed=True)
+                if not policy.should_retry(attempt):
+                    logger.error(f"⏱️ Query timeout after {attempt} attempts: {e}")
                     raise
+                delay = policy.delay(attempt)
+                logger.warning(f"⏱️ Query timeout (attempt {attempt}/{policy.max_attempts}): {e}. Retrying in {delay:.1f}s...")
+                time.sleep(delay)
             except requests.exceptions.RequestException as e:
-                if attempt < max_retries:
-                    logger.warning(f"❌ Query error (attempt {attempt}/{max_retries}): {e}. Retrying in {retry_delay}s...")
-                    time.sleep(retry_delay)
-                    retry_delay *= 2  # Exponential backoff
-                    continue
-                else:
-                    logger.error(f"❌ Query error after {max_retries} attempts: {e}")
+                response = getattr(e, 'response', None)
+                if response is None:
+                    # خطای اتصال (نه پاسخ HTTP) هم نشانه فشار روی سرور است
+                    self._record_response(failed=True)
+                elif not is_throttle_status(response.status_code):
+                    # خطای 4xx با تکرار درست نمی‌شود
+                    logger.error(f"❌ Query error: {e}")
+                    raise
+                if not policy.should_retry(attempt):
+                    logger.error(f"❌ Query error after {attempt} attempts: {e}")
                     raise
+                delay = policy.delay(attempt)
+                logger.warning(f"❌ Query error (attempt {attempt}/{policy.max_attempts}): {e}. Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+            finally:
+                # درخواست آزمایشی که بدون نتیجه قطع شد circuit را قفل نگه ندارد
+                if probe is not None:
+                    self.circuit_breaker.release_probe(probe)
     
     def get_records_count(
         self,
         start_date: str,
         end_date: str,
         province_id: Optional[int] = None,
-        township_id: Optional[int] = None
-    ) -> int:
+        township_id: Optional[int] = None,
+        default: Optional[int] = 0,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Optional[int]:
         """
         دریافت تعداد رکوردها برای بازه زمانی مشخص
         
+        اگر count_cache تنظیم شده باشد، ابتدا کش بررسی می‌شود و پاسخ‌های موفق در آن ذخیره می‌شوند.
+        
         Args:
             start_date: تاریخ شروع (فرمت: YYYY/M/D)
             end_date: تاریخ پایان (فرمت: YYYY/M/D)
             province_id: شناسه استان (اختیاری)
             township_id: شناسه شهر (اختیاری)
+            default: مقدار برگشتی در صورت خطا
+            filters: فیلترهای partition (main_org_code، sub_org_code، title)
             
         Returns:
             تعداد رکوردها
         """
-        # استفاده از countFilteredLicenses بر اساس schema واقعی
-        count_query = """
-        query CountFilteredLicenses($input: filterLicensesInput!) {
-            countFilteredLicenses(input: $input) {
-                total
-            }
-        }
-        """
-        
-        # ساخت input object بر اساس ساختار واقعی
-        input_obj = {
-            "title": "",
-            "name": "",
-            "issue_start_date": "",
-            "issue_end_date": "",
-            "last_op_start_date": start_date,
-            "last_op_end_date": end_date,
-            "main_org_code": None,
-            "sub_org_code": None
-        }
-        
-        # اضافه کردن فیلترهای اختیاری
-        if province_id:
-            input_obj["province_id"] = province_id
-        if township_id:
-            input_obj["township_id"] = township_id
+        if self.count_cache is not None:
+            cached = self.count_cache.get(start_date, end_date, province_id, township_id, filters)
+            if cached is not None:
+                logger.info(f"📊 Total records count (cached): {cached}")
+                return cached
         
         variables = {
-            'input': input_obj
+            'input': build_filter_input(start_date, end_date, province_id, township_id, filters=filters)
         }
         
         try:
-            result = self.execute_query(count_query, variables)
-            
-            # Check for errors
-            if 'errors' in result:
-                logger.error(f"❌ GraphQL errors: {result['errors']}")
-                return 0
-            
-            # Response path: data.countFilteredLicenses.total
-            count_result = result.get('data', {}).get('countFilteredLicenses', {})
-            total = count_result.get('total', 0)
+            result = self.execute_query(COUNT_QUERY, variables)
+            total = parse_count_response(result)
             logger.info(f"📊 Total records count: {total}")
-            return total
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logger.error(f"❌ Error getting records count: {e}")
-            return 0
+            return default
+        
+        if self.count_cache is not None:
+            self.count_cache.set(start_date, end_date, province_id, township_id, total, filters)
+        return total
     
     def fetch_records(
         self,
@@ -168,8 +258,9 @@ class MojavezCrawler:
         end_date: str,
         province_id: Optional[int] = None,
         township_id: Optional[int] = None,
-        page: int = 1
-    ) -> List[Dict[str, Any]]:
+        page: int = 1,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         """
         دریافت رکوردها از GraphQL
         
@@ -179,163 +270,93 @@ class MojavezCrawler:
             province_id: شناسه استان (اختیاری)
             township_id: شناسه شهر (اختیاری)
             page: شماره صفحه (شروع از 1) - باید به صورت String ارسال شود
+            filters: فیلترهای partition (main_org_code، sub_org_code، title)
             
         Returns:
-            لیست رکوردها
-        """
-        # استفاده از filterLicenses بر اساس schema واقعی
-        records_query = """
-        query FilterLicenses($input: filterLicensesInput!) {
-            filterLicenses(input: $input) {
-                license {
-                    request_number
-                    applicant_name
-                    user_image
-                    license_title
-                    organization_title
-                    province_title
-                    township_title
-                    responded_at
-                    status {
-                        status_id
-                        status_title
-                        status_slug
-                    }
-                }
-                pagination {
-                    total
-                    per_page
-                    current_page
-                }
-            }
-        }
+            دیکشنری شامل records و pagination
         """
-        
-        # ساخت input object بر اساس ساختار واقعی
-        input_obj = {
-            "title": "",
-            "name": "",
-            "issue_start_date": "",
-            "issue_end_date": "",
-            "last_op_start_date": start_date,
-            "last_op_end_date": end_date,
-            "main_org_code": None,
-            "sub_org_code": None,
-            "page": str(page)  # page باید String باشد
-            # Note: pageSize is not in the schema, API uses default page size
-        }
-        
-        # اضافه کردن فیلترهای اختیاری
-        if province_id:
-            input_obj["province_id"] = province_id
-        if township_id:
-            input_obj["township_id"] = township_id
-        
         variables = {
-            'input': input_obj
+            'input': build_filter_input(start_date, end_date, province_id, township_id, page=page, filters=filters)
         }
         
         try:
-            result = self.execute_query(records_query, variables)
-            
-            # Check for errors
-            if 'errors' in result:
-                logger.error(f"❌ GraphQL errors: {result['errors']}")
-                return []
-            
-            # مسیر پاسخ: data.filterLicenses.license
-            filter_response = result.get('data', {}).get('filterLicenses', {})
-            licenses = filter_response.get('license', [])
-            
-            # Debug: log full response structure
-            logger.debug(f"🔍 Filter response keys: {filter_response.keys() if filter_response else 'None'}")
-            
-            # Log pagination info
-            pagination = filter_response.get('pagination', {})
-            pagination_info = {
-                'total': 0,
-                'per_page': 0,
-                'current_page': 0,
-                'total_pages': 0
-            }
+            result = self.execute_query(FILTER_LICENSES_QUERY, variables)
+            parsed = parse_filter_response(result)
+            pagination_info = parsed['pagination']
             
-            if pagination:
-                pagination_info['total'] = pagination.get('total') or 0
-                pagination_info['per_page'] = pagination.get('per_page') or 0
-                pagination_info['current_page'] = pagination.get('current_page') or 0
-                if pagination_info['per_page'] and pagination_info['per_page'] > 0:
-                    pagination_info['total_pages'] = (pagination_info['total'] + pagination_info['per_page'] - 1) // pagination_info['per_page']
-                else:
-                    pagination_info['total_pages'] = 0
+            if parsed['has_pagination']:
                 logger.info(f"📄 Page {pagination_info['current_page']}/{pagination_info['total_pages']} - Total: {pagination_info['total']}, Per page: {pagination_info['per_page']}")
             else:
-                logger.warning(f"⚠️ No pagination info in response. Response structure: {list(filter_response.keys()) if filter_response else 'None'}")
+                logger.warning("⚠️ No pagination info in response")
             
             # Return records with pagination info
             return {
-                'records': licenses,
+                'records': parsed['records'],
                 'pagination': pagination_info
             }
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logger.error(f"❌ Error fetching records: {e}")
-            return {'records': [], 'pagination': {'total': 0, 'per_page': 0, 'current_page': 0, 'total_pages': 0}}
+            # کلید error صفحه ناموفق را از صفحه خالی جدا می‌کند
+            return {'records': [], 'pagination': dict(EMPTY_PAGINATION), 'error': str(e)}
     
-    def get_provinces(self) -> List[Dict[str, Any]]:
+    def get_provinces(self, use_cache: bool = True) -> List[Dict[str, Any]]:
         """
         دریافت لیست استان‌ها
         
+        Args:
+            use_cache: اگر reference_data تنظیم شده باشد ابتدا از آن خوانده شود
+        
         Returns:
             لیست استان‌ها با id و name
         """
-        provinces_query = """
-        query GetProvinces {
-            provinceTownship {
-                provinces {
-                    id
-                    name
-                }
-            }
-        }
-        """
+        if use_cache and self.reference_data is not None:
+            provinces = self.reference_data.get_provinces()
+            if provinces:
+                return provinces
         
         try:
-            result = self.execute_query(provinces_query)
-            province_township = result.get('data', {}).get('provinceTownship', {})
-            provinces = province_township.get('provinces', [])
-            return provinces
+            result = self.execute_query(PROVINCES_QUERY)
+            provinces = parse_reference_list(result, 'provinces')
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logger.error(f"❌ Error getting provinces list: {e}")
             return []
+        
+        if self.reference_data is not None and provinces:
+            self.reference_data.set_provinces(provinces)
+        return provinces
     
-    def get_cities(self, province_id: int) -> List[Dict[str, Any]]:
+    def get_cities(self, province_id: int, use_cache: bool = True) -> List[Dict[str, Any]]:
         """
         دریافت لیست شهرهای یک استان
         
         Args:
             province_id: شناسه استان
+            use_cache: اگر reference_data تنظیم شده باشد ابتدا از آن خوانده شود
             
         Returns:
             لیست شهرها با id و name
         """
-        cities_query = """
-        query GetTownships($provinceId: Int!) {
-            provinceTownship {
-                townships(provinceId: $provinceId) {
-                    id
-                    name
-                }
-            }
-        }
-        """
+        if use_cache and self.reference_data is not None:
+            townships = self.reference_data.get_townships(province_id)
+            if townships is not None:
+                return townships
         
         try:
-            result = self.execute_query(cities_query, {'provinceId': province_id})
-            province_township = result.get('data', {}).get('provinceTownship', {})
-            townships = province_township.get('townships', [])
-            return townships
+            result = self.execute_query(TOWNSHIPS_QUERY, {'provinceId': province_id})
+            townships = parse_reference_list(result, 'townships')
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logger.error(f"❌ Error getting cities list: {e}")
             return []
+        
+        if self.reference_data is not None and townships:
+            self.reference_data.set_townships(province_id, townships)
+        return townships
 
     def fetch_detail_via_graphql(self, request_number: str) -> Optional[Dict[str, Any]]:
         """
@@ -347,97 +368,218 @@ class MojavezCrawler:
         Returns:
             دیکشنری داده‌ها یا None در صورت عدم دسترسی/خطا
         """
-        details_query = """
-        query LicenseRequestDetails($id: String!) {
-            licenseRequestDetails {
-                license(id: $id) {
-                    license_title
-                    organization_title
-                    isic_code
-                    issue_type
-                    responded_at
-                    old_license_responded_at
-                    expires_at
-                    status {
-                        status_id
-                        status_title
-                        status_slug
-                    }
-                }
-                location(id: $id) {
-                    province
-                    township
-                    postal_code
-                    address
-                    map
-                }
-                applicant(id: $id) {
-                    applicant_name
-                    user_type
-                    company_name
-                    father_name
-                    code
-                    user_image
-                    work_mobile
-                }
-                approval(id: $id) {
-                    approval_title
-                    respondent_organization
-                    receiver_gateway
-                    approval_type
-                    request_type
-                }
-                history(id: $id) {
-                    license_operation
-                    operation_reasons
-                    created_at
-                    status
-                }
-                note(id: $id) {
-                    foot_notes
-                    aside_notes
-                }
-            }
-        }
-        """
-
         try:
-            result = self.execute_query(details_query, {"id": request_number})
+            result = self.execute_query(LICENSE_DETAILS_QUERY, {"id": request_number})
             if "errors" in result:
                 logger.warning(f"⚠️ GraphQL detail errors for {request_number}: {result['errors']}")
                 return None
 
-            details = result.get("data", {}).get("licenseRequestDetails")
-            if not details:
-                return None
-
-            info = details.get("license") or {}
-            location = details.get("location") or {}
-            status = info.get("status") if isinstance(info.get("status"), dict) else {}
-
-            data: Dict[str, Any] = {
-                "request_number": request_number,
-                "license_title": info.get("license_title"),
-                "organization_title": info.get("organization_title"),
-                "isic_code": info.get("isic_code"),
-                "issue_type": info.get("issue_type"),
-                "issued_at": info.get("responded_at") or info.get("old_license_responded_at"),
-                "expires_at": info.get("expires_at"),
-                "province_title_detail": location.get("province"),
-                "township_title_detail": location.get("township"),
-                "postal_code": location.get("postal_code"),
-                "business_address": location.get("address"),
-                "status_title": status.get("status_title"),
-                "status_slug": status.get("status_slug"),
-                "raw_graphql": details,
-                "source": "graphql",
-            }
-
-            return data
+            details = (result.get("data") or {}).get("licenseRequestDetails")
+            return parse_detail_payload(request_number, details)
+        except CircuitOpenError:
+            raise
         except Exception as e:
             logger.error(f"❌ Error fetching GraphQL detail for {request_number}: {e}")
             return None
 
+    def get_subday_format(
+        self,
+        day: datetime,
+        total: int,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None
+    ) -> Optional[str]:
+        """
+        فرمت زیرروزی قابل استفاده برای تقسیم یک روز پرتراکم به ساعت‌ها
+        
+        اگر subday_format داده نشده باشد با probe روی همین روز تشخیص داده می‌شود
+        (AsyncMojavezCrawler.detect_subday_format). نتیجه قطعی تا SUBDAY_FORMAT_TTL نگه داشته
+        و از طریق reference data (facet 'subday_format') با بقیه ورکرها به اشتراک گذاشته می‌شود؛
+        اگر بعضی probeها خطا دادند «نه» قطعی نیست و بعد از SUBDAY_RETRY_INTERVAL دوباره امتحان می‌شود.
+        
+        Returns:
+            template از SUBDAY_FORMATS یا None اگر API بازه کوچک‌تر از روز را نمی‌پذیرد
+        """
+        if self.subday_format is not None:
+            return self.subday_format or None
+        with self._subday_lock:
+            cached = self._detected_subday_formats.get(self.endpoint)
+            if cached is not None and cached[1] > time.time():
+                return cached[0]
+            shared = self.reference_data.get_facets('subday_format') if self.reference_data is not None else None
+            if shared:
+                self._detected_subday_formats[self.endpoint] = (shared[0], time.time() + self.SUBDAY_FORMAT_TTL)
+                return shared[0]
+            client = self._get_async_client()
+            template, conclusive = self._submit_async(
+                client.detect_subday_format(day, total, province_id, township_id)
+            ).result()
+            ttl = self.SUBDAY_FORMAT_TTL if conclusive else self.SUBDAY_RETRY_INTERVAL
+            self._detected_subday_formats[self.endpoint] = (template, time.time() + ttl)
+            if conclusive and self.reference_data is not None:
+                self.reference_data.set_facets('subday_format', [template])
+        if template:
+            logger.info(f"🕒 Sub-day windows enabled, date format: {template!r}")
+        elif conclusive:
+            logger.warning("⚠️ API ignores or rejects time in last_op dates; dense days cannot be split by hour")
+        else:
+            logger.warning(
+                f"⚠️ Sub-day format probes failed; dense days are not split by hour for the next "
+                f"{self.SUBDAY_RETRY_INTERVAL}s"
+            )
+        return template
+
+    # ------------------------------------------------------------------
+    # مسیر همزمان: واگذاری به AsyncMojavezCrawler روی event loop پس‌زمینه
+    # ------------------------------------------------------------------
+
+    def _get_async_client(self):
+        """ساخت lazy کلاینت async متصل به event loop مشترک پروسه"""
+        if self._async_client is None:
+            from async_crawler import AsyncMojavezCrawler
+            self._async_client = AsyncMojavezCrawler(
+                endpoint=self.endpoint,
+                max_concurrency=self.max_concurrency,
+                rate_limiter=self.rate_limiter,
+                detail_batch_size=self.detail_batch_size,
+                retry_policy=self.retry_policy,
+                circuit_breaker=self.circuit_breaker,
+                transport=self.transport
+            )
+        return self._async_client
+
+    def _submit_async(self, coro):
+        """ارسال coroutine به event loop پس‌زمینه و برگرداندن concurrent Future"""
+        from async_crawler import get_loop_thread
+        return get_loop_thread().submit(coro)
+
+    def fetch_pages(
+        self,
+        start_date: str,
+        end_date: str,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None,
+        pages: Optional[List[int]] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        دریافت همزمان چند صفحه (حداکثر max_concurrency درخواست در حال اجرا)
+        
+        Args:
+            start_date: تاریخ شروع (فرمت: YYYY/M/D)
+            end_date: تاریخ پایان (فرمت: YYYY/M/D)
+            province_id: شناسه استان (اختیاری)
+            township_id: شناسه شهر (اختیاری)
+            pages: لیست شماره صفحات
+            filters: فیلترهای partition (main_org_code، sub_org_code، title)
+            
+        Returns:
+            لیست نتایج fetch_records به ترتیب pages
+        """
+        if not pages:
+            return []
+        client = self._get_async_client()
+        return self._submit_async(
+            client.fetch_pages(start_date, end_date, province_id, township_id, pages, filters=filters)
+        ).result()
+
+    def fetch_details(self, request_numbers: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        دریافت همزمان جزئیات چند مجوز از GraphQL
+        
+        Returns:
+            لیست نتایج fetch_detail_via_graphql به ترتیب request_numbers
+        """
+        if not request_numbers:
+            return []
+        client = self._get_async_client()
+        return self._submit_async(client.fetch_details(request_numbers)).result()
+
+    def fetch_details_batch(self, request_numbers: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        دریافت جزئیات چند مجوز با queryهای aliasدار (چند مجوز در هر درخواست HTTP)
+        
+        اندازه هر query بین 1 و detail_batch_size خودکار تنظیم می‌شود.
+        
+        Returns:
+            لیست نتایج به ترتیب request_numbers (None برای موارد ناموفق)
+        """
+        if not request_numbers:
+            return []
+        client = self._get_async_client()
+        return self._submit_async(client.fetch_details_batch(request_numbers)).result()
+
+    def fetch_details_with_fallback(self, request_numbers: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """
+        دریافت جزئیات چند مجوز با fetch_details_batch؛ فقط برای موارد ناموفق صفحه track خوانده می‌شود
+        
+        درخواست‌ها (GraphQL و track) روی event loop همزمان اجرا می‌شوند و پارس HTML در همین thread.
+        
+        Returns:
+            لیست دیکشنری جزئیات به ترتیب request_numbers (کلید source: graphql / html)؛
+            None برای مواردی که هیچ منبعی جواب نداد
+        """
+        if not request_numbers:
+            return []
+        client = self._get_async_client()
+        results = self._submit_async(client.fetch_details_with_fallback(request_numbers)).result()
+        details = []
+        for request_number, result in zip(request_numbers, results):
+            if result['detail']:
+                details.append(result['detail'])
+            elif result['html']:
+                parsed = self.parse_track_html(result['html'], request_number=request_number)
+                parsed["source"] = "html"
+                details.append(parsed)
+            else:
+                details.append(None)
+        return details
+
+    def fetch_cities_many(self, province_ids: List[int]) -> Dict[int, List[Dict[str, Any]]]:
+        """
+        دریافت همزمان شهرهای چند استان (بدون کش)
+        
+        Returns:
+            {province_id: لیست شهرها}
+        """
+        if not province_ids:
+            return {}
+        client = self._get_async_client()
+        return self._submit_async(client.fetch_cities_many(province_ids)).result()
+
+    def count_many(
+        self,
+        ranges: List[tuple],
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None
+    ) -> List[Optional[int]]:
+        """
+        شمارش همزمان چند بازه تاریخ بدون count_cache
+        
+        برای مقایسه تعداد فعلی با تعدادهای ذخیره‌شده (کراول افزایشی) که کش نباید آن را پنهان کند.
+        
+        Args:
+            ranges: لیست (start_date, end_date) با فرمت YYYY/M/D
+            
+        Returns:
+            لیست count به ترتیب ranges؛ None برای probeهای ناموفق
+        """
+        if not ranges:
+            return []
+        client = self._get_async_client()
+        return self._submit_async(client.count_many(ranges, province_id, township_id)).result()
+
+    def close(self):
+        """بستن session ها (sync و async)؛ session های transport مشترک باز می‌مانند"""
+        if self.transport is None:
+            self.session.close()
+        if self._async_client is not None:
+            try:
+                self._submit_async(self._async_client.close()).result(timeout=10)
+            except Exception as e:
+                logger.warning(f"⚠️ Error closing async client: {e}")
+            self._async_client = None
+
     def fetch_track_page(self, request_number: str) -> Optional[str]:
         """
         دریافت HTML صفحه track بر اساس request_number
@@ -448,15 +590,25 @@ class MojavezCrawler:
         Returns:
             محتوای HTML صفحه یا None در صورت خطا
         """
+        probe = self.circuit_breaker.before_request() if self.circuit_breaker is not None else None
         try:
-            url = f"https://qr.mojavez.ir/track/{request_number}"
+            url = TRACK_PAGE_URL.format(request_number=request_number)
             logger.info(f"🌐 Fetching track page: {url}")
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire()
+            started = time.monotonic()
             resp = self.session.get(url, timeout=30)
+            self._record_response(resp.status_code, time.monotonic() - started)
             resp.raise_for_status()
             return resp.text
         except requests.RequestException as e:
+            if getattr(e, 'response', None) is None:
+                self._record_response(failed=True)
             logger.error(f"❌ Error fetching track page for {request_number}: {e}")
             return None
+        finally:
+            if probe is not None:
+                self.circuit_breaker.release_probe(probe)
 
     def parse_track_html(self, html: str, request_number: Optional[str] = None) -> Dict[str, Any]:
         """
@@ -511,7 +663,7 @@ class MojavezCrawler:
     
     def split_date_range(self, start_date: datetime, end_date: datetime) -> List[tuple]:
         """
-        تقسیم بازه زمانی به دو نیمه
+        تقسیم بازه زمانی به دو نیمه (بر اساس روز کامل)
         
         Args:
             start_date: تاریخ شروع
@@ -520,14 +672,71 @@ class MojavezCrawler:
         Returns:
             لیست شامل دو tuple (start, end)
         """
-        duration = end_date - start_date
-        mid_date = start_date + duration / 2
+        # نقطه وسط روی مرز روز گرفته می‌شود؛ در غیر این صورت نیمه دوم ساعت پیدا می‌کند
+        # و با duration.days == 0 اشتباهاً یک‌روزه فرض می‌شود.
+        mid_date = start_date + timedelta(days=(end_date - start_date).days // 2)
         
         return [
             (start_date, mid_date),
             (mid_date + timedelta(days=1), end_date)
         ]
     
+    def split_date_range_by_density(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        count: int,
+        daily_density: Optional[Dict[Any, float]] = None
+    ) -> List[tuple]:
+        """
+        تقسیم بازه به تکه‌هایی که پیش‌بینی می‌شود هر کدام زیر سقف باشند
+        
+        تعداد والد (count) بر اساس تراکم روزانه تاریخی بین روزها پخش می‌شود و روزهای
+        متوالی تا DENSITY_FILL_RATIO از MAX_RECORDS_PER_REQUEST کنار هم قرار می‌گیرند.
+        بدون سابقه، تراکم یکنواخت فرض می‌شود. اگر پیش‌بینی فقط یک تکه بدهد
+        (یعنی تاریخچه با count همخوانی ندارد)، به split_date_range برمی‌گردیم.
+        
+        Args:
+            start_date: تاریخ شروع
+            end_date: تاریخ پایان
+            count: تعداد رکوردهای کل بازه
+            daily_density: {date: تعداد رکورد} از داده‌های قبلی (اختیاری)
+            
+        Returns:
+            لیست tupleهای (start, end)
+        """
+        days = (end_date - start_date).days + 1
+        if days <= 1:
+            return [(start_date, end_date)]
+        
+        day_list = [start_date + timedelta(days=i) for i in range(days)]
+        daily_density = daily_density or {}
+        known = [daily_density[d.date()] for d in day_list if d.date() in daily_density]
+        # روزهایی که سابقه ندارند میانگین روزهای شناخته‌شده را می‌گیرند
+        default_weight = (sum(known) / len(known)) if known and sum(known) > 0 else 1.0
+        weights = [
+            max(float(daily_density.get(d.date(), default_weight)), 0.01 * default_weight)
+            for d in day_list
+        ]
+        total_weight = sum(weights)
+        predicted = [count * w / total_weight for w in weights]
+        
+        target = self.MAX_RECORDS_PER_REQUEST * self.DENSITY_FILL_RATIO
+        pieces = []
+        piece_start = 0
+        filled = 0.0
+        for i, day_count in enumerate(predicted):
+            if i > piece_start and filled + day_count > target:
+                pieces.append((day_list[piece_start], day_list[i - 1]))
+                piece_start = i
+                filled = 0.0
+            filled += day_count
+        pieces.append((day_list[piece_start], end_date))
+        
+        if len(pieces) == 1:
+            return self.split_date_range(start_date, end_date)
+        return pieces
+    
     def crawl_date_range(
         self,
         start_date: datetime,
@@ -535,19 +744,55 @@ class MojavezCrawler:
         province_id: Optional[int] = None,
         township_id: Optional[int] = None,
         progress_callback: Optional[callable] = None,
-        save_callback: Optional[callable] = None
+        save_callback: Optional[callable] = None,
+        collect: Optional[bool] = None,
+        daily_density: Optional[Dict[Any, float]] = None
     ) -> List[Dict[str, Any]]:
         """
         کراول کردن یک بازه زمانی با استراتژی تقسیم بازه
         
+        روی iter_date_range ساخته شده است؛ وقتی save_callback داده شود رکوردها به صورت
+        پیش‌فرض در حافظه نگه داشته نمی‌شوند (collect=False) و لیست خالی برگردانده می‌شود.
+        
         Args:
             start_date: تاریخ شروع
             end_date: تاریخ پایان
             province_id: شناسه استان (اختیاری)
             township_id: شناسه شهر (اختیاری)
+            progress_callback: progress_callback(fetched_count, page, total_pages)
+            save_callback: ذخیره رکوردهای هر صفحه
+            collect: نگه داشتن رکوردها برای خروجی (پیش‌فرض: فقط بدون save_callback)
+            daily_density: تراکم روزانه تاریخی برای split_date_range_by_density (اختیاری)
             
         Returns:
-            لیست تمام رکوردها
+            لیست تمام رکوردها (اگر collect)
+        """
+        return self._consume_pages(
+            self.iter_date_range(start_date, end_date, province_id, township_id, daily_density=daily_density),
+            save_callback=save_callback,
+            progress_callback=progress_callback,
+            collect=collect
+        )
+    
+    def iter_date_range(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None,
+        should_stop: Optional[callable] = None,
+        daily_density: Optional[Dict[Any, float]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        نسخه streaming کراول بازه: صفحه به صفحه yield می‌کند
+        
+        ترتیب تقسیم همان crawl_date_range است (تاریخ ← استان ← شهر ← ساعت)؛ هیچ رکوردی بعد از
+        yield نگه داشته نمی‌شود، پس مصرف حافظه به اندازه چند صفحه محدود است.
+        daily_density (تراکم روزانه تاریخی همین فیلتر استان/شهر) به تقسیم‌های تاریخ داده می‌شود؛
+        بدون آن تراکم یکنواخت فرض می‌شود.
+        
+        Yields:
+            {'start_date', 'end_date', 'province_id', 'township_id', 'page', 'total_pages', 'records'}
         """
         start_str = format_date_for_api(start_date)
         end_str = format_date_for_api(end_date)
@@ -561,77 +806,12 @@ class MojavezCrawler:
         # اگر تعداد کمتر از حد مجاز بود، مستقیماً دریافت می‌کنیم
         if count <= self.MAX_RECORDS_PER_REQUEST:
             logger.info(f"✅ Count ({count}) is within limit. Fetching all pages...")
-            all_records = []
-            page = 1
-            max_pages = (count + 20) // 21 + 10  # Estimate max pages with buffer
-            
-            while page <= max_pages:
-                result = self.fetch_records(
-                    start_str, end_str, province_id, township_id,
-                    page=page
-                )
-                
-                # Handle new response structure
-                if isinstance(result, dict):
-                    records = result.get('records', [])
-                    pagination = result.get('pagination', {})
-                else:
-                    records = result if result else []
-                    pagination = {}
-                
-                if not records:
-                    logger.info(f"ℹ️ No more records on page {page}")
-                    break
-                
-                # Annotate records with current location IDs so downstream
-                # consumers (مثل Django jobs app) بتوانند province_id/township_id را ذخیره کنند
-                for r in records:
-                    if province_id is not None:
-                        r['province_id'] = province_id
-                    if township_id is not None:
-                        r['township_id'] = township_id
-                
-                all_records.extend(records)
-                logger.info(f"✅ Fetched {len(records)} records from page {page} (Total: {len(all_records)}/{count})")
-                
-                # Save records immediately via callback
-                if save_callback:
-                    saved = save_callback(records)
-                    if saved > 0:
-                        logger.info(f"💾 Saved {saved} records from page {page} to database")
-                
-                # Update progress via callback (after saving to ensure DB is updated)
-                if progress_callback:
-                    total_pages = pagination.get('total_pages', 0)
-                    if total_pages == 0 and count > 0:
-                        total_pages = (count + 20) // 21  # Estimate
-                    # Progress callback will get actual count from database
-                    progress_callback(len(all_records), page, total_pages)
-                
-                # Check if we've reached the last page
-                total_pages = pagination.get('total_pages', 0)
-                current_page = pagination.get('current_page', page)
-                
-                if total_pages > 0 and current_page >= total_pages:
-                    logger.info(f"🏁 Reached last page according to pagination info: {current_page}/{total_pages}")
-                    break
-                
-                # Check if we've fetched all expected records
-                if len(all_records) >= count:
-                    logger.info(f"✅ Fetched all expected records: {len(all_records)}/{count}")
-                    break
-                
-                # Fallback: if records less than expected per page, might be last page
-                # But only if we've fetched at least one full page
-                if len(records) < 21 and page > 1:
-                    logger.warning(f"⚠️ Got {len(records)} records (less than 21) on page {page}. Expected {count} total, got {len(all_records)}. Continuing...")
-                    # Don't break, continue to make sure
-                
-                page += 1
-                time.sleep(0.5)  # تاخیر کوتاه برای جلوگیری از rate limiting
-            
-            logger.info(f"📊 Finished fetching. Total: {len(all_records)}/{count} records")
-            return all_records
+            yield from self.iter_pages(
+                start_str, end_str, province_id, township_id,
+                expected_count=count,
+                should_stop=should_stop
+            )
+            return
         
         # اگر تعداد بیشتر از حد مجاز بود، بازه را تقسیم می‌کنیم
         duration = end_date - start_date
@@ -641,183 +821,304 @@ class MojavezCrawler:
             if not province_id:
                 # دریافت لیست استان‌ها و کراول کردن هر کدام
                 provinces = self.get_provinces()
-                all_records = []
                 
                 for prov in provinces:
+                    if should_stop and should_stop():
+                        return
                     prov_id = prov.get('id')
                     prov_name = prov.get('name', '')
                     logger.info(f"🌍 Crawling province: {prov_name} (ID: {prov_id})")
-                    records = self.crawl_date_range(
+                    yield from self.iter_date_range(
                         start_date, end_date, province_id=prov_id,
-                        progress_callback=progress_callback,
-                        save_callback=save_callback
+                        should_stop=should_stop
                     )
-                    all_records.extend(records)
-                    time.sleep(1)
+            elif not township_id:
+                # اگر استان مشخص است، بر اساس شهر تقسیم می‌کنیم
+                cities = self.get_cities(province_id)
                 
-                return all_records
+                for city_obj in cities:
+                    if should_stop and should_stop():
+                        return
+                    city_id = city_obj.get('id')
+                    city_name = city_obj.get('name', '')
+                    logger.info(f"🏙️ Crawling city: {city_name} (ID: {city_id})")
+                    yield from self.iter_date_range(
+                        start_date, end_date, province_id=province_id, township_id=city_id,
+                        should_stop=should_stop
+                    )
             else:
-                # اگر استان مشخص است، بر اساس شهر تقسیم می‌کنیم
-                if not township_id:
-                    cities = self.get_cities(province_id)
-                    all_records = []
-                    
-                    for city_obj in cities:
-                        city_id = city_obj.get('id')
-                        city_name = city_obj.get('name', '')
-                        logger.info(f"🏙️ Crawling city: {city_name} (ID: {city_id})")
-                        records = self.crawl_date_range(
-                            start_date, end_date, province_id=province_id, township_id=city_id,
-                            progress_callback=progress_callback,
-                            save_callback=save_callback
-                        )
-                        all_records.extend(records)
-                        time.sleep(1)
-                    
-                    return all_records
-                else:
-                    # اگر شهر هم مشخص است و هنوز زیاد است، روز را به ساعت تقسیم می‌کنیم
+                # اگر شهر هم مشخص است و هنوز زیاد است، روز را به بازه‌های ساعتی جدا از هم تقسیم می‌کنیم
+                template = self.get_subday_format(start_date, count, province_id, township_id)
+                if template:
                     logger.warning(f"⚠️ One-day range with specific city still too large ({count} records)! Splitting by hours...")
-                    
-                    # تقسیم روز به ساعت (هر 6 ساعت یک بازه)
-                    all_records = []
-                    current_time = start_date
-                    hours_per_chunk = 6
-                    
-                    while current_time < end_date:
-                        chunk_end = min(current_time + timedelta(hours=hours_per_chunk), end_date)
-                        
-                        chunk_start_str = format_date_for_api(current_time)
-                        chunk_end_str = format_date_for_api(chunk_end)
-                        
-                        logger.info(f"⏰ Crawling hour range: {chunk_start_str} to {chunk_end_str}")
-                        
-                        # بررسی تعداد رکوردها در این بازه
-                        chunk_count = self.get_records_count(chunk_start_str, chunk_end_str, province_id, township_id)
-                        
-                        if chunk_count <= self.MAX_RECORDS_PER_REQUEST:
-                            # اگر کمتر از حد مجاز بود، مستقیماً دریافت می‌کنیم
-                            chunk_records = self.fetch_records_with_pagination(
-                                chunk_start_str, chunk_end_str, province_id, township_id
-                            )
-                            # Annotate with location IDs
-                            for r in chunk_records:
-                                if province_id is not None:
-                                    r['province_id'] = province_id
-                                if township_id is not None:
-                                    r['township_id'] = township_id
-                            all_records.extend(chunk_records)
-                            
-                            # Save records immediately
-                            if save_callback:
-                                saved = save_callback(chunk_records)
-                                if saved > 0:
-                                    logger.info(f"💾 Saved {saved} records from hour chunk to database")
-                            
-                            # Update progress (after saving to ensure DB is updated)
-                            if progress_callback:
-                                progress_callback(len(all_records), 0, 0)
-                        else:
-                            # اگر هنوز زیاد بود، بازه را کوچکتر می‌کنیم (هر 1 ساعت)
-                            logger.warning(f"⚠️ Hour range still too large ({chunk_count} records)! Splitting to 1-hour chunks...")
-                            hour_start = current_time
-                            
-                            while hour_start < chunk_end:
-                                hour_end = min(hour_start + timedelta(hours=1), chunk_end)
-                                hour_start_str = format_date_for_api(hour_start)
-                                hour_end_str = format_date_for_api(hour_end)
-                                
-                                logger.info(f"⏰ Crawling 1-hour range: {hour_start_str} to {hour_end_str}")
-                                
-                                hour_records = self.fetch_records_with_pagination(
-                                    hour_start_str, hour_end_str, province_id, township_id
-                                )
-                                # Annotate with location IDs
-                                for r in hour_records:
-                                    if province_id is not None:
-                                        r['province_id'] = province_id
-                                    if township_id is not None:
-                                        r['township_id'] = township_id
-                                all_records.extend(hour_records)
-                                
-                                # Save records immediately
-                                if save_callback:
-                                    saved = save_callback(hour_records)
-                                    if saved > 0:
-                                        logger.info(f"💾 Saved {saved} records from 1-hour chunk to database")
-                                
-                                # Update progress
-                                if progress_callback:
-                                    progress_callback(len(all_records), 0, 0)
-                                
-                                hour_start = hour_end
-                                time.sleep(0.5)
-                        
-                        current_time = chunk_end
-                        time.sleep(0.5)
-                    
-                    return all_records
-        
-        # تقسیم بازه زمانی
-        ranges = self.split_date_range(start_date, end_date)
-        all_records = []
+                    resolution = subday_resolution(template)
+                    day_start, day_end = day_bounds(start_date, resolution)
+                    yield from self.iter_time_range(
+                        day_start, day_end, province_id, township_id, template,
+                        total=count, should_stop=should_stop
+                    )
+                else:
+                    # بدون فرمت زیرروزی هر «ساعت» همان کل روز است؛ فقط یک بار (تا سقف سرور) دریافت می‌شود
+                    logger.error(
+                        f"❌ One-day range with specific city has {count} records and cannot be split; "
+                        f"only the first {self.MAX_RECORDS_PER_REQUEST} will be fetched"
+                    )
+                    yield from self.iter_pages(
+                        start_str, end_str, province_id, township_id,
+                        expected_count=count,
+                        should_stop=should_stop
+                    )
+            return
+        
+        # تقسیم بازه زمانی بر اساس count و تراکم تاریخی (یا یکنواخت)
+        ranges = self.split_date_range_by_density(start_date, end_date, count, daily_density)
         
         for range_start, range_end in ranges:
-            records = self.crawl_date_range(
+            if should_stop and should_stop():
+                return
+            yield from self.iter_date_range(
                 range_start, range_end, province_id, township_id,
-                progress_callback=progress_callback,
-                save_callback=save_callback
+                should_stop=should_stop,
+                daily_density=daily_density
             )
-            all_records.extend(records)
-            time.sleep(1)
-        
-        return all_records
     
+    def iter_time_range(
+        self,
+        start: datetime,
+        end: datetime,
+        province_id: Optional[int],
+        township_id: Optional[int],
+        template: str,
+        total: Optional[int] = None,
+        should_stop: Optional[callable] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        کراول بازه زمانی زیرروزی [start, end] با نصف کردن تا زیر سقف رسیدن هر تکه
+        
+        Args:
+            start / end: لحظه شروع و پایان (شامل)
+            template: فرمت زیرروزی (خروجی get_subday_format)
+            total: تعداد رکورد بازه اگر از قبل معلوم است
+        
+        Yields:
+            آیتم‌های iter_pages
+        """
+        start_str = format_datetime_for_api(start, template)
+        end_str = format_datetime_for_api(end, template)
+        if total is None:
+            total = self.get_records_count(start_str, end_str, province_id, township_id)
+        
+        halves = None
+        if total > self.MAX_RECORDS_PER_REQUEST:
+            halves = split_time_range(start, end, subday_resolution(template))
+            if not halves:
+                logger.error(f"❌ Time range {start_str} - {end_str} still has {total} records and cannot be split")
+        
+        if not halves:
+            logger.info(f"⏰ Crawling time range: {start_str} to {end_str} ({total} records)")
+            yield from self.iter_pages(
+                start_str, end_str, province_id, township_id,
+                expected_count=total,
+                should_stop=should_stop
+            )
+            return
+        
+        for half_start, half_end in halves:
+            if should_stop and should_stop():
+                return
+            yield from self.iter_time_range(
+                half_start, half_end, province_id, township_id, template,
+                should_stop=should_stop
+            )
     
     def fetch_records_with_pagination(
         self,
         start_date: str,
         end_date: str,
         province_id: Optional[int] = None,
-        township_id: Optional[int] = None
+        township_id: Optional[int] = None,
+        save_callback: Optional[callable] = None,
+        progress_callback: Optional[callable] = None,
+        start_page: int = 1,
+        expected_count: Optional[int] = None,
+        should_stop: Optional[callable] = None,
+        collect: Optional[bool] = None,
+        filters: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
         """
         دریافت رکوردها با pagination کامل
         
+        روی iter_pages ساخته شده است و save_callback / progress_callback برای هر صفحه
+        در همین thread و به ترتیب صفحه صدا زده می‌شوند.
+        
         Args:
             start_date: تاریخ شروع (فرمت: YYYY/M/D)
             end_date: تاریخ پایان (فرمت: YYYY/M/D)
             province_id: شناسه استان (اختیاری)
             township_id: شناسه شهر (اختیاری)
+            save_callback: ذخیره رکوردهای هر صفحه (تعداد ذخیره‌شده را برمی‌گرداند)
+            progress_callback: progress_callback(fetched_count, page, total_pages)
+            start_page: صفحه شروع (برای ادامه از checkpoint)
+            expected_count: تعداد مورد انتظار، برای تخمین total_pages اگر pagination نیامد
+            should_stop: اگر True برگرداند دریافت صفحات بعدی متوقف می‌شود (مثلاً لغو job)
+            collect: نگه داشتن رکوردها برای خروجی (پیش‌فرض: فقط بدون save_callback)
+            filters: فیلترهای partition (main_org_code، sub_org_code، title)
             
         Returns:
-            لیست تمام رکوردها
+            لیست تمام رکوردها (اگر collect)
         """
-        all_records = []
-        page = 1
+        return self._consume_pages(
+            self.iter_pages(
+                start_date, end_date, province_id, township_id,
+                start_page=start_page,
+                expected_count=expected_count,
+                should_stop=should_stop,
+                filters=filters
+            ),
+            save_callback=save_callback,
+            progress_callback=progress_callback,
+            collect=collect
+        )
+    
+    def iter_pages(
+        self,
+        start_date: str,
+        end_date: str,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None,
+        start_page: int = 1,
+        expected_count: Optional[int] = None,
+        should_stop: Optional[callable] = None,
+        skip_pages: Optional[Iterable[int]] = None,
+        filters: Optional[Dict[str, Any]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        صفحات یک پنجره را به ترتیب yield می‌کند
+        
+        صفحه اول به تنهایی گرفته می‌شود تا total_pages مشخص شود. اگر max_concurrency
+        بیشتر از 1 باشد، بقیه صفحات از طریق AsyncMojavezCrawler همزمان درخواست می‌شوند؛
+        فقط یک پنجره لغزان (2 × max_concurrency صفحه) جلوتر از مصرف‌کننده در جریان است
+        تا حافظه به اندازه پنجره محدود بماند.
+        
+        صفحات skip_pages (مثلاً صفحات checkpoint‌شده یک پنجره) درخواست نمی‌شوند؛ اولین صفحه
+        باقیمانده نقش صفحه اول را برای تعیین total_pages دارد.
+        
+        filters (main_org_code، sub_org_code، title) برای پنجره‌هایی است که CrawlPlanner روی
+        این محورها تقسیم کرده است (partitioning.py).
+        
+        صفحه‌ای که دریافتش خطا داد (نه صفحه خالی) یک بار دیگر درخواست می‌شود و اگر باز خطا داد
+        PageFetchError بالا می‌رود تا پنجره از آخرین checkpoint دوباره اجرا شود، نه اینکه صفحه
+        بی‌صدا جا بیفتد.
+        
+        Yields:
+            {'start_date', 'end_date', 'province_id', 'township_id', 'page', 'total_pages', 'total', 'records'}
+            total: تعداد کل رکوردهای فیلتر طبق pagination همان صفحه
+        """
+        def page_item(page: int, result: Dict[str, Any], total_pages: int) -> Dict[str, Any]:
+            records = self._annotate_location(result.get('records', []), province_id, township_id)
+            logger.info(f"✅ Fetched {len(records)} records from page {page}")
+            return {
+                'start_date': start_date,
+                'end_date': end_date,
+                'province_id': province_id,
+                'township_id': township_id,
+                'page': page,
+                'total_pages': total_pages,
+                'total': result.get('pagination', {}).get('total', 0),
+                'records': records,
+            }
+        
+        def checked(page: int, result: Dict[str, Any]) -> Dict[str, Any]:
+            if not result.get('error'):
+                return result
+            logger.warning(f"⚠️ Page {page} failed ({result['error']}); fetching it again")
+            result = self.fetch_records(start_date, end_date, province_id, township_id, page=page, filters=filters)
+            if result.get('error'):
+                raise PageFetchError(page, result['error'])
+            return result
+        
+        skip = set(skip_pages or ())
+        while start_page in skip:
+            start_page += 1
+        if skip:
+            logger.info(f"⏭️ Skipping {len(skip)} checkpointed pages, first page to fetch: {start_page}")
         
+        first = checked(start_page, self.fetch_records(
+            start_date, end_date, province_id, township_id, page=start_page, filters=filters
+        ))
+        if not first.get('records'):
+            logger.info(f"ℹ️ No records on page {start_page}")
+            return
+        
+        pagination = first.get('pagination', {})
+        total_pages = pagination.get('total_pages', 0)
+        if total_pages == 0 and expected_count:
+            total_pages = (expected_count + self.PAGE_SIZE - 1) // self.PAGE_SIZE
+        yield page_item(start_page, first, total_pages)
+        
+        if total_pages <= start_page:
+            return
+        
+        if self.max_concurrency > 1:
+            # Fan-out با پنجره لغزان: Semaphore کلاینت async تعداد درخواست‌های در جریان را
+            # محدود می‌کند و این صف تعداد صفحات دریافت‌شده ولی مصرف‌نشده را.
+            client = self._get_async_client()
+            pages = iter([page for page in range(start_page + 1, total_pages + 1) if page not in skip])
+            in_flight = deque()
+            
+            def submit_next() -> bool:
+                page = next(pages, None)
+                if page is None:
+                    return False
+                in_flight.append((page, self._submit_async(
+                    client.fetch_records(start_date, end_date, province_id, township_id, page=page, filters=filters)
+                )))
+                return True
+            
+            for _ in range(self.max_concurrency * 2):
+                if not submit_next():
+                    break
+            logger.info(f"🚀 Dispatching pages {start_page + 1}..{total_pages} (max {self.max_concurrency} in flight)")
+            try:
+                while in_flight:
+                    page, future = in_flight[0]
+                    if should_stop and should_stop():
+                        logger.warning(f"⚠️ Stopped before page {page}/{total_pages}")
+                        break
+                    result = future.result()
+                    in_flight.popleft()
+                    submit_next()
+                    result = checked(page, result)
+                    if not result.get('records'):
+                        logger.warning(f"⚠️ No records on page {page}/{total_pages}")
+                        continue
+                    yield page_item(page, result, total_pages)
+            finally:
+                for _, future in in_flight:
+                    future.cancel()
+            return
+        
+        page = start_page + 1
         while True:
-            result = self.fetch_records(
-                start_date, end_date, province_id, township_id,
-                page=page
-            )
+            if should_stop and should_stop():
+                logger.warning(f"⚠️ Stopped before page {page}")
+                break
             
-            # Handle new response structure
-            if isinstance(result, dict):
-                records = result.get('records', [])
-                pagination = result.get('pagination', {})
-            else:
-                records = result if result else []
-                pagination = {}
+            result = checked(page, self.fetch_records(
+                start_date, end_date, province_id, township_id,
+                page=page,
+                filters=filters
+            ))
+            records = result.get('records', [])
+            pagination = result.get('pagination', {})
             
             if not records:
                 break
             
-            all_records.extend(records)
-            logger.info(f"✅ Fetched {len(records)} records from page {page} (Total: {len(all_records)})")
+            yield page_item(page, result, total_pages)
             
             # Check if we've reached the last page
-            total_pages = pagination.get('total_pages', 0)
+            total_pages = pagination.get('total_pages', 0) or total_pages
             current_page = pagination.get('current_page', page)
             
             if total_pages > 0 and current_page >= total_pages:
@@ -828,10 +1129,63 @@ class MojavezCrawler:
                 break
             
             page += 1
-            time.sleep(0.5)
+            while page in skip:
+                page += 1
+    
+    def _consume_pages(
+        self,
+        pages: Iterable[Dict[str, Any]],
+        save_callback: Optional[callable] = None,
+        progress_callback: Optional[callable] = None,
+        collect: Optional[bool] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        اجرای callbackها روی صفحات iter_pages / iter_date_range
+        
+        Returns:
+            رکوردها اگر collect (پیش‌فرض: وقتی save_callback نیست)، وگرنه لیست خالی
+        """
+        if collect is None:
+            collect = save_callback is None
+        all_records = []
+        fetched = 0
+        
+        for item in pages:
+            records = item['records']
+            fetched += len(records)
+            if collect:
+                all_records.extend(records)
+            
+            # Save records immediately via callback
+            if save_callback and records:
+                saved = save_callback(records)
+                if saved > 0:
+                    logger.info(f"💾 Saved {saved} records from page {item['page']} to database")
+            
+            # Update progress via callback (after saving to ensure DB is updated)
+            if progress_callback:
+                progress_callback(fetched, item['page'], item['total_pages'])
         
+        logger.info(f"📊 Finished fetching. Total: {fetched} records")
         return all_records
     
+    def _annotate_location(
+        self,
+        records: List[Dict[str, Any]],
+        province_id: Optional[int],
+        township_id: Optional[int]
+    ) -> List[Dict[str, Any]]:
+        """
+        Annotate records with current location IDs so downstream
+        consumers (مثل Django jobs app) بتوانند province_id/township_id را ذخیره کنند
+        """
+        for r in records:
+            if province_id is not None:
+                r['province_id'] = province_id
+            if township_id is not None:
+                r['township_id'] = township_id
+        return records
+    
     def save_to_json(self, records: List[Dict], filename: str):
         """
         ذخیره رکوردها در فایل JSON
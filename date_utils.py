@@ -2,8 +2,8 @@
 ابزارهای تبدیل تاریخ
 """
 
-from datetime import datetime
-from typing import Optional
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
 
 
 def convert_date_format(date_str: str, from_format: str = "YYYY-MM-DD", to_format: str = "YYYY/M/D") -> str:
@@ -60,29 +60,98 @@ def parse_api_date(date_str: str) -> Optional[datetime]:
     تبدیل رشته تاریخ API به datetime
     
     Args:
-        date_str: رشته تاریخ به فرمت YYYY/M/D
+        date_str: رشته تاریخ به فرمت YYYY/M/D؛ رشته‌های زیرروزی (SUBDAY_FORMATS) هم پذیرفته می‌شوند
     
     Returns:
         datetime object یا None در صورت خطا
     """
     try:
+        date_str = date_str.strip()
+        time_part = None
+        for separator in (' ', 'T'):
+            if separator in date_str:
+                date_str, time_part = date_str.split(separator, 1)
+                break
+        date_str = date_str.replace('-', '/')
+        
+        parsed = None
         # فرمت‌های مختلف را امتحان می‌کنیم
         formats = ["%Y/%m/%d", "%Y/%m/%d", "%Y/%#m/%#d"]  # # برای Windows
         
         for fmt in formats:
             try:
-                return datetime.strptime(date_str, fmt)
+                parsed = datetime.strptime(date_str, fmt)
+                break
             except:
                 continue
         
-        # اگر هیچکدام کار نکرد، دستی parse می‌کنیم
-        parts = date_str.split("/")
-        if len(parts) == 3:
-            year = int(parts[0])
-            month = int(parts[1])
-            day = int(parts[2])
-            return datetime(year, month, day)
+        if parsed is None:
+            # اگر هیچکدام کار نکرد، دستی parse می‌کنیم
+            parts = date_str.split("/")
+            if len(parts) == 3:
+                year = int(parts[0])
+                month = int(parts[1])
+                day = int(parts[2])
+                parsed = datetime(year, month, day)
+        
+        if parsed is not None and time_part:
+            clock = [int(part) for part in time_part.split(':')]
+            parsed = parsed.replace(hour=clock[0], minute=clock[1], second=clock[2] if len(clock) > 2 else 0)
+        return parsed
     except:
         pass
     
     return None
+
+
+# فرمت‌های زیرروزی که برای last_op_start_date / last_op_end_date امتحان می‌شوند (به ترتیب)
+SUBDAY_FORMATS = (
+    '{y}/{m}/{d} {H:02d}:{M:02d}:{S:02d}',
+    '{y}/{m:02d}/{d:02d} {H:02d}:{M:02d}:{S:02d}',
+    '{y}-{m:02d}-{d:02d} {H:02d}:{M:02d}:{S:02d}',
+    '{y}-{m:02d}-{d:02d}T{H:02d}:{M:02d}:{S:02d}',
+    '{y}/{m}/{d} {H:02d}:{M:02d}',
+)
+
+
+def format_datetime_for_api(date: datetime, template: str) -> str:
+    """
+    تبدیل datetime به رشته زیرروزی API
+    
+    Args:
+        date: datetime object
+        template: یکی از SUBDAY_FORMATS
+    
+    Returns:
+        رشته تاریخ و ساعت (مثلاً 1404/1/5 12:00:00)
+    """
+    return template.format(y=date.year, m=date.month, d=date.day, H=date.hour, M=date.minute, S=date.second)
+
+
+def subday_resolution(template: str) -> timedelta:
+    """کوچک‌ترین گام زمانی قابل بیان با template (ثانیه یا دقیقه)"""
+    return timedelta(seconds=1) if '{S' in template else timedelta(minutes=1)
+
+
+def day_bounds(date: datetime, resolution: timedelta = timedelta(seconds=1)) -> Tuple[datetime, datetime]:
+    """اولین و آخرین لحظه (شامل) یک روز با دقت resolution"""
+    start = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, start + timedelta(days=1) - resolution
+
+
+def split_time_range(
+    start: datetime,
+    end: datetime,
+    resolution: timedelta = timedelta(seconds=1)
+) -> Optional[List[Tuple[datetime, datetime]]]:
+    """
+    نصف کردن یک بازه زمانی شامل [start, end] به دو بازه جدا از هم
+    
+    Returns:
+        [(start, mid - resolution), (mid, end)] یا None اگر بازه کوچک‌تر از دو گام باشد
+    """
+    steps = int((end - start) / resolution) + 1
+    if steps < 2:
+        return None
+    mid = start + resolution * (steps // 2)
+    return [(start, mid - resolution), (mid, end)]
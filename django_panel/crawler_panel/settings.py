@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 
 from pathlib import Path
+import json
 import os
 from dotenv import load_dotenv
 from django.core.exceptions import ImproperlyConfigured
@@ -202,6 +203,87 @@ CELERY_KNOWN_WORKERS = [
     if name.strip()
 ]
 
+# Crawler Configuration
+# حداکثر تعداد درخواست همزمان به سرور mojavez در هر تسک (مسیر async)
+CRAWLER_MAX_CONCURRENCY = int(os.getenv('CRAWLER_MAX_CONCURRENCY', '8'))
+# سقف درخواست در ثانیه به سرور mojavez (0 = بدون محدودیت) و ظرفیت burst؛ با CRAWLER_REDIS_URL سقف کل ورکرهاست
+# و بدون آن سقف هر پروسه. در حالت adaptive این نرخ اولیه است و بین MIN و MAX به روش AIMD تنظیم می‌شود.
+CRAWLER_RATE_LIMIT = float(os.getenv('CRAWLER_RATE_LIMIT', '10'))
+CRAWLER_RATE_LIMIT_BURST = int(os.getenv('CRAWLER_RATE_LIMIT_BURST', '0'))
+CRAWLER_RATE_LIMIT_ADAPTIVE = os.getenv('CRAWLER_RATE_LIMIT_ADAPTIVE', 'True') == 'True'
+CRAWLER_RATE_LIMIT_MIN = float(os.getenv('CRAWLER_RATE_LIMIT_MIN', '1'))
+CRAWLER_RATE_LIMIT_MAX = float(os.getenv('CRAWLER_RATE_LIMIT_MAX', '50'))
+# افزایش نرخ (درخواست/ثانیه) به ازای هر ثانیه پاسخ موفق، و پاسخ کندتر از این (ثانیه) نرخ را کم می‌کند
+CRAWLER_RATE_LIMIT_INCREASE = float(os.getenv('CRAWLER_RATE_LIMIT_INCREASE', '1'))
+CRAWLER_RATE_LIMIT_SLOW_SECONDS = float(os.getenv('CRAWLER_RATE_LIMIT_SLOW_SECONDS', '20'))
+# سیاست retry هر query: حداکثر تلاش و backoff با jitter (ثانیه)، و سقف کل retry هر جاب (0 = بدون سقف)
+CRAWLER_RETRY_MAX_ATTEMPTS = int(os.getenv('CRAWLER_RETRY_MAX_ATTEMPTS', '5'))
+CRAWLER_RETRY_BASE_DELAY = float(os.getenv('CRAWLER_RETRY_BASE_DELAY', '1'))
+CRAWLER_RETRY_MAX_DELAY = float(os.getenv('CRAWLER_RETRY_MAX_DELAY', '30'))
+CRAWLER_JOB_RETRY_BUDGET = int(os.getenv('CRAWLER_JOB_RETRY_BUDGET', '1000'))
+# circuit breaker: بعد از این تعداد خطای پشت سر هم، همه درخواست‌ها این مدت (ثانیه) متوقف می‌شوند (0 = غیرفعال)
+CRAWLER_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('CRAWLER_CIRCUIT_FAILURE_THRESHOLD', '10'))
+CRAWLER_CIRCUIT_RECOVERY_SECONDS = float(os.getenv('CRAWLER_CIRCUIT_RECOVERY_SECONDS', '30'))
+# connection pool مشترک هر پروسه ورکر: حداکثر اتصال به ازای host، عمر اتصال بیکار (ثانیه) و پاسخ فشرده
+CRAWLER_HTTP_POOL_SIZE = int(os.getenv('CRAWLER_HTTP_POOL_SIZE', '50'))
+CRAWLER_HTTP_KEEPALIVE_SECONDS = float(os.getenv('CRAWLER_HTTP_KEEPALIVE_SECONDS', '30'))
+CRAWLER_HTTP_COMPRESSION = os.getenv('CRAWLER_HTTP_COMPRESSION', 'True') == 'True'
+# فرمت زیرروزی last_op_start_date / last_op_end_date برای تقسیم روزهای پرتراکم یک شهر به ساعت‌ها:
+# 'auto' = تشخیص با probe، 'off' = غیرفعال، یا یک template از date_utils.SUBDAY_FORMATS
+CRAWLER_SUBDAY_FORMAT = os.getenv('CRAWLER_SUBDAY_FORMAT', 'auto')
+# محورهای تقسیم پنجره‌هایی که بعد از شهر و ساعت هنوز بیش از 2100 رکورد دارند (partitioning.py):
+# کدهای main_org_code با کاما. API لیست سازمان‌ها را برنمی‌گرداند و رکوردها کد سازمان ندارند، پس تقسیم
+# بر اساس سازمان فقط با همین تنظیم فعال می‌شود (خالی = غیرفعال)
+CRAWLER_PARTITION_ORG_CODES = [
+    int(code) if code.strip().isdigit() else code.strip()
+    for code in os.getenv('CRAWLER_PARTITION_ORG_CODES', '').split(',') if code.strip()
+]
+# کدهای sub_org_code هر سازمان به صورت JSON، مثلاً {"12": [1201, 1202]} (خالی = فقط main_org_code)
+CRAWLER_PARTITION_SUB_ORG_CODES = {
+    int(code) if str(code).isdigit() else code: list(sub_codes)
+    for code, sub_codes in json.loads(os.getenv('CRAWLER_PARTITION_SUB_ORG_CODES') or '{}').items()
+}
+# حروف پیشوند عنوان مجوز ('' = فقط پیشوندهای عنوان‌های موجود در دیتابیس) و حداکثر طول پیشوند
+CRAWLER_PARTITION_TITLE_ALPHABET = os.getenv('CRAWLER_PARTITION_TITLE_ALPHABET', 'آابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی')
+CRAWLER_PARTITION_TITLE_MAX_LENGTH = int(os.getenv('CRAWLER_PARTITION_TITLE_MAX_LENGTH', '3'))
+# audit کامل بودن پنجره‌ها در پایان جاب: کمبود قابل قبول (رکورد) و حداکثر دفعات دریافت دوباره خودکار هر پنجره
+CRAWLER_AUDIT_TOLERANCE = int(os.getenv('CRAWLER_AUDIT_TOLERANCE', '0'))
+CRAWLER_AUDIT_MAX_REFETCHES = int(os.getenv('CRAWLER_AUDIT_MAX_REFETCHES', '2'))
+# کراول افزایشی (mode='incremental'): تعداد روزهای اخیر قبل از watermark که دوباره شمرده می‌شوند
+# (رکوردهایی که دیر منتشر یا ویرایش می‌شوند)؛ روزهای قدیمی‌تر دوباره درخواست نمی‌شوند
+CRAWLER_INCREMENTAL_LOOKBACK_DAYS = int(os.getenv('CRAWLER_INCREMENTAL_LOOKBACK_DAYS', '7'))
+# کش تعداد رکوردها (CountCacheEntry): عمر ورودی‌های بازه‌های اخیر (ثانیه)
+CRAWLER_COUNT_CACHE_TTL = int(os.getenv('CRAWLER_COUNT_CACHE_TTL', str(6 * 60 * 60)))
+# بازه‌هایی که بیش از این تعداد روز از پایانشان گذشته تغییرناپذیر فرض می‌شوند
+CRAWLER_COUNT_CACHE_IMMUTABLE_AFTER_DAYS = int(os.getenv('CRAWLER_COUNT_CACHE_IMMUTABLE_AFTER_DAYS', '7'))
+# Redis مشترک بین ورکرها برای کش‌ها و هماهنگی (پیش‌فرض همان Redis بروکر؛ خالی = غیرفعال)
+CRAWLER_REDIS_URL = os.getenv('CRAWLER_REDIS_URL', CELERY_BROKER_URL)
+# کش استان/شهر: فایل JSON محلی و عمر داده (ثانیه) قبل از refresh
+CRAWLER_REFERENCE_DATA_PATH = os.getenv('CRAWLER_REFERENCE_DATA_PATH', str(BASE_DIR / 'reference_data.json'))
+CRAWLER_REFERENCE_DATA_TTL = int(os.getenv('CRAWLER_REFERENCE_DATA_TTL', str(24 * 60 * 60)))
+# Write-behind رکوردها: ظرفیت صف (صفحه) قبل از backpressure و حداکثر رکورد در هر bulk insert
+CRAWLER_WRITER_QUEUE_PAGES = int(os.getenv('CRAWLER_WRITER_QUEUE_PAGES', '64'))
+CRAWLER_WRITER_BATCH_RECORDS = int(os.getenv('CRAWLER_WRITER_BATCH_RECORDS', '2000'))
+# نوشتن پیشرفت جاب: حداکثر هر چند ثانیه یا هر چند دسته ذخیره‌شده
+CRAWLER_PROGRESS_INTERVAL = float(os.getenv('CRAWLER_PROGRESS_INTERVAL', '5'))
+CRAWLER_PROGRESS_BATCHES = int(os.getenv('CRAWLER_PROGRESS_BATCHES', '50'))
+# دریافت جزئیات: تعداد رکورد در هر دسته همزمان (هر دسته با یک bulk_create ذخیره می‌شود)
+CRAWLER_DETAIL_BATCH_SIZE = int(os.getenv('CRAWLER_DETAIL_BATCH_SIZE', '200'))
+# سقف تعداد مجوز در هر query دسته‌ای GraphQL (alias)؛ اندازه واقعی بین 1 و این مقدار خودکار تنظیم می‌شود
+CRAWLER_DETAIL_QUERY_BATCH_SIZE = int(os.getenv('CRAWLER_DETAIL_QUERY_BATCH_SIZE', '50'))
+# تعداد shardهای دریافت جزئیات هر جاب (0 = تعداد ورکرهای آنلاین × CELERY_WORKER_CONCURRENCY)
+CRAWLER_DETAIL_SHARDS = int(os.getenv('CRAWLER_DETAIL_SHARDS', '0'))
+# رزرو رکورد توسط یک shard بعد از این مدت (ثانیه) منقضی می‌شود تا shard دیگری آن را بردارد
+CRAWLER_DETAIL_CLAIM_TTL = int(os.getenv('CRAWLER_DETAIL_CLAIM_TTL', '600'))
+
+# Periodic tasks (celery -A crawler_panel beat)
+CELERY_BEAT_SCHEDULE = {
+    'refresh-reference-data': {
+        'task': 'jobs.tasks.refresh_reference_data',
+        'schedule': CRAWLER_REFERENCE_DATA_TTL,
+    },
+}
+
 # Django REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -2,7 +2,7 @@
 Django Admin configuration
 """
 from django.contrib import admin
-from .models import CrawlJob, CrawlRecord
+from .models import CrawlJob, CrawlRecord, CrawlWatermark, CrawlWindow, License, LicenseStatusHistory
 
 
 @admin.register(CrawlJob)
@@ -12,23 +12,23 @@ class CrawlJobAdmin(admin.ModelAdmin):
         'id', 'name', 'status', 'total_records', 'fetched_records',
         'progress_percentage', 'created_at', 'started_at', 'completed_at'
     ]
-    list_filter = ['status', 'created_at', 'started_at']
+    list_filter = ['status', 'mode', 'created_at', 'started_at']
     search_fields = ['name', 'province_name', 'township_name']
     readonly_fields = [
         'created_at', 'started_at', 'completed_at',
-        'total_records', 'fetched_records', 'progress_percentage',
+        'total_records', 'fetched_records', 'changed_records', 'progress_percentage',
         'current_page', 'total_pages', 'task_id'
     ]
     fieldsets = (
         ('اطلاعات اصلی', {
-            'fields': ('name', 'start_date', 'end_date', 'status')
+            'fields': ('name', 'start_date', 'end_date', 'mode', 'status')
         }),
         ('موقعیت', {
             'fields': ('province_id', 'province_name', 'township_id', 'township_name')
         }),
         ('پیشرفت', {
             'fields': (
-                'total_records', 'fetched_records', 'progress_percentage',
+                'total_records', 'fetched_records', 'changed_records', 'progress_percentage',
                 'current_page', 'total_pages'
             )
         }),
@@ -54,11 +54,11 @@ class CrawlRecordAdmin(admin.ModelAdmin):
         'organization_title', 'province_title', 'township_title'
     ]
     readonly_fields = ['created_at', 'raw_data']
-    raw_id_fields = ['crawl_job']
+    raw_id_fields = ['crawl_job', 'license']
     
     fieldsets = (
         ('اطلاعات اصلی', {
-            'fields': ('crawl_job', 'request_number', 'applicant_name')
+            'fields': ('crawl_job', 'license', 'request_number', 'applicant_name')
         }),
         ('اطلاعات مجوز', {
             'fields': ('license_title', 'organization_title')
@@ -73,3 +73,43 @@ class CrawlRecordAdmin(admin.ModelAdmin):
             'fields': ('user_image', 'created_at', 'raw_data')
         }),
     )
+
+
+@admin.register(CrawlWindow)
+class CrawlWindowAdmin(admin.ModelAdmin):
+    """Admin برای پنجره‌های کراول"""
+    list_display = [
+        'id', 'crawl_job', 'start_date', 'end_date', 'province_id', 'township_id', 'filters',
+        'status', 'expected_count', 'received_count', 'fetched_records', 'refetch_count', 'attempts', 'completed_at'
+    ]
+    list_filter = ['status']
+    readonly_fields = ['task_id', 'started_at', 'completed_at', 'error_message']
+    raw_id_fields = ['crawl_job']
+
+
+@admin.register(License)
+class LicenseAdmin(admin.ModelAdmin):
+    """Admin برای جدول یکتای مجوزها"""
+    list_display = [
+        'id', 'request_number', 'license_title', 'organization_title', 'status_title', 'last_seen_at', 'changed_at'
+    ]
+    search_fields = ['request_number', 'license_title', 'organization_title']
+    readonly_fields = ['first_seen_at', 'last_seen_at', 'changed_at', 'content_hash', 'raw_data']
+
+
+@admin.register(LicenseStatusHistory)
+class LicenseStatusHistoryAdmin(admin.ModelAdmin):
+    """Admin برای تاریخچه تغییر وضعیت مجوزها"""
+    list_display = ['id', 'license', 'previous_status_slug', 'status_slug', 'responded_at', 'crawl_job', 'observed_at']
+    list_filter = ['status_slug', 'observed_at']
+    search_fields = ['license__request_number']
+    raw_id_fields = ['license', 'crawl_job']
+
+
+@admin.register(CrawlWatermark)
+class CrawlWatermarkAdmin(admin.ModelAdmin):
+    """Admin برای watermark کراول افزایشی"""
+    list_display = ['key', 'province_id', 'township_id', 'synced_until', 'last_job', 'updated_at']
+    search_fields = ['key']
+    readonly_fields = ['updated_at']
+    raw_id_fields = ['last_job']
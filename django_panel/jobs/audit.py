@@ -0,0 +1,172 @@
+"""
+Completeness audit for crawl windows
+مقایسه رکوردهای دریافتی هر پنجره برگ با countFilteredLicenses و آماده کردن دریافت دوباره فقط پنجره‌های ناقص
+"""
+import logging
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from crawler import MojavezCrawler
+from .models import CrawlPageCheckpoint, CrawlWindow
+
+logger = logging.getLogger(__name__)
+
+
+def window_received_count(window_id: int) -> int:
+    """تعداد رکوردهایی که API برای پنجره برگرداند (جمع records_count صفحات checkpoint‌شده)"""
+    return CrawlPageCheckpoint.objects.filter(window_id=window_id).aggregate(
+        total=Sum('records_count')
+    )['total'] or 0
+
+
+def audit_window(
+    window: CrawlWindow,
+    pages: Dict[int, int],
+    page_size: int,
+    max_records: int,
+    tolerance: int = 0
+) -> Dict[str, Any]:
+    """
+    گزارش کامل بودن یک پنجره
+
+    فقط min(expected_count, max_records) رکورد از API قابل دریافت است؛ بقیه پنجره‌های سرریز
+    unreachable گزارش می‌شوند و با دریافت دوباره درست نمی‌شوند. پنجره‌ای که count آن هنوز
+    نامعلوم است (count_unknown) هیچ‌وقت کامل حساب نمی‌شود.
+
+    Args:
+        window: نمونه CrawlWindow
+        pages: {page: records_count} صفحات checkpoint‌شده پنجره
+        page_size: تعداد رکورد هر صفحه کامل
+        max_records: سقف رکورد قابل دریافت از یک فیلتر
+        tolerance: کمبود قابل قبول (مثلاً برای رکوردهایی که بین count و دریافت حذف شده‌اند)
+
+    Returns:
+        دیکشنری شامل expected / received / missing، صفحات جاافتاده (missing_pages) و صفحات
+        ناقص غیرآخر (short_pages)
+    """
+    count_unknown = window.expected_count is None
+    expected = window.expected_count or 0
+    reachable = min(expected, max_records)
+    expected_pages = (reachable + page_size - 1) // page_size
+    received = sum(pages.values())
+    return {
+        'window_id': window.id,
+        'start_date': window.start_date,
+        'end_date': window.end_date,
+        'province_id': window.province_id,
+        'township_id': window.township_id,
+        'filters': window.filters,
+        'status': window.status,
+        'expected': expected,
+        'count_unknown': count_unknown,
+        'received': received,
+        'missing': max(0, reachable - received),
+        'unreachable': expected - reachable,
+        'missing_pages': [page for page in range(1, expected_pages + 1) if page not in pages],
+        'short_pages': sorted(page for page, count in pages.items() if page < expected_pages and count < page_size),
+        'refetch_count': window.refetch_count,
+        'complete': not count_unknown and received >= reachable - tolerance,
+    }
+
+
+def audit_job(
+    job,
+    page_size: Optional[int] = None,
+    max_records: Optional[int] = None,
+    tolerance: Optional[int] = None
+) -> Dict[str, Any]:
+    """
+    گزارش کامل بودن همه پنجره‌های یک جاب (دو query، مستقل از تعداد پنجره‌ها)
+
+    پیش‌فرض‌ها: PAGE_SIZE و MAX_RECORDS_PER_REQUEST کراولر و CRAWLER_AUDIT_TOLERANCE.
+
+    Returns:
+        {'windows', 'complete', 'unfinished', 'expected', 'received', 'missing', 'unreachable',
+         'count_unknown', 'under_filled': [...], 'overflow': [...], 'audited_at'}
+        under_filled فقط پنجره‌های completed ناقص را دارد؛ پنجره‌های ناتمام در unfinished شمرده می‌شوند.
+    """
+    page_size = page_size or MojavezCrawler.PAGE_SIZE
+    max_records = max_records or MojavezCrawler.MAX_RECORDS_PER_REQUEST
+    tolerance = settings.CRAWLER_AUDIT_TOLERANCE if tolerance is None else tolerance
+
+    pages: Dict[int, Dict[int, int]] = {}
+    checkpoints = CrawlPageCheckpoint.objects.filter(window__crawl_job=job).values_list(
+        'window_id', 'page', 'records_count'
+    )
+    for window_id, page, count in checkpoints:
+        pages.setdefault(window_id, {})[page] = count
+
+    report = {
+        'windows': 0,
+        'complete': 0,
+        'unfinished': 0,
+        'expected': 0,
+        'received': 0,
+        'missing': 0,
+        'unreachable': 0,
+        'count_unknown': 0,
+        'under_filled': [],
+        'overflow': [],
+        'audited_at': timezone.now().isoformat(),
+    }
+    for window in job.windows.all():
+        item = audit_window(window, pages.get(window.id, {}), page_size, max_records, tolerance)
+        report['windows'] += 1
+        report['expected'] += item['expected']
+        report['received'] += item['received']
+        report['unreachable'] += item['unreachable']
+        report['count_unknown'] += item['count_unknown']
+        if item['unreachable']:
+            report['overflow'].append(item)
+        if window.status != 'completed':
+            report['unfinished'] += 1
+            continue
+        report['missing'] += item['missing']
+        if item['complete']:
+            report['complete'] += 1
+        else:
+            report['under_filled'].append(item)
+    return report
+
+
+def prepare_refetch(under_filled: List[Dict[str, Any]], max_refetches: Optional[int] = None) -> List[int]:
+    """
+    آماده کردن پنجره‌های ناقص برای دریافت دوباره هدفمند
+
+    checkpoint صفحات ناقص حذف می‌شود تا crawl_window فقط همان صفحات و صفحات جاافتاده را
+    بگیرد؛ اگر صفحه مشخصی مقصر نباشد کل پنجره دوباره دریافت می‌شود. رکوردهای تکراری را
+    unique (crawl_job, request_number) رد می‌کند.
+
+    Args:
+        under_filled: آیتم‌های under_filled گزارش audit_job
+        max_refetches: پنجره‌هایی که این تعداد بار دوباره دریافت شده‌اند رد می‌شوند (None = بدون سقف)
+
+    Returns:
+        شناسه پنجره‌هایی که pending شدند
+    """
+    window_ids = []
+    for item in under_filled:
+        if max_refetches is not None and item['refetch_count'] >= max_refetches:
+            continue
+        with transaction.atomic():
+            checkpoints = CrawlPageCheckpoint.objects.filter(window_id=item['window_id'])
+            if item['short_pages']:
+                checkpoints.filter(page__in=item['short_pages']).delete()
+            elif not item['missing_pages']:
+                checkpoints.delete()
+            CrawlWindow.objects.filter(id=item['window_id']).update(
+                status='pending',
+                refetch_count=F('refetch_count') + 1,
+                completed_at=None
+            )
+        logger.info(
+            f"🔁 Window {item['window_id']}: received {item['received']} of {item['expected']}, re-fetching "
+            f"{len(item['short_pages'])} short + {len(item['missing_pages'])} missing pages"
+            + ('' if item['short_pages'] or item['missing_pages'] else ' (whole window)')
+        )
+        window_ids.append(item['window_id'])
+    return window_ids
@@ -0,0 +1,184 @@
+"""
+Persistent caches backed by Django models
+کش‌های مشترک بین همه ورکرها که در دیتابیس نگه داشته می‌شوند
+"""
+import logging
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+from count_cache import CountCache
+from rate_limit import configure_rate_limiter, get_rate_limiter
+from resilience import RetryBudget, RetryPolicy, configure_circuit_breaker, get_circuit_breaker
+from transport import configure_transport, get_transport
+from reference_data import configure_reference_data, get_reference_data
+from .models import CountCacheEntry
+
+logger = logging.getLogger(__name__)
+
+_redis_client = None
+_reference_data_configured = False
+_lock = threading.Lock()
+
+
+def get_redis_client():
+    """
+    کلاینت Redis مشترک بین ورکرها (CRAWLER_REDIS_URL)
+    اگر تنظیم نشده باشد یا پکیج redis نصب نباشد None برمی‌گرداند.
+    """
+    global _redis_client
+    if not settings.CRAWLER_REDIS_URL:
+        return None
+    with _lock:
+        if _redis_client is None:
+            try:
+                import redis
+            except ImportError:
+                logger.warning("⚠️ redis package not installed; shared caches are process-local")
+                return None
+            _redis_client = redis.Redis.from_url(settings.CRAWLER_REDIS_URL, socket_timeout=5)
+        return _redis_client
+
+
+def get_shared_reference_data():
+    """کش استان/شهر پروسه، متصل به فایل محلی و Redis طبق تنظیمات"""
+    global _reference_data_configured
+    if not _reference_data_configured:
+        configure_reference_data(
+            path=settings.CRAWLER_REFERENCE_DATA_PATH,
+            ttl=settings.CRAWLER_REFERENCE_DATA_TTL,
+            redis_client=get_redis_client(),
+        )
+        _reference_data_configured = True
+    return get_reference_data()
+
+
+def get_shared_rate_limiter():
+    """
+    محدودکننده نرخ درخواست (CRAWLER_RATE_LIMIT درخواست در ثانیه؛ None اگر 0 باشد)
+
+    با CRAWLER_REDIS_URL سطل و نرخ بین همه ورکرها مشترک است؛ در غیر این صورت محلی پروسه.
+    """
+    if settings.CRAWLER_RATE_LIMIT <= 0:
+        return None
+    redis_client = get_redis_client()
+    with _lock:
+        limiter = get_rate_limiter()
+        if limiter is None:
+            aimd = {}
+            if settings.CRAWLER_RATE_LIMIT_ADAPTIVE:
+                aimd = {
+                    'min_rate': settings.CRAWLER_RATE_LIMIT_MIN,
+                    'max_rate': settings.CRAWLER_RATE_LIMIT_MAX,
+                    'increase': settings.CRAWLER_RATE_LIMIT_INCREASE,
+                    'slow_latency': settings.CRAWLER_RATE_LIMIT_SLOW_SECONDS or None,
+                }
+            limiter = configure_rate_limiter(
+                settings.CRAWLER_RATE_LIMIT,
+                settings.CRAWLER_RATE_LIMIT_BURST or None,
+                redis_client=redis_client,
+                **aimd
+            )
+        return limiter
+
+
+def get_shared_transport():
+    """
+    connection pool مشترک پروسه (CRAWLER_HTTP_*)؛ همه تسک‌های یک ورکر از همان اتصال‌های باز استفاده می‌کنند
+    """
+    with _lock:
+        transport = get_transport()
+        if transport is None:
+            transport = configure_transport(
+                pool_size=settings.CRAWLER_HTTP_POOL_SIZE,
+                keepalive_timeout=settings.CRAWLER_HTTP_KEEPALIVE_SECONDS,
+                compression=settings.CRAWLER_HTTP_COMPRESSION,
+            )
+        return transport
+
+
+def get_shared_circuit_breaker():
+    """
+    circuit breaker مشترک endpoint (None اگر CRAWLER_CIRCUIT_FAILURE_THRESHOLD صفر باشد)
+
+    با CRAWLER_REDIS_URL باز شدن circuit در یک ورکر همه ورکرها را متوقف می‌کند.
+    """
+    if settings.CRAWLER_CIRCUIT_FAILURE_THRESHOLD <= 0:
+        return None
+    redis_client = get_redis_client()
+    with _lock:
+        breaker = get_circuit_breaker()
+        if breaker is None:
+            breaker = configure_circuit_breaker(
+                failure_threshold=settings.CRAWLER_CIRCUIT_FAILURE_THRESHOLD,
+                recovery_timeout=settings.CRAWLER_CIRCUIT_RECOVERY_SECONDS,
+                redis_client=redis_client,
+            )
+        return breaker
+
+
+def get_retry_policy(job_id=None):
+    """
+    سیاست retry طبق تنظیمات CRAWLER_RETRY_*؛ با job_id سقف CRAWLER_JOB_RETRY_BUDGET
+    بین همه تسک‌های آن جاب (از طریق Redis) مشترک است.
+    """
+    budget = None
+    if job_id is not None and settings.CRAWLER_JOB_RETRY_BUDGET > 0:
+        budget = RetryBudget(
+            settings.CRAWLER_JOB_RETRY_BUDGET,
+            redis_client=get_redis_client(),
+            key=f'mojavez:retry_budget:{job_id}',
+        )
+    return RetryPolicy(
+        max_attempts=settings.CRAWLER_RETRY_MAX_ATTEMPTS,
+        base_delay=settings.CRAWLER_RETRY_BASE_DELAY,
+        max_delay=settings.CRAWLER_RETRY_MAX_DELAY,
+        budget=budget,
+    )
+
+
+class DjangoCountCache(CountCache):
+    """CountCache ذخیره‌شده در جدول CountCacheEntry"""
+
+    # حداکثر تعداد کلید در هر query ... IN (...)
+    LOOKUP_BATCH_SIZE = 500
+
+    def __init__(self, ttl=None, immutable_after_days=None):
+        super().__init__(
+            ttl=ttl or settings.CRAWLER_COUNT_CACHE_TTL,
+            immutable_after_days=immutable_after_days or settings.CRAWLER_COUNT_CACHE_IMMUTABLE_AFTER_DAYS,
+        )
+
+    def _load_many(self, keys):
+        loaded = {}
+        for i in range(0, len(keys), self.LOOKUP_BATCH_SIZE):
+            rows = CountCacheEntry.objects.filter(
+                key__in=keys[i:i + self.LOOKUP_BATCH_SIZE]
+            ).values('key', 'total', 'expires_at')
+            for row in rows:
+                expires_at = row['expires_at'].timestamp() if row['expires_at'] else None
+                loaded[row['key']] = (row['total'], expires_at)
+        return loaded
+
+    def _store_many(self, entries):
+        CountCacheEntry.objects.bulk_create(
+            [
+                CountCacheEntry(
+                    key=entry['key'],
+                    start_date=entry['start_date'],
+                    end_date=entry['end_date'],
+                    province_id=entry.get('province_id'),
+                    township_id=entry.get('township_id'),
+                    total=entry['total'],
+                    expires_at=(
+                        datetime.fromtimestamp(entry['expires_at'], tz=dt_timezone.utc)
+                        if entry['expires_at'] else None
+                    ),
+                )
+                for entry in entries
+            ],
+            update_conflicts=True,
+            unique_fields=['key'],
+            update_fields=['total', 'expires_at', 'updated_at'],
+        )
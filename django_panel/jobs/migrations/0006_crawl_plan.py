@@ -0,0 +1,21 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0005_add_worker_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='plan',
+            field=models.JSONField(blank=True, null=True, verbose_name='نقشه کراول'),
+        ),
+        migrations.AddField(
+            model_name='crawljob',
+            name='estimated_requests',
+            field=models.IntegerField(default=0, verbose_name='تعداد تخمینی درخواست‌ها'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0006_crawl_plan'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CountCacheEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True, verbose_name='کلید')),
+                ('start_date', models.CharField(max_length=20, verbose_name='تاریخ شروع')),
+                ('end_date', models.CharField(max_length=20, verbose_name='تاریخ پایان')),
+                ('province_id', models.IntegerField(blank=True, null=True, verbose_name='شناسه استان')),
+                ('township_id', models.IntegerField(blank=True, null=True, verbose_name='شناسه شهر')),
+                ('total', models.IntegerField(verbose_name='تعداد')),
+                ('expires_at', models.DateTimeField(blank=True, null=True, verbose_name='زمان انقضا')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاریخ به‌روزرسانی')),
+            ],
+            options={
+                'verbose_name': 'کش تعداد',
+                'verbose_name_plural': 'کش تعدادها',
+            },
+        ),
+    ]
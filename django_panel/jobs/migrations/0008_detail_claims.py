@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0007_count_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawlrecord',
+            name='detail_claimed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='زمان رزرو برای جزئیات'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0008_detail_claims'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlWindow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start_date', models.CharField(max_length=20, verbose_name='تاریخ شروع')),
+                ('end_date', models.CharField(max_length=20, verbose_name='تاریخ پایان')),
+                ('province_id', models.IntegerField(blank=True, null=True, verbose_name='شناسه استان')),
+                ('township_id', models.IntegerField(blank=True, null=True, verbose_name='شناسه شهر')),
+                ('expected_count', models.IntegerField(default=0, verbose_name='تعداد مورد انتظار')),
+                ('status', models.CharField(choices=[('pending', 'در انتظار'), ('running', 'در حال اجرا'), ('completed', 'تکمیل شده'), ('failed', 'ناموفق'), ('cancelled', 'لغو شده')], default='pending', max_length=20, verbose_name='وضعیت')),
+                ('fetched_records', models.IntegerField(default=0, verbose_name='تعداد رکوردهای ذخیره‌شده')),
+                ('attempts', models.IntegerField(default=0, verbose_name='تعداد تلاش')),
+                ('task_id', models.CharField(blank=True, max_length=255, null=True, verbose_name='شناسه Task')),
+                ('error_message', models.TextField(blank=True, null=True, verbose_name='پیام خطا')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='تاریخ شروع اجرا')),
+                ('completed_at', models.DateTimeField(blank=True, null=True, verbose_name='تاریخ تکمیل')),
+                ('crawl_job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='windows', to='jobs.crawljob', verbose_name='کراول جاب')),
+            ],
+            options={
+                'verbose_name': 'پنجره کراول',
+                'verbose_name_plural': 'پنجره‌های کراول',
+                'ordering': ['id'],
+                'indexes': [models.Index(fields=['crawl_job', 'status'], name='jobs_crawlw_crawl_j_8d7ec2_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0009_crawl_windows'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CrawlPageCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page', models.IntegerField(verbose_name='صفحه')),
+                ('records_count', models.IntegerField(default=0, verbose_name='تعداد رکورد صفحه')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ثبت')),
+                ('window', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='jobs.crawlwindow', verbose_name='پنجره')),
+            ],
+            options={
+                'verbose_name': 'چک‌پوینت صفحه',
+                'verbose_name_plural': 'چک‌پوینت‌های صفحه',
+                'constraints': [models.UniqueConstraint(fields=('window', 'page'), name='unique_window_page_checkpoint')],
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def dedup_crawl_records(apps, schema_editor):
+    """
+    آماده‌سازی برای unique (crawl_job, request_number): رشته خالی به NULL تبدیل می‌شود و از
+    رکوردهای تکراری هر جاب فقط یکی (ترجیحاً همانی که detail دارد) نگه داشته می‌شود.
+    """
+    CrawlRecord = apps.get_model('jobs', 'CrawlRecord')
+    CrawlRecord.objects.filter(request_number='').update(request_number=None)
+
+    duplicates = (
+        CrawlRecord.objects.exclude(request_number__isnull=True)
+        .values('crawl_job_id', 'request_number')
+        .annotate(n=Count('id'), first_id=Min('id'))
+        .filter(n__gt=1)
+    )
+    for row in duplicates.iterator():
+        group = CrawlRecord.objects.filter(crawl_job_id=row['crawl_job_id'], request_number=row['request_number'])
+        keep = (
+            group.filter(detail__isnull=False).order_by('id').values_list('id', flat=True).first()
+            or row['first_id']
+        )
+        group.exclude(id=keep).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0010_page_checkpoints'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedup_crawl_records, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0011_dedup_crawl_records'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='crawlrecord',
+            constraint=models.UniqueConstraint(fields=('crawl_job', 'request_number'), name='unique_job_request_number'),
+        ),
+        # unique constraint خودش ایندکس (crawl_job, request_number) را می‌سازد
+        migrations.RemoveIndex(
+            model_name='crawlrecord',
+            name='jobs_crawlr_crawl_j_de8074_idx',
+        ),
+    ]
@@ -0,0 +1,36 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0012_unique_request_number'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='License',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('request_number', models.CharField(max_length=100, unique=True, verbose_name='شماره درخواست')),
+                ('license_title', models.CharField(blank=True, max_length=500, null=True, verbose_name='عنوان مجوز')),
+                ('organization_title', models.CharField(blank=True, max_length=500, null=True, verbose_name='عنوان سازمان')),
+                ('responded_at', models.CharField(blank=True, max_length=50, null=True, verbose_name='تاریخ پاسخ')),
+                ('status_title', models.CharField(blank=True, max_length=100, null=True, verbose_name='عنوان وضعیت')),
+                ('status_slug', models.CharField(blank=True, max_length=100, null=True, verbose_name='Slug وضعیت')),
+                ('raw_data', models.JSONField(blank=True, null=True, verbose_name='داده خام')),
+                ('first_seen_at', models.DateTimeField(auto_now_add=True, verbose_name='اولین مشاهده')),
+                ('last_seen_at', models.DateTimeField(auto_now=True, verbose_name='آخرین مشاهده')),
+            ],
+            options={
+                'verbose_name': 'مجوز',
+                'verbose_name_plural': 'مجوزها',
+            },
+        ),
+        migrations.AddField(
+            model_name='crawlrecord',
+            name='license',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='records', to='jobs.license', verbose_name='مجوز'),
+        ),
+    ]
@@ -0,0 +1,59 @@
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+BACKFILL_BATCH_SIZE = 2000
+
+
+def backfill_licenses(apps, schema_editor):
+    """
+    ساخت License برای request_numberهای موجود و لینک کردن CrawlRecordها به آن (دسته‌ای)
+
+    داده خام رکوردهای قدیمی دست نمی‌خورد؛ فقط رکوردهای جدید raw_data را در License نگه می‌دارند.
+    """
+    CrawlRecord = apps.get_model('jobs', 'CrawlRecord')
+    License = apps.get_model('jobs', 'License')
+
+    last_id = 0
+    while True:
+        records = list(
+            CrawlRecord.objects.filter(id__gt=last_id, license__isnull=True, request_number__isnull=False)
+            .order_by('id')
+            .values('id', 'request_number', 'license_title', 'organization_title', 'responded_at',
+                    'status_title', 'status_slug', 'raw_data')[:BACKFILL_BATCH_SIZE]
+        )
+        if not records:
+            break
+        last_id = records[-1]['id']
+
+        latest = {}
+        for record in records:
+            latest[record['request_number']] = record
+        License.objects.bulk_create(
+            [
+                License(
+                    request_number=number,
+                    license_title=record['license_title'],
+                    organization_title=record['organization_title'],
+                    responded_at=record['responded_at'],
+                    status_title=record['status_title'],
+                    status_slug=record['status_slug'],
+                    raw_data=record['raw_data'],
+                )
+                for number, record in sorted(latest.items())
+            ],
+            ignore_conflicts=True
+        )
+        CrawlRecord.objects.filter(id__in=[record['id'] for record in records]).update(
+            license_id=Subquery(License.objects.filter(request_number=OuterRef('request_number')).values('id')[:1])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0013_license'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_licenses, migrations.RunPython.noop),
+    ]
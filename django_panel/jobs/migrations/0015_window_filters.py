@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0014_backfill_licenses'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawlwindow',
+            name='filters',
+            field=models.JSONField(blank=True, default=dict, verbose_name='فیلترهای تقسیم'),
+        ),
+    ]
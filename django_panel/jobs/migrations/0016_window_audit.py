@@ -0,0 +1,26 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0015_window_filters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='audit',
+            field=models.JSONField(blank=True, null=True, verbose_name='گزارش کامل بودن'),
+        ),
+        migrations.AddField(
+            model_name='crawlwindow',
+            name='received_count',
+            field=models.IntegerField(default=0, verbose_name='تعداد رکورد دریافتی'),
+        ),
+        migrations.AddField(
+            model_name='crawlwindow',
+            name='refetch_count',
+            field=models.IntegerField(default=0, verbose_name='تعداد دریافت دوباره (audit)'),
+        ),
+    ]
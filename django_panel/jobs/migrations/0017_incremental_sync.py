@@ -0,0 +1,34 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0016_window_audit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='mode',
+            field=models.CharField(choices=[('full', 'کامل'), ('incremental', 'افزایشی (از آخرین sync)')], default='full', max_length=20, verbose_name='حالت کراول'),
+        ),
+        migrations.CreateModel(
+            name='CrawlWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True, verbose_name='کلید محدوده')),
+                ('province_id', models.IntegerField(blank=True, null=True, verbose_name='شناسه استان')),
+                ('township_id', models.IntegerField(blank=True, null=True, verbose_name='شناسه شهر')),
+                ('synced_until', models.CharField(max_length=20, verbose_name='همگام تا تاریخ')),
+                ('day_counts', models.JSONField(blank=True, default=dict, verbose_name='تعداد رکورد روزهای اخیر')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='تاریخ به‌روزرسانی')),
+                ('last_job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='jobs.crawljob', verbose_name='آخرین جاب')),
+            ],
+            options={
+                'verbose_name': 'watermark کراول',
+                'verbose_name_plural': 'watermarkهای کراول',
+            },
+        ),
+    ]
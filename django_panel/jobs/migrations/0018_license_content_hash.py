@@ -0,0 +1,45 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0017_incremental_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='crawljob',
+            name='changed_records',
+            field=models.IntegerField(default=0, verbose_name='تعداد مجوزهای تغییرکرده'),
+        ),
+        migrations.AddField(
+            model_name='license',
+            name='content_hash',
+            field=models.CharField(blank=True, max_length=40, null=True, verbose_name='hash محتوا'),
+        ),
+        migrations.AddField(
+            model_name='license',
+            name='changed_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='آخرین تغییر محتوا'),
+        ),
+        migrations.CreateModel(
+            name='LicenseStatusHistory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('previous_status_slug', models.CharField(blank=True, max_length=100, null=True, verbose_name='Slug وضعیت قبلی')),
+                ('status_slug', models.CharField(blank=True, max_length=100, null=True, verbose_name='Slug وضعیت')),
+                ('previous_responded_at', models.CharField(blank=True, max_length=50, null=True, verbose_name='تاریخ پاسخ قبلی')),
+                ('responded_at', models.CharField(blank=True, max_length=50, null=True, verbose_name='تاریخ پاسخ')),
+                ('observed_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان مشاهده')),
+                ('crawl_job', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='jobs.crawljob', verbose_name='کراول جاب')),
+                ('license', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_history', to='jobs.license', verbose_name='مجوز')),
+            ],
+            options={
+                'verbose_name': 'تاریخچه وضعیت مجوز',
+                'verbose_name_plural': 'تاریخچه وضعیت مجوزها',
+                'ordering': ['id'],
+            },
+        ),
+    ]
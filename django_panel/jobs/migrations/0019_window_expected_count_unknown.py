@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0018_license_content_hash'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='crawlwindow',
+            name='expected_count',
+            field=models.IntegerField(blank=True, default=0, null=True, verbose_name='تعداد مورد انتظار'),
+        ),
+    ]
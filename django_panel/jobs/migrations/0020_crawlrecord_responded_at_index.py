@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0019_window_expected_count_unknown'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='crawlrecord',
+            index=models.Index(fields=['responded_at'], name='jobs_crawlr_respond_ec08a6_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def link_latest_details(apps, schema_editor):
+    """License.detail = جدیدترین mojavez_detail رکوردهای هر مجوز"""
+    License = apps.get_model('jobs', 'License')
+    MojavezDetail = apps.get_model('jobs', 'MojavezDetail')
+    License.objects.update(detail_id=Subquery(
+        MojavezDetail.objects.filter(crawl_record__license_id=OuterRef('pk')).order_by('-id').values('id')[:1]
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0020_crawlrecord_responded_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='license',
+            name='detail',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='jobs.mojavezdetail', verbose_name='جزئیات فعلی'),
+        ),
+        migrations.RunPython(link_latest_details, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0021_license_detail'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='crawljob',
+            name='detail_status',
+            field=models.CharField(blank=True, help_text='pending / running / completed / partial / failed', max_length=20, null=True, verbose_name='وضعیت دریافت جزئیات'),
+        ),
+    ]
@@ -16,6 +16,11 @@ class CrawlJob(models.Model):
         ('cancelled', 'لغو شده'),
     ]
     
+    MODE_CHOICES = [
+        ('full', 'کامل'),
+        ('incremental', 'افزایشی (از آخرین sync)'),
+    ]
+    
     name = models.CharField(max_length=255, verbose_name='نام کراول')
     start_date = models.CharField(max_length=20, verbose_name='تاریخ شروع')
     end_date = models.CharField(max_length=20, verbose_name='تاریخ پایان')
@@ -24,16 +29,25 @@ class CrawlJob(models.Model):
     township_id = models.IntegerField(null=True, blank=True, verbose_name='شناسه شهر')
     province_name = models.CharField(max_length=100, null=True, blank=True, verbose_name='نام استان')
     township_name = models.CharField(max_length=100, null=True, blank=True, verbose_name='نام شهر')
+    # incremental: فقط روزهای بعد از CrawlWatermark محدوده و روزهای اخیری که تعدادشان عوض شده
+    mode = models.CharField(max_length=20, choices=MODE_CHOICES, default='full', verbose_name='حالت کراول')
     
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='وضعیت')
     total_records = models.IntegerField(default=0, verbose_name='تعداد کل رکوردها')
     fetched_records = models.IntegerField(default=0, verbose_name='تعداد رکوردهای دریافت شده')
+    changed_records = models.IntegerField(default=0, verbose_name='تعداد مجوزهای تغییرکرده')
     
     # Progress tracking (main crawl)
     current_page = models.IntegerField(default=0, verbose_name='صفحه فعلی')
     total_pages = models.IntegerField(default=0, verbose_name='تعداد کل صفحات')
     progress_percentage = models.IntegerField(default=0, verbose_name='درصد پیشرفت')
     
+    # Count-first plan (planner.CrawlPlan.to_dict)
+    plan = models.JSONField(null=True, blank=True, verbose_name='نقشه کراول')
+    estimated_requests = models.IntegerField(default=0, verbose_name='تعداد تخمینی درخواست‌ها')
+    # گزارش کامل بودن پنجره‌ها در پایان جاب (jobs.audit.audit_job)
+    audit = models.JSONField(null=True, blank=True, verbose_name='گزارش کامل بودن')
+    
     # Detail tracking (mojavez_detail)
     detail_total = models.IntegerField(default=0, verbose_name='تعداد کل رکوردهای جزئیات')
     detail_processed = models.IntegerField(default=0, verbose_name='تعداد جزئیات پردازش‌شده')
@@ -43,7 +57,7 @@ class CrawlJob(models.Model):
         null=True,
         blank=True,
         verbose_name='وضعیت دریافت جزئیات',
-        help_text='pending / running / completed / failed'
+        help_text='pending / running / completed / partial / failed'
     )
     
     # Timestamps
@@ -82,6 +96,75 @@ class CrawlJob(models.Model):
         return self.status == 'failed'
 
 
+class License(models.Model):
+    """
+    جدول یکتای مجوزها بر اساس request_number
+    هر مجوز یک بار ذخیره می‌شود و رکوردهای کراول جاب‌های مختلف (CrawlRecord) فقط به آن لینک می‌شوند؛
+    داده خام API فقط همین‌جا نگه داشته می‌شود.
+    """
+
+    request_number = models.CharField(max_length=100, unique=True, verbose_name='شماره درخواست')
+    license_title = models.CharField(max_length=500, null=True, blank=True, verbose_name='عنوان مجوز')
+    organization_title = models.CharField(max_length=500, null=True, blank=True, verbose_name='عنوان سازمان')
+    responded_at = models.CharField(max_length=50, null=True, blank=True, verbose_name='تاریخ پاسخ')
+    status_title = models.CharField(max_length=100, null=True, blank=True, verbose_name='عنوان وضعیت')
+    status_slug = models.CharField(max_length=100, null=True, blank=True, verbose_name='Slug وضعیت')
+    raw_data = models.JSONField(null=True, blank=True, verbose_name='داده خام')
+    # sha1 محتوای رکورد API (persistence.content_hash)؛ ردیف فقط وقتی بازنویسی می‌شود که عوض شود
+    content_hash = models.CharField(max_length=40, null=True, blank=True, verbose_name='hash محتوا')
+    # جزئیات track فعلی مجوز که رکوردهای همه جاب‌ها به آن ارجاع می‌دهند (کپی نمی‌شود)؛
+    # اگر قبل از changed_at گرفته شده باشد کهنه است و دوباره دریافت می‌شود
+    detail = models.ForeignKey(
+        'MojavezDetail',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='جزئیات فعلی'
+    )
+
+    first_seen_at = models.DateTimeField(auto_now_add=True, verbose_name='اولین مشاهده')
+    last_seen_at = models.DateTimeField(auto_now=True, verbose_name='آخرین مشاهده')
+    changed_at = models.DateTimeField(null=True, blank=True, verbose_name='آخرین تغییر محتوا')
+
+    class Meta:
+        verbose_name = 'مجوز'
+        verbose_name_plural = 'مجوزها'
+
+    def __str__(self):
+        return f"{self.request_number} - {self.license_title or 'N/A'}"
+
+
+class LicenseStatusHistory(models.Model):
+    """
+    تاریخچه فشرده تغییر وضعیت مجوزها
+    هر ردیف یک تغییر status_slug / responded_at است که یک کراول دوباره (با مقایسه content_hash) دیده است.
+    """
+
+    license = models.ForeignKey(License, on_delete=models.CASCADE, related_name='status_history', verbose_name='مجوز')
+    crawl_job = models.ForeignKey(
+        CrawlJob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='کراول جاب'
+    )
+    previous_status_slug = models.CharField(max_length=100, null=True, blank=True, verbose_name='Slug وضعیت قبلی')
+    status_slug = models.CharField(max_length=100, null=True, blank=True, verbose_name='Slug وضعیت')
+    previous_responded_at = models.CharField(max_length=50, null=True, blank=True, verbose_name='تاریخ پاسخ قبلی')
+    responded_at = models.CharField(max_length=50, null=True, blank=True, verbose_name='تاریخ پاسخ')
+    observed_at = models.DateTimeField(auto_now_add=True, verbose_name='زمان مشاهده')
+
+    class Meta:
+        verbose_name = 'تاریخچه وضعیت مجوز'
+        verbose_name_plural = 'تاریخچه وضعیت مجوزها'
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.license_id}: {self.previous_status_slug or '-'} → {self.status_slug or '-'}"
+
+
 class CrawlRecord(models.Model):
     """مدل رکوردهای کراول شده"""
     
@@ -89,6 +172,15 @@ class CrawlRecord(models.Model):
     
     # اطلاعات رکورد
     request_number = models.CharField(max_length=100, null=True, blank=True, db_index=True, verbose_name='شماره درخواست')
+    # لینک جاب ↔ مجوز؛ برای رکوردهای لینک‌شده raw_data فقط در License ذخیره می‌شود
+    license = models.ForeignKey(
+        License,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='records',
+        verbose_name='مجوز'
+    )
     applicant_name = models.CharField(max_length=255, null=True, blank=True, verbose_name='نام متقاضی')
     user_image = models.CharField(max_length=500, null=True, blank=True, verbose_name='تصویر کاربر')
     license_title = models.CharField(max_length=500, null=True, blank=True, verbose_name='عنوان مجوز')
@@ -111,19 +203,100 @@ class CrawlRecord(models.Model):
     # Raw JSON data
     raw_data = models.JSONField(null=True, blank=True, verbose_name='داده خام')
     
+    # Detail shard claim (fetch_detail_shard): رکورد تا CRAWLER_DETAIL_CLAIM_TTL ثانیه متعلق به یک shard است
+    detail_claimed_at = models.DateTimeField(null=True, blank=True, verbose_name='زمان رزرو برای جزئیات')
+    
     class Meta:
         verbose_name = 'رکورد کراول'
         verbose_name_plural = 'رکوردهای کراول'
         ordering = ['-created_at']
         indexes = [
-            models.Index(fields=['crawl_job', 'request_number']),
             models.Index(fields=['created_at']),
+            # فیلتر بازه تراکم تاریخی (tasks._historical_daily_density)
+            models.Index(fields=['responded_at']),
+        ]
+        constraints = [
+            # هر request_number در هر جاب یک بار؛ bulk_create با ignore_conflicts تکراری‌ها را رد می‌کند
+            models.UniqueConstraint(fields=['crawl_job', 'request_number'], name='unique_job_request_number'),
         ]
     
     def __str__(self):
         return f"{self.request_number or 'N/A'} - {self.applicant_name or 'N/A'}"
 
 
+class CrawlWindow(models.Model):
+    """
+    پنجره برگ نقشه کراول (تاریخ / استان / شهر) که به صورت یک تسک جدا اجرا می‌شود
+    وضعیت هر پنجره جدا نگه داشته می‌شود تا بعد از ری‌استارت فقط پنجره‌های ناتمام دوباره اجرا شوند.
+    """
+
+    STATUS_CHOICES = [
+        ('pending', 'در انتظار'),
+        ('running', 'در حال اجرا'),
+        ('completed', 'تکمیل شده'),
+        ('failed', 'ناموفق'),
+        ('cancelled', 'لغو شده'),
+    ]
+
+    crawl_job = models.ForeignKey(CrawlJob, on_delete=models.CASCADE, related_name='windows', verbose_name='کراول جاب')
+    start_date = models.CharField(max_length=20, verbose_name='تاریخ شروع')
+    end_date = models.CharField(max_length=20, verbose_name='تاریخ پایان')
+    province_id = models.IntegerField(null=True, blank=True, verbose_name='شناسه استان')
+    township_id = models.IntegerField(null=True, blank=True, verbose_name='شناسه شهر')
+    # main_org_code / sub_org_code / title وقتی planner پنجره را با partitioning.py تقسیم کرده باشد
+    filters = models.JSONField(default=dict, blank=True, verbose_name='فیلترهای تقسیم')
+    # None: probe تعداد در planning خطا داد؛ crawl_window آن را از total صفحه اول پر می‌کند
+    expected_count = models.IntegerField(default=0, null=True, blank=True, verbose_name='تعداد مورد انتظار')
+
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending', verbose_name='وضعیت')
+    fetched_records = models.IntegerField(default=0, verbose_name='تعداد رکوردهای ذخیره‌شده')
+    # رکوردهایی که API برای این پنجره برگرداند (جمع CrawlPageCheckpoint.records_count)؛ برای مقایسه با expected_count
+    received_count = models.IntegerField(default=0, verbose_name='تعداد رکورد دریافتی')
+    refetch_count = models.IntegerField(default=0, verbose_name='تعداد دریافت دوباره (audit)')
+    attempts = models.IntegerField(default=0, verbose_name='تعداد تلاش')
+    task_id = models.CharField(max_length=255, null=True, blank=True, verbose_name='شناسه Task')
+    error_message = models.TextField(null=True, blank=True, verbose_name='پیام خطا')
+
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name='تاریخ شروع اجرا')
+    completed_at = models.DateTimeField(null=True, blank=True, verbose_name='تاریخ تکمیل')
+
+    class Meta:
+        verbose_name = 'پنجره کراول'
+        verbose_name_plural = 'پنجره‌های کراول'
+        ordering = ['id']
+        indexes = [
+            models.Index(fields=['crawl_job', 'status']),
+        ]
+
+    def __str__(self):
+        location = f"{self.province_id or 'All'}/{self.township_id or 'All'}"
+        if self.filters:
+            location += ' ' + ', '.join(f"{field}={value}" for field, value in sorted(self.filters.items()))
+        return f"{self.start_date} - {self.end_date} ({location})"
+
+
+class CrawlPageCheckpoint(models.Model):
+    """
+    لاگ صفحات ذخیره‌شده هر پنجره
+    هر ردیف یعنی رکوردهای این صفحه در دیتابیس هستند؛ در احیا این صفحات دوباره دریافت نمی‌شوند.
+    """
+
+    window = models.ForeignKey(CrawlWindow, on_delete=models.CASCADE, related_name='checkpoints', verbose_name='پنجره')
+    page = models.IntegerField(verbose_name='صفحه')
+    records_count = models.IntegerField(default=0, verbose_name='تعداد رکورد صفحه')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='تاریخ ثبت')
+
+    class Meta:
+        verbose_name = 'چک‌پوینت صفحه'
+        verbose_name_plural = 'چک‌پوینت‌های صفحه'
+        constraints = [
+            models.UniqueConstraint(fields=['window', 'page'], name='unique_window_page_checkpoint'),
+        ]
+
+    def __str__(self):
+        return f"{self.window_id}:{self.page}"
+
+
 class MojavezDetail(models.Model):
     """
     جزئیات صفحه track برای هر رکورد (mojavez_detail)
@@ -174,3 +347,61 @@ class MojavezDetail(models.Model):
 
     def __str__(self):
         return f"جزئیات مجوز {self.request_number or 'N/A'}"
+
+
+class CountCacheEntry(models.Model):
+    """
+    کش پایدار countFilteredLicenses بر اساس (بازه تاریخ، استان، شهر)
+    ورودی‌های بازه‌های قدیمی تغییرناپذیرند (expires_at خالی).
+    """
+
+    key = models.CharField(max_length=255, unique=True, verbose_name='کلید')
+    start_date = models.CharField(max_length=20, verbose_name='تاریخ شروع')
+    end_date = models.CharField(max_length=20, verbose_name='تاریخ پایان')
+    province_id = models.IntegerField(null=True, blank=True, verbose_name='شناسه استان')
+    township_id = models.IntegerField(null=True, blank=True, verbose_name='شناسه شهر')
+    total = models.IntegerField(verbose_name='تعداد')
+    expires_at = models.DateTimeField(null=True, blank=True, verbose_name='زمان انقضا')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='تاریخ به‌روزرسانی')
+
+    class Meta:
+        verbose_name = 'کش تعداد'
+        verbose_name_plural = 'کش تعدادها'
+
+    def __str__(self):
+        return f"{self.key} = {self.total}"
+
+
+class CrawlWatermark(models.Model):
+    """
+    high-water mark کراول افزایشی برای هر محدوده (استان، شهر)
+    synced_until آخرین روزی است که رکوردهایش کامل دریافت شده؛ day_counts تعداد رکورد روزهای اخیر
+    ({'YYYY/M/D': total}) است تا sync بعدی فقط روزهایی را که تعدادشان عوض شده دوباره بگیرد.
+    """
+
+    key = models.CharField(max_length=64, unique=True, verbose_name='کلید محدوده')
+    province_id = models.IntegerField(null=True, blank=True, verbose_name='شناسه استان')
+    township_id = models.IntegerField(null=True, blank=True, verbose_name='شناسه شهر')
+    synced_until = models.CharField(max_length=20, verbose_name='همگام تا تاریخ')
+    day_counts = models.JSONField(default=dict, blank=True, verbose_name='تعداد رکورد روزهای اخیر')
+    last_job = models.ForeignKey(
+        CrawlJob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='+',
+        verbose_name='آخرین جاب'
+    )
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='تاریخ به‌روزرسانی')
+
+    class Meta:
+        verbose_name = 'watermark کراول'
+        verbose_name_plural = 'watermarkهای کراول'
+
+    def __str__(self):
+        return f"{self.province_id or 'All'}/{self.township_id or 'All'} ≤ {self.synced_until}"
+
+    @staticmethod
+    def scope_key(province_id, township_id) -> str:
+        """کلید یکتای محدوده (None هم مقدار معتبر است، پس unique روی دو ستون nullable کافی نیست)"""
+        return f"{province_id or ''}|{township_id or ''}"
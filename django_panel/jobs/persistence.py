@@ -0,0 +1,447 @@
+"""
+Batched persistence of crawled records
+ذخیره دسته‌ای رکوردها: یک query برای request_numberهای موجود و یک bulk_create برای هر دسته،
+و RecordWriter که ذخیره را از حلقه دریافت صفحات جدا می‌کند.
+"""
+import hashlib
+import json
+import logging
+import queue
+import threading
+from typing import Dict, List, Optional, Any, Set, Tuple
+
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import CrawlJob, CrawlPageCheckpoint, CrawlRecord, License, LicenseStatusHistory, MojavezDetail
+
+logger = logging.getLogger(__name__)
+
+BULK_CREATE_BATCH_SIZE = 1000
+
+
+def _status_field(record_data: Dict[str, Any], field: str):
+    status = record_data.get('status')
+    return status.get(field) if isinstance(status, dict) else None
+
+
+LICENSE_UPSERT_FIELDS = [
+    'license_title', 'organization_title', 'responded_at', 'status_title', 'status_slug', 'raw_data',
+    'content_hash', 'changed_at', 'last_seen_at'
+]
+
+# کلیدهایی که کراولر به رکورد اضافه می‌کند (_annotate_location)؛ به محدوده کراول بستگی دارند نه به خود مجوز
+CONTENT_HASH_EXCLUDED_KEYS = frozenset({'province_id', 'township_id'})
+
+
+def content_hash(record_data: Dict[str, Any]) -> str:
+    """hash پایدار محتوای یک رکورد API: sha1 روی JSON با کلیدهای مرتب، مستقل از محدوده کراول"""
+    payload = {key: value for key, value in record_data.items() if key not in CONTENT_HASH_EXCLUDED_KEYS}
+    encoded = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+    return hashlib.sha1(encoded).hexdigest()
+
+
+def build_license(record_data: Dict[str, Any]) -> License:
+    """تبدیل یک رکورد API به نمونه License (بدون ذخیره)"""
+    return License(
+        request_number=record_data.get('request_number'),
+        license_title=record_data.get('license_title'),
+        organization_title=record_data.get('organization_title'),
+        responded_at=record_data.get('responded_at'),
+        status_title=_status_field(record_data, 'status_title'),
+        status_slug=_status_field(record_data, 'status_slug'),
+        raw_data=record_data,
+        content_hash=content_hash(record_data)
+    )
+
+
+def upsert_licenses(records: List[Dict[str, Any]], job=None) -> Tuple[Dict[str, int], Set[str]]:
+    """
+    درج مجوزهای جدید و بازنویسی فقط مجوزهایی که محتوایشان عوض شده است
+
+    content_hash هر رکورد با مقدار ذخیره‌شده مقایسه می‌شود: مجوز بدون تغییر فقط last_seen_at
+    می‌گیرد (یک UPDATE برای کل دسته)، مجوز تغییرکرده بازنویسی و changed_at آن تنظیم می‌شود تا
+    جزئیات قدیمی‌اش دوباره استفاده نشود (missing_detail_filter)، و اگر status_slug یا responded_at
+    عوض شده باشد یک ردیف LicenseStatusHistory اضافه می‌شود. ردیف‌های قبل از content_hash فقط
+    وقتی تغییرکرده حساب می‌شوند که وضعیتشان فرق کند.
+
+    Args:
+        records: رکوردهای API با request_number یکتا
+        job: جابی که تغییر را دیده (برای تاریخچه)
+
+    Returns:
+        ({request_number: license_id}، request_numberهای تغییرکرده)
+    """
+    if not records:
+        return {}, set()
+    now = timezone.now()
+    licenses = {}
+    for record_data in records:
+        license = build_license(record_data)
+        licenses[license.request_number] = license
+    # ترتیب ثابت request_number از deadlock بین پنجره‌های همزمان جلوگیری می‌کند
+    numbers = sorted(licenses)
+    existing = {
+        number: rest for number, *rest in License.objects.filter(request_number__in=numbers).values_list(
+            'request_number', 'id', 'content_hash', 'status_slug', 'responded_at'
+        )
+    }
+
+    license_ids = {}
+    unchanged_ids = []
+    updated = []
+    history = []
+    changed = set()
+    for number in numbers:
+        if number not in existing:
+            continue
+        license_id, old_hash, old_slug, old_responded_at = existing[number]
+        license_ids[number] = license_id
+        license = licenses[number]
+        if old_hash == license.content_hash:
+            unchanged_ids.append(license_id)
+            continue
+        license.id = license_id
+        license.last_seen_at = now
+        status_changed = (old_slug, old_responded_at) != (license.status_slug, license.responded_at)
+        if old_hash is not None or status_changed:
+            license.changed_at = now
+            changed.add(number)
+        updated.append(license)
+        if status_changed:
+            history.append(LicenseStatusHistory(
+                license_id=license_id,
+                crawl_job=job,
+                previous_status_slug=old_slug,
+                status_slug=license.status_slug,
+                previous_responded_at=old_responded_at,
+                responded_at=license.responded_at
+            ))
+
+    new_licenses = [licenses[number] for number in numbers if number not in existing]
+    with transaction.atomic():
+        if new_licenses:
+            # پنجره همزمان ممکن است همین مجوز را بین lookup و insert درج کرده باشد
+            License.objects.bulk_create(new_licenses, batch_size=BULK_CREATE_BATCH_SIZE, ignore_conflicts=True)
+        if updated:
+            # changed_at ردیف‌های قدیمی بدون تغییر وضعیت None می‌ماند (فقط hash پر می‌شود)
+            License.objects.bulk_update(updated, LICENSE_UPSERT_FIELDS, batch_size=BULK_CREATE_BATCH_SIZE)
+        if history:
+            LicenseStatusHistory.objects.bulk_create(history, batch_size=BULK_CREATE_BATCH_SIZE)
+        if unchanged_ids:
+            License.objects.filter(id__in=unchanged_ids).update(last_seen_at=now)
+    if new_licenses:
+        license_ids.update(
+            License.objects.filter(request_number__in=[item.request_number for item in new_licenses])
+            .values_list('request_number', 'id')
+        )
+    return license_ids, changed
+
+
+def build_crawl_record(job, record_data: Dict[str, Any], license_id: Optional[int] = None) -> CrawlRecord:
+    """
+    تبدیل یک رکورد API به نمونه CrawlRecord (بدون ذخیره)
+
+    اگر license_id داده شود رکورد فقط لینک جاب ↔ مجوز است و raw_data در License می‌ماند.
+    """
+    return CrawlRecord(
+        crawl_job=job,
+        license_id=license_id,
+        request_number=record_data.get('request_number') or None,
+        applicant_name=record_data.get('applicant_name'),
+        user_image=record_data.get('user_image'),
+        license_title=record_data.get('license_title'),
+        organization_title=record_data.get('organization_title'),
+        province_id=record_data.get('province_id'),
+        province_title=record_data.get('province_title'),
+        township_id=record_data.get('township_id'),
+        township_title=record_data.get('township_title'),
+        responded_at=record_data.get('responded_at'),
+        status_id=_status_field(record_data, 'status_id'),
+        status_title=_status_field(record_data, 'status_title'),
+        status_slug=_status_field(record_data, 'status_slug'),
+        raw_data=None if license_id else record_data
+    )
+
+
+def save_crawl_records(job, records_batch: List[Dict[str, Any]]) -> int:
+    """
+    ذخیره دسته‌ای رکوردهای یک جاب
+
+    رکورد تکراری (داخل همین دسته یا از قبل در دیتابیس برای این جاب) رد می‌شود؛
+    تعداد query ها به ازای هر دسته ثابت است و به تعداد رکوردها بستگی ندارد.
+    یکتایی را unique (crawl_job, request_number) در دیتابیس تضمین می‌کند؛ lookup فقط
+    برای شمارش دقیق رکوردهای جدید همین دسته است و هیچ حالتی در حافظه نگه داشته نمی‌شود.
+    هر مجوز یک بار در License ذخیره می‌شود و فقط اگر content_hash آن عوض شده باشد بازنویسی
+    می‌شود (upsert_licenses)؛ تعداد مجوزهای تغییرکرده به CrawlJob.changed_records اضافه می‌شود.
+
+    Args:
+        job: نمونه CrawlJob
+        records_batch: لیست رکوردهای API
+
+    Returns:
+        تعداد رکوردهایی که واقعاً درج شدند (بعد از insert با یک count از دیتابیس شمرده می‌شود)
+    """
+    if not records_batch:
+        return 0
+
+    # حذف تکراری‌های داخل دسته (رکورد بدون request_number همیشه ذخیره می‌شود)
+    unique_records = []
+    seen = set()
+    for record_data in records_batch:
+        request_number = record_data.get('request_number')
+        if request_number:
+            if request_number in seen:
+                continue
+            seen.add(request_number)
+        unique_records.append(record_data)
+
+    existing = set()
+    if seen:
+        existing = set(
+            CrawlRecord.objects.filter(crawl_job=job, request_number__in=seen)
+            .values_list('request_number', flat=True)
+        )
+    new_records = [
+        record_data for record_data in unique_records
+        if record_data.get('request_number') not in existing
+    ]
+    license_ids, changed = upsert_licenses(
+        [record_data for record_data in new_records if record_data.get('request_number')], job=job
+    )
+    if changed:
+        CrawlJob.objects.filter(id=job.id).update(changed_records=F('changed_records') + len(changed))
+        logger.info(f"🔄 [Job {job.id}] {len(changed)} licences changed since they were last crawled")
+    new_objects = [
+        build_crawl_record(job, record_data, license_ids.get(record_data.get('request_number')))
+        for record_data in new_records
+    ]
+    inserted = 0
+    if new_objects:
+        with transaction.atomic():
+            CrawlRecord.objects.bulk_create(new_objects, batch_size=BULK_CREATE_BATCH_SIZE, ignore_conflicts=True)
+        # ignore_conflicts تعداد ردیف‌های درج‌شده را برنمی‌گرداند؛ ردیف‌های این request_numberها بعد از
+        # insert منهای آن‌هایی که از قبل بودند (رکورد بدون request_number تداخلی ندارد و همیشه درج می‌شود)
+        inserted = sum(1 for obj in new_objects if not obj.request_number)
+        if seen:
+            inserted += CrawlRecord.objects.filter(crawl_job=job, request_number__in=seen).count() - len(existing)
+
+    skipped = len(records_batch) - inserted
+    if skipped:
+        logger.info(f"⏭️ [Job {job.id}] Skipped {skipped} duplicate records")
+    return inserted
+
+
+def save_page_checkpoints(window, checkpoints: List[tuple]) -> int:
+    """
+    ثبت صفحات ذخیره‌شده یک پنجره در لاگ checkpoint
+
+    Args:
+        window: نمونه CrawlWindow
+        checkpoints: لیست (page, records_count)
+
+    Returns:
+        تعداد صفحات ارسال‌شده برای insert
+    """
+    if not checkpoints:
+        return 0
+    CrawlPageCheckpoint.objects.bulk_create(
+        [CrawlPageCheckpoint(window=window, page=page, records_count=count) for page, count in checkpoints],
+        ignore_conflicts=True
+    )
+    return len(checkpoints)
+
+
+def build_mojavez_detail(record: CrawlRecord, parsed: Dict[str, Any]) -> MojavezDetail:
+    """تبدیل خروجی fetch_details_with_fallback به نمونه MojavezDetail (بدون ذخیره)"""
+    return MojavezDetail(
+        crawl_record=record,
+        request_number=parsed.get("request_number") or record.request_number,
+        license_title=parsed.get("license_title"),
+        organization_title=parsed.get("organization_title"),
+        isic_code=parsed.get("isic_code"),
+        issue_type=parsed.get("issue_type"),
+        issued_at=parsed.get("issued_at"),
+        expires_at=parsed.get("expires_at"),
+        province_title=parsed.get("province_title_detail"),
+        township_title=parsed.get("township_title_detail"),
+        postal_code=parsed.get("postal_code"),
+        business_address=parsed.get("business_address"),
+        status_title=parsed.get("status_title"),
+        status_slug=parsed.get("status_slug"),
+        raw_data=parsed,
+    )
+
+
+def missing_detail_filter() -> Q:
+    """
+    فیلتر CrawlRecordهایی که هنوز جزئیات ندارند: نه detail خودشان و نه detail مجوزشان (License.detail)
+
+    detail مجوز بین همه جاب‌ها مشترک است و فقط اگر بعد از آخرین تغییر محتوای مجوز
+    (License.changed_at) گرفته شده باشد معتبر است؛ پس فقط مجوزهای جدید و تغییرکرده دوباره
+    درخواست می‌شوند.
+    """
+    license_detail = Q(license__detail__isnull=False) & (
+        Q(license__changed_at__isnull=True) | Q(license__changed_at__lte=F('license__detail__created_at'))
+    )
+    return Q(detail__isnull=True) & ~license_detail
+
+
+def save_mojavez_details(details: List[MojavezDetail]) -> int:
+    """
+    ذخیره دسته‌ای جزئیات؛ رکوردی که در این فاصله detail گرفته باشد (crawl_record یکتا) رد می‌شود
+
+    License.detail مجوز هر رکورد به detail تازه اشاره داده می‌شود تا رکوردهای همین مجوز در
+    جاب‌های دیگر به جای کپی از همان استفاده کنند.
+
+    Returns:
+        تعداد ردیف‌هایی که واقعاً درج شدند (ردیف‌های این رکوردها بعد از insert منهای قبل از آن)
+    """
+    if not details:
+        return 0
+    crawl_record_ids = [detail.crawl_record_id for detail in details]
+    with transaction.atomic():
+        existing = MojavezDetail.objects.filter(crawl_record_id__in=crawl_record_ids).count()
+        MojavezDetail.objects.bulk_create(details, batch_size=BULK_CREATE_BATCH_SIZE, ignore_conflicts=True)
+        rows = list(
+            MojavezDetail.objects
+            .filter(crawl_record_id__in=crawl_record_ids)
+            .values_list('crawl_record__license_id', 'id')
+        )
+        License.objects.bulk_update(
+            [License(id=license_id, detail_id=detail_id) for license_id, detail_id in rows if license_id is not None],
+            ['detail'],
+            batch_size=BULK_CREATE_BATCH_SIZE
+        )
+    return len(rows) - existing
+
+
+class RecordWriter:
+    """
+    Write-behind writer بین دریافت صفحات و دیتابیس
+
+    صفحات دریافت‌شده در یک صف محدود قرار می‌گیرند و یک thread جداگانه آن‌ها را
+    به دسته‌های بزرگ تبدیل و با save_batch ذخیره می‌کند. وقتی صف پر است put منتظر
+    می‌ماند (backpressure)؛ در غیر این صورت fetcher هرگز منتظر دیتابیس نمی‌ماند.
+    """
+
+    _STOP = object()
+
+    def __init__(
+        self,
+        save_batch,
+        after_flush=None,
+        save_checkpoints=None,
+        max_pending_pages: int = 64,
+        max_batch_records: int = 2000,
+        flush_interval: float = 1.0,
+        name: str = 'record-writer'
+    ):
+        """
+        Args:
+            save_batch: save_batch(records) -> تعداد ذخیره‌شده
+            after_flush: after_flush(saved, progress) بعد از هر ذخیره در thread نویسنده (saved تعداد همین دسته)؛
+                progress آخرین مقداری است که با set_progress ثبت شده (یا None)
+            save_checkpoints: save_checkpoints(checkpoints) بعد از ذخیره موفق رکوردهای همان دسته؛
+                checkpoints مقادیری است که همراه صفحات به put داده شده‌اند
+            max_pending_pages: ظرفیت صف (تعداد صفحه)
+            max_batch_records: حداکثر رکورد در هر ذخیره دسته‌ای
+            flush_interval: حداکثر زمان نگه داشتن رکوردها قبل از ذخیره (ثانیه)
+        """
+        self.save_batch = save_batch
+        self.after_flush = after_flush
+        self.save_checkpoints = save_checkpoints
+        self.max_batch_records = max_batch_records
+        self.flush_interval = flush_interval
+        self.saved = 0
+        self.flushes = 0
+        self.error: Optional[BaseException] = None
+        self._queue = queue.Queue(maxsize=max_pending_pages)
+        self._progress = None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+
+    def start(self) -> 'RecordWriter':
+        self._thread.start()
+        return self
+
+    def put(self, records: List[Dict[str, Any]], checkpoint=None) -> int:
+        """
+        سپردن رکوردهای یک صفحه به writer (در صورت پر بودن صف منتظر می‌ماند)
+
+        Args:
+            records: رکوردهای صفحه
+            checkpoint: نشانه صفحه (مثلاً شماره صفحه)؛ فقط بعد از ذخیره رکوردهایش به save_checkpoints می‌رسد
+
+        Returns:
+            تعداد رکوردهای صف‌شده (نه ذخیره‌شده)
+        """
+        if self.error is not None:
+            raise self.error
+        if records or checkpoint is not None:
+            self._queue.put((list(records), checkpoint))
+        return len(records)
+
+    def set_progress(self, *progress):
+        """ثبت آخرین وضعیت پیشرفت؛ بعد از flush بعدی به after_flush داده می‌شود"""
+        self._progress = progress
+
+    def close(self):
+        """ذخیره همه رکوردهای باقیمانده و پایان thread"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _run(self):
+        pending: List[Dict[str, Any]] = []
+        checkpoints: List[Any] = []
+        stop = False
+        try:
+            while not stop:
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    item = None
+                # هرچه در صف آماده است با همین دسته ادغام می‌شود
+                while item is not None:
+                    if item is self._STOP:
+                        stop = True
+                        break
+                    records, checkpoint = item
+                    pending.extend(records)
+                    if checkpoint is not None:
+                        checkpoints.append(checkpoint)
+                    if len(pending) >= self.max_batch_records:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        item = None
+                if pending or checkpoints or (stop and self._progress is not None):
+                    self._flush(pending, checkpoints)
+                    pending = []
+                    checkpoints = []
+        finally:
+            connection.close()
+
+    def _flush(self, records: List[Dict[str, Any]], checkpoints: List[Any]):
+        if self.error is not None:
+            # بعد از خطا فقط صف تخلیه می‌شود تا fetcher قفل نشود
+            return
+        try:
+            saved = 0
+            if records:
+                saved = self.save_batch(records) or 0
+                self.saved += saved
+                self.flushes += 1
+            # checkpoint همیشه بعد از رکوردهایش نوشته می‌شود؛ کرش بین این دو فقط باعث
+            # دریافت دوباره همین دسته می‌شود که رکوردهایش به عنوان تکراری رد می‌شوند
+            if checkpoints and self.save_checkpoints:
+                self.save_checkpoints(checkpoints)
+            if self.after_flush:
+                self.after_flush(saved, self._progress)
+        except Exception as e:
+            logger.error(f"❌ Record writer failed: {e}")
+            self.error = e
@@ -0,0 +1,123 @@
+"""
+Cheap progress accounting for crawl jobs
+شمارنده‌های پیشرفت در حافظه که با فاصله زمانی/دسته‌ای و با F() در CrawlJob نوشته می‌شوند
+"""
+import logging
+import threading
+import time
+from typing import Optional
+
+from django.db.models import F, Value
+from django.db.models.functions import Least
+
+from .models import CrawlJob
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressTracker:
+    """
+    پیشرفت یک جاب بدون COUNT روی جدول رکوردها
+
+    record() فقط شمارنده‌های حافظه را بالا می‌برد؛ flush() حداکثر هر min_interval ثانیه
+    یا هر min_batches دسته یک UPDATE با update_fields محدود و افزایش F('fetched_records')
+    اجرا می‌کند، پس هزینه هر نوشتن مستقل از اندازه جاب است و نویسنده‌های همزمان
+    (مثلاً چند shard یک جاب) مقدار هم را بازنویسی نمی‌کنند.
+    """
+
+    def __init__(
+        self,
+        job_id: int,
+        total_records: int = 0,
+        page_size: int = 21,
+        min_interval: float = 5.0,
+        min_batches: int = 50
+    ):
+        """
+        Args:
+            job_id: شناسه CrawlJob
+            total_records: تعداد کل برای محاسبه درصد
+            page_size: تعداد رکورد هر صفحه برای تخمین total_pages
+            min_interval: حداقل فاصله بین دو نوشتن (ثانیه)
+            min_batches: بعد از این تعداد record() بدون توجه به زمان نوشته می‌شود
+        """
+        self.job_id = job_id
+        self.total_records = total_records
+        self.page_size = page_size
+        self.min_interval = min_interval
+        self.min_batches = min_batches
+        self.status: Optional[str] = None
+        self._pending_records = 0
+        self._pending_batches = 0
+        self._current_page = 0
+        self._total_pages = 0
+        self._last_flush = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, saved: int, current_page: int = 0, total_pages: int = 0):
+        """
+        ثبت نتیجه یک دسته در حافظه
+
+        Args:
+            saved: تعداد ردیف‌هایی که واقعاً insert شدند
+            current_page: صفحه فعلی
+            total_pages: تعداد کل صفحات (0 یعنی نامشخص)
+        """
+        with self._lock:
+            self._pending_records += saved
+            self._pending_batches += 1
+            if current_page:
+                self._current_page = current_page
+            if total_pages:
+                self._total_pages = total_pages
+
+    def due(self) -> bool:
+        """آیا زمان نوشتن در دیتابیس رسیده است؟"""
+        with self._lock:
+            if not self._pending_batches:
+                return False
+            return (
+                self._pending_batches >= self.min_batches
+                or time.monotonic() - self._last_flush >= self.min_interval
+            )
+
+    def maybe_flush(self) -> bool:
+        """نوشتن فقط در صورت due بودن؛ True اگر نوشته شد"""
+        if not self.due():
+            return False
+        self.flush()
+        return True
+
+    def flush(self):
+        """نوشتن شمارنده‌های انباشته با یک UPDATE و خواندن وضعیت جاب"""
+        with self._lock:
+            pending_records = self._pending_records
+            current_page = self._current_page
+            total_pages = self._total_pages
+            self._pending_records = 0
+            self._pending_batches = 0
+            self._last_flush = time.monotonic()
+
+        if not total_pages and self.total_records > 0:
+            total_pages = (self.total_records + self.page_size - 1) // self.page_size
+
+        updates = {'fetched_records': F('fetched_records') + pending_records}
+        if current_page:
+            updates['current_page'] = current_page
+        if total_pages:
+            updates['total_pages'] = total_pages
+        if self.total_records > 0:
+            updates['progress_percentage'] = Least(
+                (F('fetched_records') + pending_records) * 100 / self.total_records,
+                Value(100)
+            )
+
+        try:
+            CrawlJob.objects.filter(id=self.job_id).update(**updates)
+            self.status = CrawlJob.objects.filter(id=self.job_id).values_list('status', flat=True).first()
+            logger.info(f"📈 [Job {self.job_id}] Progress flushed: +{pending_records} records, page {current_page}/{total_pages}")
+        except Exception as e:
+            # شمارنده‌ها برای flush بعدی برگردانده می‌شوند
+            with self._lock:
+                self._pending_records += pending_records
+            logger.error(f"❌ [Job {self.job_id}] Error updating progress: {e}")
@@ -2,7 +2,7 @@
 Serializers for API
 """
 from rest_framework import serializers
-from .models import CrawlJob, CrawlRecord
+from .models import CrawlJob, CrawlRecord, CrawlWindow
 
 
 class CrawlRecordSerializer(serializers.ModelSerializer):
@@ -18,26 +18,43 @@ class CrawlRecordSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
+class CrawlWindowSerializer(serializers.ModelSerializer):
+    """Serializer برای پنجره‌های کراول"""
+    checkpointed_pages = serializers.IntegerField(read_only=True, default=None)
+
+    class Meta:
+        model = CrawlWindow
+        fields = [
+            'id', 'start_date', 'end_date', 'province_id', 'township_id', 'filters',
+            'expected_count', 'received_count', 'fetched_records', 'refetch_count', 'status', 'attempts',
+            'checkpointed_pages', 'error_message', 'started_at', 'completed_at'
+        ]
+        read_only_fields = fields
+
+
 class CrawlJobSerializer(serializers.ModelSerializer):
     """Serializer برای کراول جاب"""
     records_count = serializers.SerializerMethodField()
     duration_seconds = serializers.SerializerMethodField()
+    eta_seconds = serializers.SerializerMethodField()
 
     class Meta:
         model = CrawlJob
         fields = [
-            'id', 'name', 'start_date', 'end_date',
+            'id', 'name', 'start_date', 'end_date', 'mode',
             'province_id', 'township_id', 'province_name', 'township_name',
             'target_worker', 'target_queue',
-            'status', 'total_records', 'fetched_records',
+            'status', 'total_records', 'fetched_records', 'changed_records',
             'current_page', 'total_pages', 'progress_percentage',
+            'estimated_requests', 'eta_seconds',
             'detail_total', 'detail_processed', 'detail_errors', 'detail_status',
             'created_at', 'started_at', 'completed_at', 'duration_seconds',
             'error_message', 'task_id', 'records_count'
         ]
         read_only_fields = [
-            'id', 'status', 'total_records', 'fetched_records',
+            'id', 'status', 'total_records', 'fetched_records', 'changed_records',
             'current_page', 'total_pages', 'progress_percentage',
+            'estimated_requests',
             'detail_total', 'detail_processed', 'detail_errors', 'detail_status',
             'created_at', 'started_at', 'completed_at',
             'error_message', 'task_id'
@@ -54,6 +71,14 @@ class CrawlJobSerializer(serializers.ModelSerializer):
             return max(0, int(delta.total_seconds()))
         return None
 
+    def get_eta_seconds(self, obj):
+        """زمان باقیمانده تخمینی (ثانیه) بر اساس plan؛ فقط برای جاب‌های در حال اجرا"""
+        if obj.status != 'running' or not obj.plan:
+            return None
+        estimated = obj.plan.get('estimated_seconds') or 0
+        remaining_ratio = 1 - (obj.progress_percentage or 0) / 100
+        return max(0, int(estimated * remaining_ratio))
+
 
 class CrawlJobCreateSerializer(serializers.ModelSerializer):
     """Serializer برای ایجاد کراول جاب"""
@@ -61,7 +86,7 @@ class CrawlJobCreateSerializer(serializers.ModelSerializer):
     class Meta:
         model = CrawlJob
         fields = [
-            'name', 'start_date', 'end_date',
+            'name', 'start_date', 'end_date', 'mode',
             'province_id', 'township_id', 'province_name', 'township_name',
             'target_worker', 'target_queue'
         ]
@@ -3,306 +3,450 @@ Celery tasks for crawling
 """
 import sys
 import os
-import time
 import logging
-from celery import shared_task
+import random
+import threading
+from datetime import timedelta
+from celery import chord, shared_task
+from celery.exceptions import Retry
+from celery.signals import worker_ready
+from django.conf import settings
 from django.utils import timezone
 from django.db import transaction
+from django.db.models import Count, F, Q
+from django.db.models.functions import Substr
 
 # اضافه کردن مسیر اصلی پروژه
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
 
 from crawler import MojavezCrawler
+from partitioning import build_partitioners
+from planner import CrawlPlan, CrawlPlanner
+from resilience import CircuitOpenError
 from date_utils import format_date_for_api, parse_api_date
-from .models import CrawlJob, CrawlRecord, MojavezDetail
+from .audit import audit_job, prepare_refetch, window_received_count
+from .models import CrawlJob, CrawlRecord, CrawlWatermark, CrawlWindow, MojavezDetail
+from .caches import (
+    DjangoCountCache, get_retry_policy, get_shared_circuit_breaker, get_shared_rate_limiter, get_shared_reference_data,
+    get_shared_transport
+)
+from .persistence import (
+    BULK_CREATE_BATCH_SIZE, RecordWriter, build_mojavez_detail, missing_detail_filter, save_crawl_records, save_mojavez_details,
+    save_page_checkpoints
+)
+from .progress import ProgressTracker
+from .workers import get_online_queues
 
 logger = logging.getLogger(__name__)
 
 
-# Long-running crawl: ack only after completion (so pod restart re-queues task); no time limit so job can finish.
-@shared_task(bind=True, max_retries=10, acks_late=True, time_limit=24 * 60 * 60, soft_time_limit=23 * 60 * 60)
+def _circuit_countdown(error: CircuitOpenError) -> float:
+    """تأخیر retry تسک تا باز شدن circuit، با کمی jitter تا همه تسک‌ها همزمان برنگردند"""
+    return error.retry_after + random.uniform(1, 5)
+
+
+def _subday_format_setting():
+    """CRAWLER_SUBDAY_FORMAT به مقدار subday_format کراولر ('auto' → None، 'off' → '')"""
+    value = settings.CRAWLER_SUBDAY_FORMAT
+    if value == 'auto':
+        return None
+    return '' if value == 'off' else value
+
+
+def _plan_partitioners():
+    """
+    partitionerهای planner برای پنجره‌هایی که بعد از شهر و ساعت هنوز از سقف بیشترند
+
+    پیشوندهای عنوان مجوزهای موجود در دیتابیس (تا CRAWLER_PARTITION_TITLE_MAX_LENGTH حرف) یک بار
+    شمرده و در ReferenceDataCache (facet 'title') نگه داشته می‌شوند تا هر planning دوباره کل
+    جدول را اسکن نکند. کدهای سازمان از API قابل دریافت نیستند و فقط از
+    CRAWLER_PARTITION_ORG_CODES / CRAWLER_PARTITION_SUB_ORG_CODES خوانده می‌شوند.
+    """
+    max_length = settings.CRAWLER_PARTITION_TITLE_MAX_LENGTH
+    reference_data = get_shared_reference_data()
+    titles = reference_data.get_facets('title')
+    if titles is None:
+        titles = sorted({
+            prefix.strip() for prefix in CrawlRecord.objects.exclude(license_title__isnull=True)
+            .annotate(prefix=Substr('license_title', 1, max_length))
+            .order_by().values_list('prefix', flat=True).distinct()
+            if prefix and prefix.strip()
+        })
+        if titles:
+            reference_data.set_facets('title', titles)
+    if not settings.CRAWLER_PARTITION_ORG_CODES:
+        logger.info("🏢 Organization partitioning disabled (CRAWLER_PARTITION_ORG_CODES is empty)")
+    return build_partitioners(
+        org_codes=settings.CRAWLER_PARTITION_ORG_CODES,
+        sub_org_codes=settings.CRAWLER_PARTITION_SUB_ORG_CODES,
+        titles=titles,
+        title_alphabet=settings.CRAWLER_PARTITION_TITLE_ALPHABET,
+        title_max_length=max_length
+    )
+
+
+def _responded_at_range(start_date, end_date):
+    """
+    فیلتر SQL روزهای بازه روی responded_at، با همان فرمتی که از API ذخیره شده است
+
+    فرمت از چند رکورد آخر خوانده می‌شود. اگر ماه یا روزی با صفر شروع شود (YYYY/MM/DD یا YYYY-MM-DD)
+    رشته‌ها قابل مقایسه‌اند و بازه دقیقاً یک range روی ایندکس responded_at است. اگر ماه یا روزی
+    یک رقمی باشد (YYYY/M/D) ترتیب رشته‌ای فقط در سطح سال (یا ماه، اگر بازه در یک ماه باشد) درست
+    است؛ و اگر نمونه‌ها هیچ‌کدام را نشان ندهند (مثلاً فقط 2026/12/31) range سطح سال گرفته می‌شود که
+    برای هر دو فرمت درست است. روزهای بیرون بازه را فراخواننده بعد از گروه‌بندی کنار می‌گذارد.
+
+    Returns:
+        Q یا None اگر هنوز رکوردی با responded_at نیست
+    """
+    samples = CrawlRecord.objects.exclude(responded_at__isnull=True).exclude(responded_at='').order_by('-id') \
+        .values_list('responded_at', flat=True)[:20]
+    day_parts = [sample.strip().split(' ')[0].split('T')[0] for sample in samples]
+    if not day_parts:
+        return None
+    sep = '-' if '-' in day_parts[0] else '/'
+    parts = [part.split(sep)[1:] for part in day_parts]
+    if any(len(piece) == 2 and piece.startswith('0') for pieces in parts for piece in pieces):
+        def padded(day):
+            return f"{day.year:04d}{sep}{day.month:02d}{sep}{day.day:02d}"
+        return Q(responded_at__gte=padded(start_date), responded_at__lt=padded(end_date + timedelta(days=1)))
+
+    unpadded = any(len(piece) == 1 for pieces in parts for piece in pieces)
+    if unpadded and (start_date.year, start_date.month) == (end_date.year, end_date.month):
+        # همه روزهای ماه پیشوند '2026/1/' دارند؛ سقف '2026/10' است (کاراکتر بعد از جداکننده) که ماه 10 را بیرون می‌گذارد
+        prefix = f"{start_date.year}{sep}{start_date.month}{sep}"
+        return Q(responded_at__gte=prefix, responded_at__lt=f"{prefix[:-1]}{chr(ord(sep) + 1)}")
+    return Q(responded_at__gte=f"{start_date.year}{sep}", responded_at__lt=f"{end_date.year + 1}{sep}")
+
+
+def _historical_daily_density(start_date, end_date, province_id=None, township_id=None):
+    """
+    تراکم روزانه تاریخی از CrawlRecord.responded_at برای تقسیم تراکم‌محور
+
+    بازه تاریخ در خود SQL فیلتر می‌شود (_responded_at_range) و فقط روزهای بازه بر اساس
+    10 کاراکتر اول responded_at گروه‌بندی می‌شوند. هر مجوز یک بار شمرده می‌شود، حتی اگر
+    چند جاب آن را کراول کرده باشند.
+
+    Returns:
+        {date: تعداد رکورد}
+    """
+    day_range = _responded_at_range(start_date, end_date)
+    if day_range is None:
+        return {}
+    records = CrawlRecord.objects.filter(day_range)
+    if province_id:
+        records = records.filter(province_id=province_id)
+    if township_id:
+        records = records.filter(township_id=township_id)
+
+    density = {}
+    rows = records.annotate(day=Substr('responded_at', 1, 10)).values('day').annotate(
+        n=Count('request_number', distinct=True)
+    )
+    for row in rows:
+        day = parse_api_date((row['day'] or '').split(' ')[0].split('T')[0])
+        if day and start_date <= day <= end_date:
+            density[day.date()] = density.get(day.date(), 0) + row['n']
+    return density
+
+
+def _plan_range(job, crawler, start_date, end_date, total_count=None):
+    """
+    CrawlPlan یک بازه تاریخ از محدوده جاب
+
+    اگر تعداد زیر سقف API باشد کل بازه یک پنجره است؛ در غیر این صورت CrawlPlanner
+    پنجره‌های برگ را می‌سازد.
+
+    Args:
+        total_count: تعداد بازه اگر از قبل معلوم است (یک probe کمتر)
+
+    Returns:
+        (CrawlPlan، تعداد کل رکوردهای بازه طبق count)
+    """
+    start_str = format_date_for_api(start_date)
+    end_str = format_date_for_api(end_date)
+    probes = 0
+    if total_count is None:
+        logger.info(f"🔍 [Job {job.id}] Fetching records count for {start_str} - {end_str}...")
+        total_count = crawler.get_records_count(start_str, end_str, job.province_id, job.township_id, default=None)
+        probes = 1
+    logger.info(f"📊 [Job {job.id}] {start_str} - {end_str}: {total_count} records")
+
+    if total_count is not None and total_count <= crawler.MAX_RECORDS_PER_REQUEST:
+        logger.info(f"📊 [Job {job.id}] Count ({total_count}) is within limit. Using a single window...")
+        window = {
+            'start_date': start_str,
+            'end_date': end_str,
+            'province_id': job.province_id,
+            'township_id': job.township_id,
+            'filters': {},
+            'count': total_count,
+        }
+        return CrawlPlan([window], probe_count=probes, page_size=crawler.PAGE_SIZE), total_count
+
+    if total_count is None:
+        # count نامعلوم (نه صفر): planner دوباره probe می‌کند و در صورت خطا بدون count تقسیم می‌کند
+        logger.warning(f"⚠️ [Job {job.id}] Count probe failed. Planning split windows...")
+    else:
+        logger.info(f"📊 [Job {job.id}] Count ({total_count}) exceeds limit ({crawler.MAX_RECORDS_PER_REQUEST}). Planning split windows...")
+    # Planning phase: all count probes run (in parallel) before any record is downloaded
+    daily_density = _historical_daily_density(start_date, end_date, job.province_id, job.township_id)
+    logger.info(f"📈 [Job {job.id}] Historical density available for {len(daily_density)} days")
+    plan = CrawlPlanner(
+        crawler, daily_density=daily_density, partitioners=_plan_partitioners()
+    ).build_plan(
+        start_date,
+        end_date,
+        job.province_id,
+        job.township_id,
+        total_count=total_count
+    )
+    plan.probe_count += probes
+    if plan.windows and any(w.get('probe_failed') for w in plan.windows):
+        logger.warning(
+            f"⚠️ [Job {job.id}] {sum(1 for w in plan.windows if w.get('probe_failed'))} windows have an unknown count; "
+            f"their size is taken from the first page"
+        )
+    if plan.overflow_windows:
+        # فقط MAX_RECORDS_PER_REQUEST رکورد از هر پنجره سرریز قابل دریافت است
+        unreachable = sum(w['count'] - crawler.MAX_RECORDS_PER_REQUEST for w in plan.overflow_windows)
+        logger.error(
+            f"❌ [Job {job.id}] {len(plan.overflow_windows)} windows could not be split under the API cap; "
+            f"~{unreachable} records are unreachable (see plan['windows'][*]['overflow'])"
+        )
+    return plan, plan.total_count if total_count is None else total_count
+
+
+def _day_range(start_date, end_date):
+    """روزهای بازه (شامل هر دو سر)"""
+    return [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+
+
+def _plan_incremental(job, crawler, start_date, end_date):
+    """
+    plan افزایشی بر اساس CrawlWatermark محدوده جاب
+
+    - روزهای بعد از synced_until مثل کراول کامل plan می‌شوند.
+    - CRAWLER_INCREMENTAL_LOOKBACK_DAYS روز آخر تا synced_until با یک probe همزمان برای هر روز (بدون
+      count_cache) دوباره شمرده می‌شوند و فقط روزهایی که تعدادشان با day_counts فرق دارد (هر دنباله
+      روزهای پشت سر هم یک بازه) دوباره دریافت می‌شوند.
+    - روزهای قدیمی‌تر اصلاً درخواست نمی‌شوند.
+    بدون watermark کل بازه plan می‌شود. تعداد روزهای اخیر تا end_date هم برای sync بعدی شمرده
+    و در plan['incremental'] نگه داشته می‌شود؛ finalize_crawl_job بعد از تکمیل جاب آن را در watermark می‌نویسد.
+
+    Returns:
+        (لیست (CrawlPlan، تعداد کل)، دیکشنری plan['incremental'])
+    """
+    lookback = max(1, settings.CRAWLER_INCREMENTAL_LOOKBACK_DAYS)
+    watermark = CrawlWatermark.objects.filter(
+        key=CrawlWatermark.scope_key(job.province_id, job.township_id)
+    ).first()
+    synced_until = parse_api_date(watermark.synced_until) if watermark else None
+
+    new_start = start_date
+    recheck_days = []
+    if synced_until and synced_until >= start_date:
+        new_start = synced_until + timedelta(days=1)
+        recheck_from = max(start_date, synced_until - timedelta(days=lookback - 1))
+        recheck_days = _day_range(recheck_from, min(synced_until, end_date))
+    # روزهای آخر بازه که sync بعدی دوباره می‌شمارد
+    tail_days = _day_range(max(start_date, end_date - timedelta(days=lookback - 1)), end_date)
+    count_days = sorted(set(recheck_days) | set(tail_days))
+    counts = dict(zip(count_days, crawler.count_many(
+        [(format_date_for_api(day), format_date_for_api(day)) for day in count_days],
+        job.province_id,
+        job.township_id
+    )))
+
+    stored = watermark.day_counts if watermark else {}
+    changed_days = [
+        day for day in recheck_days
+        if counts[day] is None or stored.get(format_date_for_api(day)) != counts[day]
+    ]
+    plans = []
+    run = []
+    for day in changed_days + [None]:
+        if run and (day is None or day - run[-1] != timedelta(days=1)):
+            # تعداد دنباله فقط وقتی معلوم است که همه probeهای آن موفق بوده باشند
+            known = [counts[d] for d in run]
+            total = None if None in known else sum(known)
+            if total != 0:
+                plans.append(_plan_range(job, crawler, run[0], run[-1], total_count=total))
+            run = []
+        if day is not None:
+            run.append(day)
+    new_days = (end_date - new_start).days + 1 if new_start <= end_date else 0
+    if new_days:
+        plans.append(_plan_range(job, crawler, new_start, end_date))
+
+    incremental = {
+        'synced_until': watermark.synced_until if watermark else None,
+        'rechecked_days': len(recheck_days),
+        'changed_days': [format_date_for_api(day) for day in changed_days],
+        'skipped_days': (end_date - start_date).days + 1 - len(recheck_days) - new_days,
+        'new_range': [format_date_for_api(new_start), format_date_for_api(end_date)] if new_days else None,
+        'count_probes': len(count_days),
+        'day_counts': {
+            format_date_for_api(day): counts[day] for day in tail_days if counts[day] is not None
+        },
+    }
+    logger.info(
+        f"🔂 [Job {job.id}] Incremental: synced until {incremental['synced_until'] or '-'}, "
+        f"{len(changed_days)}/{len(recheck_days)} recent days changed, {incremental['skipped_days']} days skipped, "
+        f"new range {incremental['new_range'] or '-'}"
+    )
+    return plans, incremental
+
+
+def _plan_crawl_windows(job, crawler):
+    """
+    ساخت ردیف‌های CrawlWindow برای یک جاب (فقط در اجرای اول)
+
+    کراول کامل کل بازه را plan می‌کند (_plan_range)؛ کراول افزایشی فقط بخش‌های تغییرکرده را
+    (_plan_incremental). هر پنجره برگ یک ردیف می‌شود.
+
+    Returns:
+        تعداد کل رکوردها طبق count
+    """
+    start_date = parse_api_date(job.start_date)
+    end_date = parse_api_date(job.end_date)
+    if not start_date or not end_date:
+        raise ValueError("❌ Date parsing error")
+
+    incremental = None
+    if job.mode == 'incremental':
+        plans, incremental = _plan_incremental(job, crawler, start_date, end_date)
+    else:
+        plans = [_plan_range(job, crawler, start_date, end_date)]
+
+    plan = CrawlPlan(
+        windows=[window for sub_plan, _ in plans for window in sub_plan.windows],
+        probe_count=sum(sub_plan.probe_count for sub_plan, _ in plans) + (incremental or {}).get('count_probes', 0),
+        page_size=crawler.PAGE_SIZE,
+        avg_request_seconds=max((sub_plan.avg_request_seconds for sub_plan, _ in plans), default=0.0),
+        concurrency=max((sub_plan.concurrency for sub_plan, _ in plans), default=1)
+    )
+    total_count = sum(count or 0 for _, count in plans)
+    job.plan = plan.to_dict()
+    job.plan['count_cache'] = crawler.count_cache.stats()
+    if incremental is not None:
+        job.plan['incremental'] = incremental
+    job.estimated_requests = plan.estimated_requests
+    job.total_pages = plan.estimated_pages
+    logger.info(
+        f"🗺️ [Job {job.id}] Plan: {len(plan.windows)} windows, {plan.probe_count} probes, ~{plan.estimated_requests} requests, "
+        f"ETA ~{plan.estimated_seconds}s | Count cache: {job.plan['count_cache']}"
+    )
+
+    with transaction.atomic():
+        CrawlWindow.objects.bulk_create([
+            CrawlWindow(
+                crawl_job=job,
+                start_date=window['start_date'],
+                end_date=window['end_date'],
+                province_id=window['province_id'],
+                township_id=window['township_id'],
+                filters=window.get('filters') or {},
+                expected_count=window['count'],
+            )
+            for window in plan.windows
+        ])
+        job.total_records = total_count
+        job.save(update_fields=['total_records', 'plan', 'estimated_requests', 'total_pages'])
+    return total_count
+
+
+def _dispatch_windows(job, window_ids, note=''):
+    """اجرای پنجره‌ها به صورت chord از crawl_window با callback finalize_crawl_job"""
+    # پنجره‌ها به صورت round-robin روی صف ورکرهای آنلاین پخش می‌شوند
+    try:
+        queues = get_online_queues()
+    except Exception as e:
+        logger.warning(f"⚠️ [Job {job.id}] Could not inspect workers: {e}")
+        queues = []
+    if not queues:
+        queues = [job.target_queue or settings.CELERY_DEFAULT_QUEUE]
+
+    logger.info(f"🪟 [Job {job.id}] Dispatching {len(window_ids)} windows over {len(set(queues))} queues {note}")
+    tasks = [
+        crawl_window.s(window_id).set(queue=queues[index % len(queues)])
+        for index, window_id in enumerate(window_ids)
+    ]
+    chord(tasks)(finalize_crawl_job.s(job.id).set(queue=job.target_queue or settings.CELERY_DEFAULT_QUEUE))
+
+
+# Coordinator only: planning + dispatch. Each leaf window is its own task (crawl_window),
+# so one job spreads over every online worker and a restart re-runs only unfinished leaves.
+@shared_task(bind=True, max_retries=10, acks_late=True, time_limit=2 * 60 * 60, soft_time_limit=110 * 60)
 def run_crawl_job(self, job_id):
     """
-    Execute crawl job
-    
+    Plan a crawl job into leaf windows and fan them out as crawl_window tasks
+
     Args:
         job_id: Crawl job ID
     """
+    crawler = None
     try:
         logger.info(f"🚀 [Job {job_id}] Starting crawl job...")
         job = CrawlJob.objects.get(id=job_id)
-        
-        # Check if this is a resume (job was running before)
-        is_resume = job.status == 'running' and job.fetched_records > 0
-        resume_from_page = job.current_page if is_resume else 1
-        existing_records_count = job.records.count() if is_resume else 0
-        
-        if is_resume:
-            logger.info(f"🔄 [Job {job_id}] Resuming from checkpoint: {existing_records_count} records, page {resume_from_page}")
-        else:
-            logger.info(f"🆕 [Job {job_id}] Starting new crawl job")
-        
+
         # Update status
         job.status = 'running'
         if not job.started_at:  # Only set if not already set (for resume)
             job.started_at = timezone.now()
         job.task_id = self.request.id
-        job.save()
+        job.error_message = None
+        job.save(update_fields=['status', 'started_at', 'task_id', 'error_message'])
         logger.info(f"✅ [Job {job_id}] Status updated to running")
-        
-        # Parse dates
-        start_date = parse_api_date(job.start_date)
-        end_date = parse_api_date(job.end_date)
-        
-        if not start_date or not end_date:
-            raise ValueError("❌ Date parsing error")
-        
         logger.info(f"📅 [Job {job_id}] Date range: {job.start_date} to {job.end_date}")
-        
-        # Create crawler
-        crawler = MojavezCrawler()
-        
-        # Get total count for display
-        start_str = format_date_for_api(start_date)
-        end_str = format_date_for_api(end_date)
-        
-        logger.info(f"🔍 [Job {job_id}] Fetching total records count...")
-        total_count = crawler.get_records_count(
-            start_str,
-            end_str,
-            job.province_id,
-            job.township_id
-        )
-        
-        job.total_records = total_count
-        job.save()
-        logger.info(f"📊 [Job {job_id}] Total records: {total_count}")
-        
-        # Use crawl_date_range which implements the splitting strategy
-        # This will automatically split by date -> province -> city -> hours if needed
-        logger.info(f"🔄 [Job {job_id}] Starting crawl with splitting strategy...")
-        
-        # Save callback function - saves records immediately to database
-        def save_records_callback(records_batch):
-            """Callback to save records immediately to database"""
-            if not records_batch:
-                return 0
-            
-            saved = 0
-            with transaction.atomic():
-                for record_data in records_batch:
-                    # Skip if already exists (for resume)
-                    if record_data.get('request_number') and CrawlRecord.objects.filter(
-                        crawl_job=job,
-                        request_number=record_data.get('request_number')
-                    ).exists():
-                        continue
-                    
-                    CrawlRecord.objects.create(
-                        crawl_job=job,
-                        request_number=record_data.get('request_number'),
-                        applicant_name=record_data.get('applicant_name'),
-                        user_image=record_data.get('user_image'),
-                        license_title=record_data.get('license_title'),
-                        organization_title=record_data.get('organization_title'),
-                        province_id=record_data.get('province_id'),
-                        province_title=record_data.get('province_title'),
-                        township_id=record_data.get('township_id'),
-                        township_title=record_data.get('township_title'),
-                        responded_at=record_data.get('responded_at'),
-                        status_id=record_data.get('status', {}).get('status_id') if isinstance(record_data.get('status'), dict) else None,
-                        status_title=record_data.get('status', {}).get('status_title') if isinstance(record_data.get('status'), dict) else None,
-                        status_slug=record_data.get('status', {}).get('status_slug') if isinstance(record_data.get('status'), dict) else None,
-                        raw_data=record_data
-                    )
-                    saved += 1
-            
-            return saved
-        
-        # Progress callback function
-        def update_progress_callback(fetched_count, current_page=0, total_pages=0):
-            """Callback to update job progress during crawling"""
-            try:
-                job.refresh_from_db()
-                # Get actual count from database
-                actual_count = job.records.count()
-                job.fetched_records = actual_count
-                job.current_page = current_page
-                if total_pages > 0:
-                    job.total_pages = total_pages
-                elif job.total_records > 0:
-                    job.total_pages = (job.total_records + 20) // 21  # Estimate based on 21 per page
-                
-                if job.total_records > 0:
-                    job.progress_percentage = int((actual_count / job.total_records) * 100)
-                
-                job.save()
-                logger.info(f"📈 [Job {job_id}] Progress updated: {job.progress_percentage}% ({actual_count}/{job.total_records})")
-            except Exception as e:
-                logger.error(f"❌ [Job {job_id}] Error updating progress: {e}")
-        
-        # When resuming (احیا), always use direct pagination from current_page so we don't re-fetch from the start.
-        # Otherwise use splitting strategy for large counts, or direct pagination for small counts.
-        if total_count > crawler.MAX_RECORDS_PER_REQUEST and not is_resume:
-            logger.info(f"📊 [Job {job_id}] Count ({total_count}) exceeds limit ({crawler.MAX_RECORDS_PER_REQUEST}). Using splitting strategy...")
-            all_records = crawler.crawl_date_range(
-                start_date,
-                end_date,
-                job.province_id,
-                job.township_id,
-                progress_callback=update_progress_callback,
-                save_callback=save_records_callback
-            )
+
+        # هر اجرا (شروع یا احیا) با بودجه retry کامل آغاز می‌شود
+        retry_policy = get_retry_policy(job_id)
+        if retry_policy.budget is not None:
+            retry_policy.budget.reset()
+
+        if job.windows.exists():
+            # احیا: پنجره‌ها قبلاً ساخته شده‌اند؛ فقط پنجره‌های ناتمام دوباره اجرا می‌شوند
+            logger.info(f"🔄 [Job {job_id}] Resuming: windows already planned")
         else:
-            # Direct pagination (with resume from current_page when is_resume)
-            if is_resume:
-                logger.info(f"📊 [Job {job_id}] Resuming from page {resume_from_page} ({existing_records_count} records already in DB)...")
-            else:
-                logger.info(f"📊 [Job {job_id}] Count ({total_count}) is within limit. Using direct pagination...")
-            
-            # Check if resuming - skip already fetched records
-            if is_resume and existing_records_count > 0:
-                # Get already fetched request_numbers to avoid duplicates
-                existing_request_numbers = set(
-                    job.records.values_list('request_number', flat=True).exclude(request_number__isnull=True)
-                )
-                logger.info(f"📋 [Job {job_id}] Found {len(existing_request_numbers)} existing records. Resuming from page {resume_from_page}")
-            else:
-                existing_request_numbers = set()
-                resume_from_page = 1
-            
-            all_records = []
-            page = resume_from_page
-            
-            while True:
-                # Check if cancelled
-                job.refresh_from_db()
-                if job.status == 'cancelled':
-                    logger.warning(f"⚠️ [Job {job_id}] Job was cancelled")
-                    break
-                
-                # Fetch records with retry logic
-                max_fetch_retries = 10
-                fetch_retry_delay = 2
-                result = None
-                records = []
-                pagination = {}
-                
-                for fetch_attempt in range(1, max_fetch_retries + 1):
-                    try:
-                        logger.info(f"📄 [Job {job_id}] Fetching page {page} (attempt {fetch_attempt}/{max_fetch_retries})...")
-                        result = crawler.fetch_records(
-                            start_str,
-                            end_str,
-                            job.province_id,
-                            job.township_id,
-                            page=page
-                        )
-                        
-                        # Handle new response structure
-                        if isinstance(result, dict):
-                            records = result.get('records', [])
-                            pagination = result.get('pagination', {})
-                        else:
-                            records = result if result else []
-                            pagination = {}
-                        
-                        # Success - break retry loop
-                        break
-                        
-                    except Exception as fetch_error:
-                        if fetch_attempt < max_fetch_retries:
-                            logger.warning(f"⚠️ [Job {job_id}] Error fetching page {page} (attempt {fetch_attempt}/{max_fetch_retries}): {fetch_error}. Retrying in {fetch_retry_delay}s...")
-                            time.sleep(fetch_retry_delay)
-                            fetch_retry_delay *= 2
-                            continue
-                        else:
-                            logger.error(f"❌ [Job {job_id}] Failed to fetch page {page} after {max_fetch_retries} attempts: {fetch_error}")
-                            page += 1
-                            fetch_retry_delay = 2
-                            continue
-                
-                if not records:
-                    logger.info(f"ℹ️ [Job {job_id}] No more records found")
-                    break
-                
-                # Filter out already fetched records (for resume)
-                if is_resume and existing_request_numbers:
-                    new_records = [r for r in records if r.get('request_number') not in existing_request_numbers]
-                    skipped = len(records) - len(new_records)
-                    if skipped > 0:
-                        logger.info(f"⏭️ [Job {job_id}] Skipped {skipped} duplicate records on page {page}")
-                    records = new_records
-                
-                # Save records immediately to database
-                if records:
-                    saved_count = save_records_callback(records)
-                    logger.info(f"💾 [Job {job_id}] Saved {saved_count} records from page {page} to database")
-                
-                all_records.extend(records)
-                
-                # Update progress based on actual database count
-                job.refresh_from_db()
-                actual_count = job.records.count()
-                job.fetched_records = actual_count
-                job.current_page = page
-                
-                if job.total_records > 0:
-                    job.progress_percentage = int((actual_count / job.total_records) * 100)
-                    per_page = pagination.get('per_page', 21) or 21
-                    job.total_pages = (job.total_records + per_page - 1) // per_page
-                
-                job.save()
-                logger.info(f"📈 [Job {job_id}] Progress: {job.progress_percentage}% ({actual_count}/{job.total_records}) - Page {page}/{job.total_pages}")
-                
-                # Check if we should continue
-                total_pages = pagination.get('total_pages', job.total_pages)
-                if total_pages > 0 and page >= total_pages:
-                    break
-                
-                if len(records) < 21 and page > 1:  # Assuming 21 per page
-                    break
-                
-                page += 1
-                time.sleep(0.5)
-        
-        # Records are already saved during crawling via save_callback
-        # Just verify final count
-        job.refresh_from_db()
-        final_saved_count = job.records.count()
-        logger.info(f"✅ [Job {job_id}] All records saved. Total in database: {final_saved_count}")
-        
-        # Complete crawl
-        job.refresh_from_db()
-        final_count = job.records.count()  # Get actual count from database
-        job.status = 'completed'
-        job.completed_at = timezone.now()
-        job.fetched_records = final_count
-        job.progress_percentage = 100
-        job.save()
-        
-        logger.info(f"✅ [Job {job_id}] Completed successfully! Total records: {final_count}")
-
-        # After main crawl is completed, automatically start detail fetching task
-        try:
-            from .tasks import fetch_mojavez_details_for_job
-            logger.info(f"🧾 [Job {job_id}] Triggering detail fetch task...")
-            fetch_mojavez_details_for_job.delay(job_id)
-        except Exception as e:
-            logger.error(f"❌ [Job {job_id}] Failed to trigger detail fetch task: {e}")
-        
-        return {
-            'job_id': job_id,
-            'total_records': final_count,
-            'status': 'completed'
-        }
-        
+            logger.info(f"🆕 [Job {job_id}] Starting new crawl job")
+            crawler = MojavezCrawler(
+                max_concurrency=settings.CRAWLER_MAX_CONCURRENCY,
+                count_cache=DjangoCountCache(),
+                reference_data=get_shared_reference_data(),
+                rate_limiter=get_shared_rate_limiter(),
+                retry_policy=retry_policy,
+                circuit_breaker=get_shared_circuit_breaker(),
+                transport=get_shared_transport(),
+                subday_format=_subday_format_setting()
+            )
+            _plan_crawl_windows(job, crawler)
+            crawler.close()
+            crawler = None
+
+        unfinished = list(job.windows.exclude(status='completed').values_list('id', flat=True))
+        done = job.windows.filter(status='completed').count()
+        if not unfinished:
+            return finalize_crawl_job([], job_id)
+
+        job.windows.filter(id__in=unfinished).update(status='pending', error_message=None)
+        _dispatch_windows(job, unfinished, f"({done} already completed)")
+        return {'job_id': job_id, 'status': 'dispatched', 'windows': len(unfinished)}
+
     except CrawlJob.DoesNotExist:
         logger.error(f"❌ [Job {job_id}] Job not found")
         return {'error': 'Job not found'}
+    except CircuitOpenError as e:
+        # سرور از دسترس خارج است: جاب failed نمی‌شود و بعد از باز شدن circuit دوباره plan می‌شود
+        if crawler is not None:
+            crawler.close()
+        countdown = _circuit_countdown(e)
+        logger.warning(f"🔌 [Job {job_id}] Upstream unavailable, planning again in {countdown:.0f}s")
+        raise self.retry(exc=e, countdown=countdown, max_retries=self.request.retries + 1)
     except Exception as e:
         # On error
         logger.error(f"❌ [Job {job_id}] Error: {str(e)}")
+        if crawler is not None:
+            crawler.close()
         try:
             job = CrawlJob.objects.get(id=job_id)
             job.status = 'failed'
@@ -311,7 +455,7 @@ def run_crawl_job(self, job_id):
             job.save()
         except:
             pass
-        
+
         # Retry if needed (with exponential backoff)
         retry_count = self.request.retries
         countdown = min(60 * (2 ** retry_count), 600)  # Max 10 minutes
@@ -319,11 +463,370 @@ def run_crawl_job(self, job_id):
         raise self.retry(exc=e, countdown=countdown)
 
 
+@shared_task(bind=True, max_retries=5, acks_late=True, time_limit=6 * 60 * 60, soft_time_limit=350 * 60)
+def crawl_window(self, window_id: int, circuit_waits: int = 0):
+    """
+    دریافت همه صفحات یک پنجره برگ و ذخیره رکوردهای آن
+
+    هر صفحه ذخیره‌شده در CrawlPageCheckpoint ثبت می‌شود؛ اجرای دوباره همین پنجره (retry یا احیا)
+    فقط صفحاتی را می‌گیرد که checkpoint ندارند.
+    هر خطا (حتی قبل از شروع دریافت، مثل ساخت کراولر یا خطای دیتابیس) به _window_error می‌رسد:
+    retry یا failed کردن پنجره؛ جز Retry هیچ exception بالا نمی‌رود تا callback chord
+    (finalize_crawl_job) همیشه اجرا شود.
+    انتظار برای باز شدن circuit (circuit_waits) از سهمیه retry پنجره کم نمی‌شود.
+    """
+    try:
+        return _crawl_window(self, window_id)
+    except Retry:
+        raise
+    except Exception as e:
+        return _window_error(self, window_id, circuit_waits, e)
+
+
+def _window_error(task, window_id: int, circuit_waits: int, error: Exception):
+    """retry پنجره بعد از خطا یا failed کردن آن وقتی سهمیه retry تمام شده است"""
+    logger.error(f"❌ Window {window_id}: Error: {error}")
+    retries = task.request.retries - circuit_waits
+    try:
+        if isinstance(error, CircuitOpenError):
+            # صفحات ذخیره‌شده checkpoint دارند؛ بعد از باز شدن circuit از همان‌جا ادامه می‌دهیم
+            CrawlWindow.objects.filter(id=window_id).update(status='pending', error_message=str(error))
+            raise task.retry(
+                exc=error,
+                countdown=_circuit_countdown(error),
+                max_retries=task.request.retries + 1,
+                kwargs={'circuit_waits': circuit_waits + 1}
+            )
+        if retries < task.max_retries:
+            CrawlWindow.objects.filter(id=window_id).update(status='pending', error_message=str(error))
+            # سقف retry با انتظارهای circuit جابه‌جا می‌شود وگرنه celery به جای retry خود خطا را بالا می‌دهد
+            raise task.retry(
+                exc=error,
+                countdown=min(30 * (2 ** retries), 600),
+                max_retries=circuit_waits + task.max_retries
+            )
+    except Retry:
+        raise
+    except Exception as retry_error:
+        logger.error(f"❌ Window {window_id}: could not schedule a retry: {retry_error}")
+    try:
+        CrawlWindow.objects.filter(id=window_id).update(
+            status='failed',
+            error_message=str(error),
+            completed_at=timezone.now()
+        )
+    except Exception as db_error:
+        logger.error(f"❌ Window {window_id}: could not mark as failed: {db_error}")
+    return {'window_id': window_id, 'status': 'failed', 'saved': 0}
+
+
+def _crawl_window(task, window_id: int):
+    """بدنه crawl_window؛ خطاها بعد از ذخیره رکوردهای در صف بالا داده می‌شوند"""
+    try:
+        window = CrawlWindow.objects.select_related('crawl_job').get(id=window_id)
+    except CrawlWindow.DoesNotExist:
+        logger.error(f"❌ Window {window_id} not found")
+        return {'window_id': window_id, 'status': 'not_found', 'saved': 0}
+    job = window.crawl_job
+    label = f"[Job {job.id}] Window {window_id} ({window})"
+
+    if window.status == 'completed':
+        return {'window_id': window_id, 'status': 'completed', 'saved': 0}
+    if job.status == 'cancelled':
+        CrawlWindow.objects.filter(id=window_id).update(status='cancelled')
+        return {'window_id': window_id, 'status': 'cancelled', 'saved': 0}
+
+    CrawlWindow.objects.filter(id=window_id).update(
+        status='running',
+        attempts=F('attempts') + 1,
+        task_id=task.request.id,
+        started_at=timezone.now()
+    )
+    logger.info(f"🪟 {label}: fetching ~{window.expected_count} records")
+
+    crawler = MojavezCrawler(
+        max_concurrency=settings.CRAWLER_MAX_CONCURRENCY,
+        reference_data=get_shared_reference_data(),
+        rate_limiter=get_shared_rate_limiter(),
+        retry_policy=get_retry_policy(job.id),
+        circuit_breaker=get_shared_circuit_breaker(),
+        transport=get_shared_transport()
+    )
+    # Progress: همه پنجره‌ها با F() به همان شمارنده جاب اضافه می‌کنند
+    tracker = ProgressTracker(
+        job.id,
+        total_records=job.total_records,
+        page_size=crawler.PAGE_SIZE,
+        min_interval=settings.CRAWLER_PROGRESS_INTERVAL,
+        min_batches=settings.CRAWLER_PROGRESS_BATCHES
+    )
+    cancelled = threading.Event()
+
+    def after_flush(saved, progress):
+        tracker.record(saved)
+        if tracker.maybe_flush() and tracker.status == 'cancelled' and not cancelled.is_set():
+            logger.warning(f"⚠️ {label}: job was cancelled")
+            cancelled.set()
+
+    # صفحاتی که در اجرای قبلی ذخیره شده‌اند دوباره دریافت نمی‌شوند
+    done_pages = set(window.checkpoints.values_list('page', flat=True))
+    if done_pages:
+        logger.info(f"🔄 {label}: resuming, {len(done_pages)} pages already checkpointed")
+
+    writer = RecordWriter(
+        lambda records_batch: save_crawl_records(job, records_batch),
+        after_flush=after_flush,
+        save_checkpoints=lambda checkpoints: save_page_checkpoints(window, checkpoints),
+        max_pending_pages=settings.CRAWLER_WRITER_QUEUE_PAGES,
+        max_batch_records=settings.CRAWLER_WRITER_BATCH_RECORDS,
+        name=f'record-writer-{job.id}-{window_id}'
+    ).start()
+
+    try:
+        pages = crawler.iter_pages(
+            window.start_date,
+            window.end_date,
+            window.province_id,
+            window.township_id,
+            expected_count=window.expected_count,
+            should_stop=cancelled.is_set,
+            skip_pages=done_pages,
+            filters=window.filters or None
+        )
+        for item in pages:
+            if window.expected_count is None and item['total']:
+                # count پنجره در planning نامعلوم ماند؛ total صفحه اول جای آن را می‌گیرد تا audit معنا داشته باشد
+                window.expected_count = item['total']
+                CrawlWindow.objects.filter(id=window_id).update(expected_count=item['total'])
+                logger.info(f"📊 {label}: count taken from first page: {item['total']}")
+            # checkpoint صفحه بعد از ذخیره رکوردهایش در همان thread نویسنده ثبت می‌شود
+            writer.put(item['records'], checkpoint=(item['page'], len(item['records'])))
+        writer.close()
+    except Exception:
+        try:
+            writer.close()
+        except Exception as writer_error:
+            logger.error(f"❌ {label}: Error flushing records: {writer_error}")
+        tracker.flush()
+        raise
+    finally:
+        crawler.close()
+        # آمار تجمعی pool مشترک این پروسه (نسبت استفاده دوباره از اتصال‌ها)
+        get_shared_transport().log_stats(f"{label}: worker ")
+
+    tracker.flush()
+    window_status = 'cancelled' if cancelled.is_set() else 'completed'
+    received = window_received_count(window_id)
+    CrawlWindow.objects.filter(id=window_id).update(
+        status=window_status,
+        fetched_records=F('fetched_records') + writer.saved,
+        received_count=received,
+        completed_at=timezone.now()
+    )
+    logger.info(f"✅ {label}: {window_status}, {writer.saved} new records")
+    if window_status == 'completed' and received < min(window.expected_count or 0, crawler.MAX_RECORDS_PER_REQUEST):
+        logger.warning(f"⚠️ {label}: received {received} of {window.expected_count} expected records")
+    return {'window_id': window_id, 'status': window_status, 'saved': writer.saved}
+
+
+def _advance_watermark(job):
+    """
+    ثبت high-water mark محدوده بعد از تکمیل یک جاب افزایشی بدون پنجره ناقص
+
+    synced_until عقب نمی‌رود و اگر بازه جاب به watermark فعلی نچسبد (روزهای وسط کراول نشده‌اند)
+    جلو نمی‌رود؛ day_counts فقط CRAWLER_INCREMENTAL_LOOKBACK_DAYS روز آخر را نگه می‌دارد.
+    """
+    incremental = (job.plan or {}).get('incremental')
+    if job.mode != 'incremental' or incremental is None:
+        return
+    start_date = parse_api_date(job.start_date)
+    end_date = parse_api_date(job.end_date)
+    with transaction.atomic():
+        watermark, _ = CrawlWatermark.objects.select_for_update().get_or_create(
+            key=CrawlWatermark.scope_key(job.province_id, job.township_id),
+            defaults={
+                'province_id': job.province_id,
+                'township_id': job.township_id,
+                'synced_until': job.end_date,
+            }
+        )
+        synced_until = parse_api_date(watermark.synced_until) or end_date
+        if start_date > synced_until + timedelta(days=1):
+            logger.warning(
+                f"⚠️ [Job {job.id}] Watermark not advanced: {job.start_date} is after "
+                f"{watermark.synced_until} + 1 day (days in between were never synced)"
+            )
+            return
+        synced_until = max(synced_until, end_date)
+        oldest = synced_until - timedelta(days=max(1, settings.CRAWLER_INCREMENTAL_LOOKBACK_DAYS) - 1)
+        day_counts = {**watermark.day_counts, **incremental['day_counts']}
+        watermark.day_counts = {
+            day: count for day, count in day_counts.items()
+            if (parse_api_date(day) or oldest) >= oldest
+        }
+        watermark.synced_until = format_date_for_api(synced_until)
+        watermark.last_job = job
+        watermark.save()
+    logger.info(f"🔂 [Job {job.id}] Watermark {watermark} ({len(watermark.day_counts)} day counts)")
+
+
+@shared_task
+def finalize_crawl_job(window_results, job_id: int):
+    """
+    callback chord: تطبیق شمارنده با جدول، audit کامل بودن و بستن جاب
+
+    جاب فقط وقتی completed می‌شود که همه پنجره‌ها completed باشند؛ در غیر این صورت failed
+    می‌شود و requeue فقط پنجره‌های ناتمام را دوباره اجرا می‌کند.
+    پنجره‌هایی که کمتر از count خود رکورد گرفته‌اند (تا CRAWLER_AUDIT_MAX_REFETCHES بار) فقط
+    همان صفحات ناقص را دوباره می‌گیرند و این callback بعد از آن‌ها دوباره اجرا می‌شود.
+    """
+    job = CrawlJob.objects.get(id=job_id)
+    # One COUNT per run reconciles the incremental counters with the table
+    final_count = job.records.count()
+
+    if job.status == 'cancelled':
+        CrawlJob.objects.filter(id=job_id).update(fetched_records=final_count)
+        logger.warning(f"🛑 [Job {job_id}] Stopped after cancellation with {final_count} records saved")
+        return {'job_id': job_id, 'total_records': final_count, 'status': 'cancelled'}
+
+    unfinished = job.windows.exclude(status='completed').count()
+    job.fetched_records = final_count
+    job.completed_at = timezone.now()
+    if unfinished:
+        job.status = 'failed'
+        job.error_message = f"{unfinished} of {job.windows.count()} windows did not complete"
+        job.save(update_fields=['status', 'fetched_records', 'completed_at', 'error_message'])
+        logger.error(f"❌ [Job {job_id}] {job.error_message} ({final_count} records saved)")
+        return {'job_id': job_id, 'total_records': final_count, 'status': 'failed'}
+
+    job.audit = audit_job(job)
+    refetch = prepare_refetch(job.audit['under_filled'], settings.CRAWLER_AUDIT_MAX_REFETCHES)
+    if refetch:
+        CrawlJob.objects.filter(id=job_id).update(fetched_records=final_count, audit=job.audit)
+        logger.warning(
+            f"🔁 [Job {job_id}] Audit: {len(job.audit['under_filled'])} under-filled windows "
+            f"({job.audit['missing']} records missing); re-fetching {len(refetch)}"
+        )
+        _dispatch_windows(job, refetch, '(audit re-fetch)')
+        return {'job_id': job_id, 'total_records': final_count, 'status': 'refetching', 'windows': len(refetch)}
+
+    job.status = 'completed'
+    job.progress_percentage = 100
+    job.error_message = None
+    if job.audit['under_filled'] or job.audit['unreachable']:
+        job.error_message = (
+            f"Incomplete: {len(job.audit['under_filled'])} under-filled windows ({job.audit['missing']} records missing), "
+            f"{job.audit['unreachable']} records beyond the API cap"
+        )
+        logger.error(f"❌ [Job {job_id}] {job.error_message}")
+    job.save(update_fields=['status', 'fetched_records', 'completed_at', 'progress_percentage', 'audit', 'error_message'])
+    logger.info(f"✅ [Job {job_id}] Completed successfully! Total records: {final_count}")
+    if not job.audit['under_filled']:
+        _advance_watermark(job)
+
+    # After main crawl is completed, automatically start detail fetching task
+    try:
+        logger.info(f"🧾 [Job {job_id}] Triggering detail fetch task...")
+        fetch_mojavez_details_for_job.delay(job_id)
+    except Exception as e:
+        logger.error(f"❌ [Job {job_id}] Failed to trigger detail fetch task: {e}")
+
+    return {'job_id': job_id, 'total_records': final_count, 'status': 'completed'}
+
+
+@shared_task
+def refetch_incomplete_windows(job_id: int):
+    """
+    دریافت دوباره هدفمند پنجره‌های ناقص یک جاب (دستی؛ سقف CRAWLER_AUDIT_MAX_REFETCHES اعمال نمی‌شود)
+
+    فقط صفحات ناقص/جاافتاده پنجره‌های under-filled دوباره دریافت می‌شوند، نه کل جاب.
+    """
+    job = CrawlJob.objects.get(id=job_id)
+    report = audit_job(job)
+    refetch = prepare_refetch(report['under_filled'])
+    if not refetch:
+        CrawlJob.objects.filter(id=job_id).update(audit=report)
+        logger.info(f"✅ [Job {job_id}] Audit: no under-filled windows to re-fetch")
+        return {'job_id': job_id, 'status': 'complete', 'windows': 0}
+
+    CrawlJob.objects.filter(id=job_id).update(status='running', audit=report, completed_at=None)
+    _dispatch_windows(job, refetch, '(manual re-fetch)')
+    return {'job_id': job_id, 'status': 'refetching', 'windows': len(refetch)}
+
+
+def _detail_shard_ranges(pending_qs, shard_count):
+    """
+    تقسیم رکوردهای بدون detail به بازه‌های id با تعداد تقریباً برابر
+
+    مرزها از خود idهای pending (هر n-امین id) برداشته می‌شوند، نه از min/max،
+    تا شکاف‌های id باعث shardهای خالی نشوند.
+
+    Returns:
+        لیست (first_id, last_id) شامل هر دو سر
+    """
+    total = pending_qs.count()
+    if not total:
+        return []
+    shard_count = max(1, min(shard_count, total))
+    step = -(-total // shard_count)  # ceil
+    # یک بار پیمایش idها به ترتیب (نه یک OFFSET جدا برای هر مرز)
+    ranges = []
+    first_id = last_id = None
+    ids = pending_qs.order_by('id').values_list('id', flat=True).iterator(chunk_size=BULK_CREATE_BATCH_SIZE)
+    for index, record_id in enumerate(ids):
+        if index % step == 0:
+            if first_id is not None:
+                ranges.append((first_id, last_id))
+            first_id = record_id
+        last_id = record_id
+    if first_id is not None:
+        ranges.append((first_id, last_id))
+    return ranges
+
+
+def _claim_detail_batch(job_id, first_id, last_id, batch_size):
+    """
+    رزرو اتمیک یک دسته رکورد بدون detail در بازه shard
+
+    fetch_detail_shard بعد از هر دسته first_id را از آخرین id رزروشده جلو می‌برد، پس رکوردی که
+    در همین اجرا خطا داد و رزروش آزاد شد دوباره در همین حلقه برداشته نمی‌شود.
+
+    SELECT ... FOR UPDATE SKIP LOCKED تضمین می‌کند دو ورکر هرگز یک رکورد را با هم نگیرند؛
+    رزرو بعد از CRAWLER_DETAIL_CLAIM_TTL ثانیه منقضی می‌شود تا رکوردهای shard کرش‌کرده
+    دوباره قابل برداشت باشند.
+    """
+    now = timezone.now()
+    stale_before = now - timedelta(seconds=settings.CRAWLER_DETAIL_CLAIM_TTL)
+    with transaction.atomic():
+        records = list(
+            CrawlRecord.objects
+            .select_for_update(skip_locked=True, of=('self',))
+            .filter(
+                crawl_job_id=job_id,
+                id__gte=first_id,
+                id__lte=last_id,
+                request_number__isnull=False,
+            )
+            .filter(missing_detail_filter())
+            .filter(Q(detail_claimed_at__isnull=True) | Q(detail_claimed_at__lt=stale_before))
+            .exclude(request_number='')
+            .order_by('id')
+            .only('id', 'request_number')[:batch_size]
+        )
+        if records:
+            CrawlRecord.objects.filter(id__in=[record.id for record in records]).update(detail_claimed_at=now)
+    return records
+
+
 @shared_task(bind=True, max_retries=5, acks_late=True, time_limit=24 * 60 * 60, soft_time_limit=23 * 60 * 60)
 def fetch_mojavez_details_for_job(self, job_id: int):
     """
-    برای همه رکوردهای یک CrawlJob، صفحه track را با BeautifulSoup می‌خواند
-    و جدول mojavez_detail را پر می‌کند.
+    برای همه رکوردهای یک CrawlJob، جزئیات مجوز (GraphQL و در صورت نیاز صفحه track) را
+    می‌گیرد و جدول mojavez_detail را پر می‌کند.
+
+    این تسک فقط هماهنگ‌کننده است: رکوردهای باقیمانده به shardهایی بر اساس بازه id تقسیم و
+    به صورت chord روی صف ورکرهای آنلاین پخش می‌شوند؛ finalize_detail_job بعد از پایان همه
+    shardها وضعیت را completed / partial / failed می‌کند.
     """
     try:
         job = CrawlJob.objects.get(id=job_id)
@@ -331,102 +834,269 @@ def fetch_mojavez_details_for_job(self, job_id: int):
         logger.error(f"❌ [Detail Job {job_id}] CrawlJob not found")
         return {'job_id': job_id, 'status': 'not_found'}
 
-    # در حالت احیا، رکوردهایی که قبلاً mojavez_detail دارند را دوباره پردازش نکن.
-    # تعداد جزئیات موجود را به عنوان processed اولیه در نظر می‌گیریم و فقط رکوردهای بدون detail را پردازش می‌کنیم.
-    existing_details_count = MojavezDetail.objects.filter(crawl_record__crawl_job=job).count()
-    pending_qs = job.records.filter(detail__isnull=True)
+    # در حالت احیا، رکوردهایی که قبلاً mojavez_detail دارند را دوباره پردازش نکن؛ رکوردهایی هم که مجوزشان
+    # detail تازه دارد (License.detail، از هر جابی) درخواست نمی‌شوند. این‌ها processed اولیه حساب می‌شوند.
+    pending_qs = job.records.filter(missing_detail_filter())
     total_records = job.records.count()
+    existing_details_count = total_records - pending_qs.count()
+    reused = existing_details_count - MojavezDetail.objects.filter(crawl_record__crawl_job=job).count()
 
     job.detail_total = total_records
     job.detail_processed = existing_details_count
-    # خطاهای قبلی را حفظ می‌کنیم؛ اگر اولین بار است معمولاً صفر است.
-    errors = job.detail_errors or 0
-    job.detail_errors = errors
+    # رکوردهای خطادار اجرای قبلی رزروشان آزاد شده و دوباره pending هستند، پس خطاها از صفر شمرده می‌شوند.
+    job.detail_errors = 0
     job.detail_status = 'running'
     job.save(update_fields=['detail_total', 'detail_processed', 'detail_errors', 'detail_status'])
 
+    # یک shard به ازای هر thread ورکر آنلاین (یا CRAWLER_DETAIL_SHARDS اگر تنظیم شده باشد)
+    try:
+        queues = get_online_queues()
+    except Exception as e:
+        logger.warning(f"⚠️ [Detail Job {job_id}] Could not inspect workers: {e}")
+        queues = []
+    if not queues:
+        queues = [job.target_queue or settings.CELERY_DEFAULT_QUEUE]
+    shard_count = settings.CRAWLER_DETAIL_SHARDS or len(queues) * settings.CELERY_WORKER_CONCURRENCY
+    ranges = _detail_shard_ranges(pending_qs, shard_count)
+
     logger.info(
-        f"🧾 [Detail Job {job_id}] Fetching mojavez_detail for {pending_qs.count()} remaining records "
-        f"(already have details for {existing_details_count} records out of {total_records})."
+        f"🧾 [Detail Job {job_id}] Fetching mojavez_detail for remaining records in {len(ranges)} shards "
+        f"over {len(set(queues))} queues (already have details for {existing_details_count} records out of {total_records}, "
+        f"{reused} of them through the licence's existing detail)."
     )
 
-    crawler = MojavezCrawler()
-    processed_this_run = 0
-    graphql_success = 0
-    graphql_fail = 0
-    html_fallback_used = 0
-    html_fallback_failed = 0
+    if not ranges:
+        job.detail_status = 'completed'
+        job.save(update_fields=['detail_status'])
+        return {'job_id': job_id, 'processed': 0, 'errors': 0, 'shards': 0}
 
-    # فقط رکوردهایی را می‌گیریم که هنوز detail ندارند (برای جلوگیری از duplicate key)
-    for record in pending_qs.iterator():
-        if not record.request_number:
-            continue
+    shards = [
+        fetch_detail_shard.s(job_id, first_id, last_id).set(queue=queues[index % len(queues)])
+        for index, (first_id, last_id) in enumerate(ranges)
+    ]
+    chord(shards)(finalize_detail_job.s(job_id).set(queue=job.target_queue or settings.CELERY_DEFAULT_QUEUE))
+    return {'job_id': job_id, 'status': 'dispatched', 'shards': len(ranges)}
 
-        try:
-            # First try GraphQL-based detail fetch
-            parsed = crawler.fetch_detail_via_graphql(record.request_number)
-
-            # Fallback to HTML track page if GraphQL fails
-            if not parsed:
-                graphql_fail += 1
-                html = crawler.fetch_track_page(record.request_number)
-                if not html:
-                    html_fallback_failed += 1
-                    errors += 1
-                    continue
-                parsed = crawler.parse_track_html(html, request_number=record.request_number)
-                parsed["source"] = "html"
-                html_fallback_used += 1
-            else:
-                graphql_success += 1
-
-            MojavezDetail.objects.create(
-                crawl_record=record,
-                request_number=parsed.get("request_number") or record.request_number,
-                license_title=parsed.get("license_title"),
-                organization_title=parsed.get("organization_title"),
-                isic_code=parsed.get("isic_code"),
-                issue_type=parsed.get("issue_type"),
-                issued_at=parsed.get("issued_at"),
-                expires_at=parsed.get("expires_at"),
-                province_title=parsed.get("province_title_detail"),
-                township_title=parsed.get("township_title_detail"),
-                postal_code=parsed.get("postal_code"),
-                business_address=parsed.get("business_address"),
-                status_title=parsed.get("status_title"),
-                status_slug=parsed.get("status_slug"),
-                raw_data=parsed,
+
+@shared_task(bind=True, max_retries=5, acks_late=True, time_limit=24 * 60 * 60, soft_time_limit=23 * 60 * 60)
+def fetch_detail_shard(self, job_id: int, first_id: int, last_id: int, circuit_waits: int = 0):
+    """
+    دریافت جزئیات رکوردهای یک shard (بازه id) با رزرو اتمیک دسته‌ها
+
+    پیشرفت هر دسته با F() مستقیماً به CrawlJob.detail_processed / detail_errors اضافه می‌شود.
+    مثل crawl_window هر خطا (دیتابیس، SoftTimeLimitExceeded، ...) به _detail_shard_error می‌رسد:
+    رزرو رکوردهای shard آزاد و shard دوباره زمان‌بندی می‌شود یا نتیجه failed برمی‌گردد؛ جز Retry
+    هیچ exception بالا نمی‌رود تا finalize_detail_job همیشه اجرا شود.
+    """
+    stats = {
+        'processed': 0,
+        'errors': 0,
+        'graphql_success': 0,
+        'graphql_fail': 0,
+        'html_fallback_used': 0,
+        'html_fallback_failed': 0,
+    }
+    try:
+        _fetch_detail_shard(job_id, first_id, last_id, stats)
+    except Retry:
+        raise
+    except Exception as e:
+        return _detail_shard_error(self, job_id, first_id, last_id, circuit_waits, stats, e)
+    return {'job_id': job_id, 'first_id': first_id, 'last_id': last_id, 'status': 'completed', **stats}
+
+
+def _release_detail_claims(job_id: int, first_id: int, last_id: int):
+    """آزاد کردن رزرو رکوردهای بدون detail بازه shard تا retry یا اجرای بعدی آن‌ها را بردارد"""
+    CrawlRecord.objects.filter(
+        crawl_job_id=job_id, id__gte=first_id, id__lte=last_id, detail_claimed_at__isnull=False
+    ).filter(missing_detail_filter()).update(detail_claimed_at=None)
+
+
+def _detail_shard_error(task, job_id: int, first_id: int, last_id: int, circuit_waits: int, stats, error: Exception):
+    """retry یک shard بعد از خطا یا برگرداندن نتیجه failed وقتی سهمیه retry تمام شده است"""
+    label = f"[Detail Job {job_id}] Shard {first_id}-{last_id}"
+    try:
+        _release_detail_claims(job_id, first_id, last_id)
+    except Exception as db_error:
+        logger.error(f"❌ {label}: could not release claimed records: {db_error}")
+    retries = task.request.retries - circuit_waits
+    try:
+        if isinstance(error, CircuitOpenError):
+            countdown = _circuit_countdown(error)
+            logger.warning(f"🔌 {label} paused for {countdown:.0f}s: upstream unavailable")
+            raise task.retry(
+                exc=error,
+                countdown=countdown,
+                max_retries=task.request.retries + 1,
+                kwargs={'circuit_waits': circuit_waits + 1}
+            )
+        logger.error(f"❌ {label}: Error: {error}")
+        if retries < task.max_retries:
+            raise task.retry(
+                exc=error,
+                countdown=min(30 * (2 ** retries), 600),
+                max_retries=circuit_waits + task.max_retries
             )
-            processed_this_run += 1
-            existing_details_count += 1
+    except Retry:
+        raise
+    except Exception as retry_error:
+        logger.error(f"❌ {label}: could not schedule a retry: {retry_error}")
+    return {
+        'job_id': job_id, 'first_id': first_id, 'last_id': last_id,
+        'status': 'failed', 'error': str(error), **stats
+    }
+
 
-            # Update job detail progress (بر اساس مجموع جزئیات موجود)
-            job.detail_processed = existing_details_count
-            job.save(update_fields=['detail_processed'])
+def _fetch_detail_shard(job_id: int, first_id: int, last_id: int, stats):
+    """بدنه fetch_detail_shard؛ stats در همان جا پر می‌شود تا نتیجه failed هم پیشرفت را نشان دهد"""
+    crawler = MojavezCrawler(
+        max_concurrency=settings.CRAWLER_MAX_CONCURRENCY,
+        reference_data=get_shared_reference_data(),
+        rate_limiter=get_shared_rate_limiter(),
+        detail_batch_size=settings.CRAWLER_DETAIL_QUERY_BATCH_SIZE,
+        retry_policy=get_retry_policy(job_id),
+        circuit_breaker=get_shared_circuit_breaker(),
+        transport=get_shared_transport()
+    )
 
-            # تاخیر خیلی کوتاه برای احترام به سرور
-            time.sleep(0.3)
+    def process_batch(records):
+        """دریافت همزمان جزئیات یک دسته (GraphQL و در صورت نیاز صفحه track) و یک bulk_create"""
+        failed_ids = []
+        details = []
+        try:
+            results = crawler.fetch_details_with_fallback([record.request_number for record in records])
+        except CircuitOpenError:
+            # خطا حساب نمی‌شود: رزرو رکوردها آزاد می‌شود تا بعد از باز شدن circuit دوباره گرفته شوند
+            CrawlRecord.objects.filter(id__in=[record.id for record in records]).update(detail_claimed_at=None)
+            raise
         except Exception as e:
-            logger.error(f"❌ [Detail Job {job_id}] Error fetching detail for {record.request_number}: {e}")
-            errors += 1
-            job.detail_errors = errors
-            job.save(update_fields=['detail_errors'])
+            logger.error(f"❌ [Detail Job {job_id}] Error fetching detail batch of {len(records)} records: {e}")
+            failed_ids = [record.id for record in records]
+        else:
+            for record, parsed in zip(records, results):
+                if not parsed:
+                    stats['graphql_fail'] += 1
+                    stats['html_fallback_failed'] += 1
+                    failed_ids.append(record.id)
+                    continue
+                if parsed.get("source") == "html":
+                    stats['graphql_fail'] += 1
+                    stats['html_fallback_used'] += 1
+                else:
+                    stats['graphql_success'] += 1
+                details.append(build_mojavez_detail(record, parsed))
 
-    job.detail_status = 'completed'
-    job.save(update_fields=['detail_status'])
+        saved = save_mojavez_details(details)
+        if failed_ids:
+            # خطای گذرا نباید detail را برای همیشه جا بیندازد: اجرای بعدی fetch_details دوباره برشان می‌دارد
+            CrawlRecord.objects.filter(id__in=failed_ids).update(detail_claimed_at=None)
+        batch_errors = len(failed_ids)
+        stats['processed'] += saved
+        stats['errors'] += batch_errors
+        # Update job detail progress (جمع همه shardها با F())
+        CrawlJob.objects.filter(id=job_id).update(
+            detail_processed=F('detail_processed') + saved,
+            detail_errors=F('detail_errors') + batch_errors
+        )
+        logger.info(f"🧾 [Detail Job {job_id}] Shard {first_id}-{last_id} batch: {saved} saved, {batch_errors} errors")
+
+    # دسته‌ها همزمان دریافت می‌شوند؛ سرعت را CRAWLER_MAX_CONCURRENCY و CRAWLER_RATE_LIMIT تعیین می‌کنند نه sleep ثابت.
+    next_id = first_id
+    try:
+        while True:
+            records = _claim_detail_batch(job_id, next_id, last_id, settings.CRAWLER_DETAIL_BATCH_SIZE)
+            if not records:
+                break
+            next_id = records[-1].id + 1
+            process_batch(records)
+    finally:
+        crawler.close()
+        get_shared_transport().log_stats(f"[Detail Job {job_id}] Shard {first_id}-{last_id}: worker ")
 
     logger.info(
-        "✅ [Detail Job %s] Done. Processed: %s, Errors: %s | GraphQL ok: %s, GraphQL fail: %s | HTML used: %s, HTML fail: %s",
+        "✅ [Detail Job %s] Shard %s-%s done. Processed: %s, Errors: %s | GraphQL ok: %s, GraphQL fail: %s | HTML used: %s, HTML fail: %s",
         job_id,
-        processed_this_run,
-        errors,
-        graphql_success,
-        graphql_fail,
-        html_fallback_used,
-        html_fallback_failed,
+        first_id,
+        last_id,
+        stats['processed'],
+        stats['errors'],
+        stats['graphql_success'],
+        stats['graphql_fail'],
+        stats['html_fallback_used'],
+        stats['html_fallback_failed'],
+    )
+
+
+@shared_task
+def finalize_detail_job(shard_results, job_id: int):
+    """
+    callback chord: جمع نتایج shardها و تعیین detail_status
+
+    failed اگر shardی بعد از همه retryها خطا داد، partial اگر رکوردهایی جزئیات نگرفتند
+    (رزروشان آزاد است و «احیا» آن‌ها را دوباره درخواست می‌کند)، وگرنه completed.
+    """
+    results = [result or {} for result in shard_results]
+    processed = sum(result.get('processed', 0) for result in results)
+    errors = sum(result.get('errors', 0) for result in results)
+    failed_shards = sum(1 for result in results if result.get('status') == 'failed')
+    if failed_shards:
+        status = 'failed'
+    elif errors:
+        status = 'partial'
+    else:
+        status = 'completed'
+    CrawlJob.objects.filter(id=job_id).update(detail_status=status)
+
+    log = logger.info if status == 'completed' else logger.warning
+    log(
+        f"{'✅' if status == 'completed' else '⚠️'} [Detail Job {job_id}] Done ({status}). {len(results)} shards, "
+        f"{failed_shards} failed | Processed: {processed}, Errors: {errors}"
     )
     return {
         "job_id": job_id,
-        "processed": processed_this_run,
+        "status": status,
+        "processed": processed,
         "errors": errors,
+        "failed_shards": failed_shards,
+        "shards": len(results),
     }
+
+
+@shared_task
+def refresh_reference_data():
+    """
+    دریافت دوباره سلسله‌مراتب استان/شهر و ذخیره در فایل محلی و Redis
+    (به صورت دوره‌ای از CELERY_BEAT_SCHEDULE اجرا می‌شود)
+    """
+    reference_data = get_shared_reference_data()
+    crawler = MojavezCrawler(
+        max_concurrency=settings.CRAWLER_MAX_CONCURRENCY,
+        reference_data=reference_data,
+        rate_limiter=get_shared_rate_limiter(),
+        retry_policy=get_retry_policy(),
+        circuit_breaker=get_shared_circuit_breaker(),
+        transport=get_shared_transport()
+    )
+    try:
+        data = reference_data.refresh(crawler)
+    finally:
+        crawler.close()
+    return {
+        'provinces': len(data.get('provinces') or []),
+        'townships': len(data.get('townships') or {}),
+    }
+
+
+@worker_ready.connect
+def warm_reference_data(sender=None, **kwargs):
+    """Warm-load کش استان/شهر هنگام شروع ورکر؛ اگر کهنه بود refresh در صف قرار می‌گیرد"""
+    try:
+        reference_data = get_shared_reference_data()
+        reference_data.load()
+        if reference_data.is_stale():
+            logger.info("🗂️ Reference data is stale; scheduling refresh")
+            refresh_reference_data.delay()
+        else:
+            logger.info(f"🗂️ Reference data warm-loaded: {len(reference_data.get_provinces())} provinces")
+    except Exception as e:
+        logger.error(f"❌ Error warm-loading reference data: {e}")
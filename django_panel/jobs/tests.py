@@ -1,3 +1,1053 @@
-from django.test import TestCase
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from celery.exceptions import Retry
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+# اضافه کردن مسیر اصلی پروژه
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from async_crawler import AsyncMojavezCrawler, get_host_semaphore
+from crawler import MojavezCrawler
+from graphql_queries import build_details_batch_query, details_batch_variables, parse_details_batch_response
+from date_utils import (
+    SUBDAY_FORMATS,
+    day_bounds,
+    format_date_for_api,
+    format_datetime_for_api,
+    parse_api_date,
+    split_time_range,
+    subday_resolution,
+)
+from partitioning import OrganizationPartitioner, TitlePrefixPartitioner, build_partitioners
+from planner import CrawlPlan, CrawlPlanner
+from rate_limit import RateLimiter
+from resilience import CircuitBreaker, CircuitOpenError, RetryBudget, RetryPolicy
+from .audit import audit_job, audit_window, prepare_refetch
+from .models import (
+    CrawlJob, CrawlPageCheckpoint, CrawlRecord, CrawlWatermark, CrawlWindow, License, LicenseStatusHistory,
+    MojavezDetail,
+)
+from .persistence import (
+    RecordWriter,
+    build_mojavez_detail,
+    content_hash,
+    missing_detail_filter,
+    save_crawl_records,
+    save_mojavez_details,
+    upsert_licenses,
+)
+from . import tasks
+
+
+# ----------------------------------------------------------------------
+# همزمانی محدود به ازای هر host (async_crawler)
+# ----------------------------------------------------------------------
+
+class HostSemaphoreTests(SimpleTestCase):
+    def test_instances_share_one_semaphore_per_host(self):
+        async def run():
+            first = AsyncMojavezCrawler(max_concurrency=3)
+            second = AsyncMojavezCrawler(max_concurrency=3)
+            same = first._get_semaphore(first.endpoint) is second._get_semaphore(second.endpoint)
+            other = first._get_semaphore('https://example.com/x') is first._get_semaphore(first.endpoint)
+            return same, other
+
+        self.assertEqual(asyncio.run(run()), (True, False))
+
+    def test_in_flight_requests_never_exceed_limit(self):
+        in_flight = 0
+        peak = 0
+
+        async def request(crawler):
+            nonlocal in_flight, peak
+            async with crawler._get_semaphore(crawler.endpoint):
+                in_flight += 1
+                peak = max(peak, in_flight)
+                await asyncio.sleep(0.01)
+                in_flight -= 1
+
+        async def run():
+            crawlers = [AsyncMojavezCrawler(max_concurrency=2) for _ in range(3)]
+            await asyncio.gather(*[request(crawlers[i % 3]) for i in range(12)])
+
+        asyncio.run(run())
+        self.assertEqual(peak, 2)
+
+    def test_each_event_loop_gets_its_own_semaphore(self):
+        async def get():
+            return get_host_semaphore('qr.mojavez.ir', 2)
+
+        self.assertIsNot(asyncio.run(get()), asyncio.run(get()))
+
+
+# ----------------------------------------------------------------------
+# CrawlPlanner با سرور جعلی count
+# ----------------------------------------------------------------------
+
+class FakeCountClient:
+    """جایگزین AsyncMojavezCrawler برای planner: count هر پنجره از تابع count_for"""
+
+    def __init__(self, count_for):
+        self.count_for = count_for
+        self.calls = []
+
+    async def get_records_count(self, start_date, end_date, province_id=None, township_id=None, default=0, filters=None):
+        self.calls.append((start_date, end_date, province_id, township_id, filters))
+        return self.count_for(parse_api_date(start_date), parse_api_date(end_date), province_id, township_id, filters or {})
+
+
+class PlannerCrawler(MojavezCrawler):
+    MAX_RECORDS_PER_REQUEST = 100
+
+    def __init__(self, count_for):
+        super().__init__(subday_format='')
+        self.client = FakeCountClient(count_for)
+
+    def _get_async_client(self):
+        return self.client
+
+
+def days_count(daily):
+    """count_for بازه‌های روزانه: جمع daily(day) روزهای بازه (فیلترها نادیده)"""
+    def count_for(start, end, province_id, township_id, filters):
+        return sum(daily(start + timedelta(days=i)) for i in range((end - start).days + 1))
+    return count_for
+
+
+class CrawlPlannerTests(SimpleTestCase):
+    def assert_covers(self, plan, start, end):
+        """پنجره‌ها بازه را بدون شکاف و همپوشانی پوشش می‌دهند"""
+        day = start
+        for window in plan.windows:
+            self.assertEqual(parse_api_date(window['start_date']), day)
+            day = parse_api_date(window['end_date']) + timedelta(days=1)
+        self.assertEqual(day, end + timedelta(days=1))
+
+    def test_range_under_limit_is_one_window(self):
+        crawler = PlannerCrawler(days_count(lambda day: 5))
+        plan = CrawlPlanner(crawler).build_plan(datetime(2026, 1, 1), datetime(2026, 1, 10))
+        self.assertEqual(len(plan.windows), 1)
+        self.assertEqual(plan.total_count, 50)
+        self.assertEqual(plan.probe_count, 1)
+
+    def test_dense_range_is_cut_into_windows_under_limit(self):
+        crawler = PlannerCrawler(days_count(lambda day: 30))
+        start, end = datetime(2026, 1, 1), datetime(2026, 1, 10)
+        plan = CrawlPlanner(crawler).build_plan(start, end)
+        # تراکم یکنواخت: هر تکه تا 80% سقف (دو روز = 60 رکورد)
+        self.assertEqual([window['count'] for window in plan.windows], [60] * 5)
+        self.assertEqual(plan.total_count, 300)
+        self.assertEqual(plan.probe_count, 6)
+        self.assert_covers(plan, start, end)
+
+    def test_total_count_skips_root_probe_and_empty_windows_are_dropped(self):
+        crawler = PlannerCrawler(days_count(lambda day: 0 if day.day <= 4 else 40))
+        start, end = datetime(2026, 1, 1), datetime(2026, 1, 8)
+        plan = CrawlPlanner(crawler).build_plan(start, end, total_count=160)
+        self.assertNotIn(('2026/1/1', '2026/1/8', None, None, None), crawler.client.calls)
+        self.assertTrue(all(window['count'] > 0 for window in plan.windows))
+        self.assertTrue(all(window['count'] <= 100 for window in plan.windows))
+        self.assertEqual(plan.total_count, 160)
+
+    def test_failed_probe_becomes_probe_failed_leaf(self):
+        def count_for(start, end, province_id, township_id, filters):
+            return None if start.day == 2 else 10
+
+        crawler = PlannerCrawler(count_for)
+        plan = CrawlPlanner(crawler).build_plan(datetime(2026, 1, 2), datetime(2026, 1, 2), 1, 2)
+        self.assertEqual(len(plan.windows), 1)
+        self.assertIsNone(plan.windows[0]['count'])
+        self.assertTrue(plan.windows[0]['probe_failed'])
+        # یک probe اولیه و PROBE_RETRY_ROUNDS تکرار
+        self.assertEqual(plan.probe_count, 1 + CrawlPlanner.PROBE_RETRY_ROUNDS)
+
+
+# ----------------------------------------------------------------------
+# تقسیم تراکم‌محور بازه تاریخ
+# ----------------------------------------------------------------------
+
+class DensitySplitTests(SimpleTestCase):
+    def setUp(self):
+        self.crawler = PlannerCrawler(days_count(lambda day: 0))
+
+    def test_uniform_density_fills_pieces_up_to_ratio(self):
+        pieces = self.crawler.split_date_range_by_density(datetime(2026, 1, 1), datetime(2026, 1, 10), 300)
+        self.assertEqual(pieces, [
+            (datetime(2026, 1, day), datetime(2026, 1, day + 1)) for day in range(1, 10, 2)
+        ])
+
+    def test_history_moves_boundaries_around_dense_days(self):
+        density = {datetime(2026, 1, day).date(): (78 if day == 3 else 5) for day in range(1, 11)}
+        pieces = self.crawler.split_date_range_by_density(
+            datetime(2026, 1, 1), datetime(2026, 1, 10), 123, density
+        )
+        self.assertEqual(pieces, [
+            (datetime(2026, 1, 1), datetime(2026, 1, 2)),
+            (datetime(2026, 1, 3), datetime(2026, 1, 3)),
+            (datetime(2026, 1, 4), datetime(2026, 1, 10)),
+        ])
+
+    def test_single_predicted_piece_falls_back_to_halving(self):
+        pieces = self.crawler.split_date_range_by_density(datetime(2026, 1, 1), datetime(2026, 1, 4), 120, {
+            datetime(2026, 1, day).date(): 1 for day in range(1, 5)
+        })
+        self.assertEqual(pieces, self.crawler.split_date_range(datetime(2026, 1, 1), datetime(2026, 1, 4)))
+
+    def test_iter_date_range_passes_density_to_every_split(self):
+        seen = []
+        original = self.crawler.split_date_range_by_density
+
+        def spy(start, end, count, daily_density=None):
+            seen.append(daily_density)
+            return original(start, end, count, daily_density)
+
+        self.crawler.split_date_range_by_density = spy
+        self.crawler.get_records_count = lambda start, end, *args, **kwargs: 30 * (
+            (parse_api_date(end) - parse_api_date(start)).days + 1
+        )
+        self.crawler.iter_pages = lambda *args, **kwargs: iter([{'records': []}])
+        density = {datetime(2026, 1, day).date(): 30 for day in range(1, 11)}
+        list(self.crawler.iter_date_range(datetime(2026, 1, 1), datetime(2026, 1, 10), daily_density=density))
+        self.assertTrue(seen)
+        self.assertTrue(all(item is density for item in seen))
+
+
+class HistoricalDensityTests(TestCase):
+    def setUp(self):
+        self.job = CrawlJob.objects.create(name='density', start_date='2026/1/1', end_date='2026/1/31')
+
+    def add_records(self, *responded_at):
+        for value in responded_at:
+            CrawlRecord.objects.create(crawl_job=self.job, request_number=f'R{CrawlRecord.objects.count()}', responded_at=value)
+
+    def test_no_records_means_no_history(self):
+        self.assertIsNone(tasks._responded_at_range(datetime(2026, 1, 1), datetime(2026, 1, 2)))
+        self.assertEqual(tasks._historical_daily_density(datetime(2026, 1, 1), datetime(2026, 1, 2)), {})
+
+    def test_padded_dates_use_one_exact_range(self):
+        self.add_records('2026/01/09 10:00:00', '2026/01/09', '2026/01/10', '2026/01/11', '2025/12/31')
+        self.assertEqual(tasks._historical_daily_density(datetime(2026, 1, 9), datetime(2026, 1, 10)), {
+            datetime(2026, 1, 9).date(): 2,
+            datetime(2026, 1, 10).date(): 1,
+        })
+
+    def test_unpadded_dates_are_filtered_after_grouping(self):
+        self.add_records('2026/1/5', '2026/1/9 10:00', '2026/1/10', '2026/10/3', '2026/2/1', '2025/12/31')
+        # بازه یک ماهه: ماه 10 با پیشوند '2026/1' بیرون می‌ماند
+        self.assertEqual(
+            tasks._responded_at_range(datetime(2026, 1, 1), datetime(2026, 1, 31)).children,
+            [('responded_at__gte', '2026/1/'), ('responded_at__lt', '2026/10')]
+        )
+        self.assertEqual(sorted(tasks._historical_daily_density(datetime(2026, 1, 9), datetime(2026, 2, 1))), [
+            datetime(2026, 1, 9).date(), datetime(2026, 1, 10).date(), datetime(2026, 2, 1).date(),
+        ])
+
+    def test_ambiguous_samples_use_a_range_valid_for_both_formats(self):
+        # 2025/12/31 هم YYYY/M/D است و هم YYYY/MM/DD
+        self.add_records('2026/1/5', '2025/12/31')
+        query = tasks._responded_at_range(datetime(2026, 1, 1), datetime(2026, 1, 31))
+        self.assertEqual(query.children, [('responded_at__gte', '2026/1/'), ('responded_at__lt', '2026/10')])
+        CrawlRecord.objects.filter(responded_at='2026/1/5').delete()
+        query = tasks._responded_at_range(datetime(2026, 1, 1), datetime(2026, 1, 31))
+        self.assertEqual(query.children, [('responded_at__gte', '2026/'), ('responded_at__lt', '2027/')])
+
+    def test_each_licence_counts_once_across_jobs(self):
+        other = CrawlJob.objects.create(name='other', start_date='2026/1/1', end_date='2026/1/31')
+        CrawlRecord.objects.create(crawl_job=self.job, request_number='R1', responded_at='2026/1/5')
+        CrawlRecord.objects.create(crawl_job=other, request_number='R1', responded_at='2026/1/5')
+        self.assertEqual(tasks._historical_daily_density(datetime(2026, 1, 1), datetime(2026, 1, 31)), {
+            datetime(2026, 1, 5).date(): 1,
+        })
+
+
+# ----------------------------------------------------------------------
+# ذخیره دسته‌ای رکوردها
+# ----------------------------------------------------------------------
+
+def api_record(request_number, **fields):
+    return {'request_number': request_number, 'license_title': 'عنوان', 'status': {'status_slug': 'active'}, **fields}
+
+
+class SaveCrawlRecordsTests(TestCase):
+    def setUp(self):
+        self.job = CrawlJob.objects.create(name='save', start_date='2026/1/1', end_date='2026/1/1')
+
+    def test_duplicates_in_batch_and_database_are_skipped(self):
+        batch = [api_record('R1'), api_record('R2'), api_record('R1')]
+        self.assertEqual(save_crawl_records(self.job, batch), 2)
+        self.assertEqual(save_crawl_records(self.job, [api_record('R2'), api_record('R3')]), 1)
+        self.assertEqual(
+            sorted(self.job.records.values_list('request_number', flat=True)), ['R1', 'R2', 'R3']
+        )
+
+    def test_records_without_request_number_are_always_saved(self):
+        self.assertEqual(save_crawl_records(self.job, [api_record(None), api_record(''), api_record('R1')]), 3)
+        self.assertEqual(self.job.records.count(), 3)
+
+    def test_records_link_to_one_licence_across_jobs(self):
+        other = CrawlJob.objects.create(name='other', start_date='2026/1/1', end_date='2026/1/1')
+        save_crawl_records(self.job, [api_record('R1')])
+        self.assertEqual(save_crawl_records(other, [api_record('R1')]), 1)
+        self.assertEqual(License.objects.count(), 1)
+        license = License.objects.get()
+        self.assertEqual(set(CrawlRecord.objects.values_list('license_id', flat=True)), {license.id})
+        # داده خام فقط در License نگه داشته می‌شود
+        self.assertIsNone(CrawlRecord.objects.first().raw_data)
+
+    def test_inserted_count_excludes_rows_present_before_the_batch(self):
+        CrawlRecord.objects.create(crawl_job=self.job, request_number='R1')
+        self.assertEqual(save_crawl_records(self.job, [api_record('R1'), api_record('R2')]), 1)
+
+    def test_empty_batch(self):
+        self.assertEqual(save_crawl_records(self.job, []), 0)
+
+
+# ----------------------------------------------------------------------
+# دریافت همزمان جزئیات با fallback صفحه track
+# ----------------------------------------------------------------------
+
+class FakeDetailClient(AsyncMojavezCrawler):
+    """GraphQL فقط برای details جواب می‌دهد و صفحه track فقط برای pages"""
+
+    def __init__(self, details, pages):
+        super().__init__()
+        self.details = details
+        self.pages = pages
+        self.track_requests = []
+
+    async def fetch_details_batch(self, request_numbers):
+        return [self.details.get(number) for number in request_numbers]
+
+    async def fetch_track_page(self, request_number):
+        self.track_requests.append(request_number)
+        return self.pages.get(request_number)
+
+
+class DetailCrawler(MojavezCrawler):
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+
+    def _get_async_client(self):
+        return self.client
+
+
+TRACK_HTML = '<div><span>عنوان مجوز</span><span>نانوایی</span></div>'
+
+
+class DetailFallbackTests(SimpleTestCase):
+    def setUp(self):
+        self.client = FakeDetailClient(
+            details={'R1': {'request_number': 'R1', 'source': 'graphql'}},
+            pages={'R2': TRACK_HTML}
+        )
+
+    def test_track_page_is_fetched_only_for_graphql_misses(self):
+        results = asyncio.run(self.client.fetch_details_with_fallback(['R1', 'R2', 'R3']))
+        self.assertEqual(self.client.track_requests, ['R2', 'R3'])
+        self.assertEqual([bool(result['detail']) for result in results], [True, False, False])
+        self.assertEqual(results[1]['html'], TRACK_HTML)
+        self.assertIsNone(results[2]['html'])
+
+    def test_results_keep_input_order_and_mark_their_source(self):
+        details = DetailCrawler(self.client).fetch_details_with_fallback(['R3', 'R2', 'R1'])
+        self.assertIsNone(details[0])
+        self.assertEqual((details[1]['source'], details[1]['license_title']), ('html', 'نانوایی'))
+        self.assertEqual(details[2]['source'], 'graphql')
+
+
+# ----------------------------------------------------------------------
+# query دسته‌ای جزئیات با alias
+# ----------------------------------------------------------------------
+
+def graphql_detail(title):
+    return {'license': {'license_title': title, 'status': {'status_slug': 'active'}}, 'location': {}}
+
+
+class DetailBatchQueryTests(SimpleTestCase):
+    def test_query_has_one_alias_and_variable_per_licence(self):
+        query = build_details_batch_query(3)
+        for i in range(3):
+            self.assertIn(f'r{i}: licenseRequestDetails', query)
+            self.assertIn(f'$id{i}: String!', query)
+        self.assertEqual(details_batch_variables(['A', 'B']), {'id0': 'A', 'id1': 'B'})
+
+    def test_partial_error_only_drops_its_alias(self):
+        result = {
+            'data': {'r0': graphql_detail('اول'), 'r1': None, 'r2': graphql_detail('سوم')},
+            'errors': [{'message': 'not found', 'path': ['r1', 'license']}],
+        }
+        details = parse_details_batch_response(result, ['A', 'B', 'C'])
+        self.assertEqual([detail and detail['license_title'] for detail in details], ['اول', None, 'سوم'])
+        self.assertEqual(details[2]['request_number'], 'C')
+
+    def test_error_without_path_fails_the_whole_batch(self):
+        result = {'data': {'r0': graphql_detail('اول')}, 'errors': [{'message': 'too complex'}]}
+        self.assertEqual(parse_details_batch_response(result, ['A', 'B']), [None, None])
+
+    def test_failed_batch_is_retried_as_halves(self):
+        sizes = []
+
+        class Client(AsyncMojavezCrawler):
+            async def execute_query(self, query, variables=None, max_retries=None, timeout=None):
+                sizes.append(len(variables))
+                if len(variables) > 2:
+                    raise TimeoutError()
+                numbers = [variables[f'id{i}'] for i in range(len(variables))]
+                return {'data': {f'r{i}': graphql_detail(number) for i, number in enumerate(numbers)}}
+
+        client = Client(detail_batch_size=4)
+        client.detail_batch_tuner.size = 4
+        details = asyncio.run(client.fetch_details_batch(['A', 'B', 'C', 'D']))
+        self.assertEqual([detail['license_title'] for detail in details], ['A', 'B', 'C', 'D'])
+        self.assertEqual(sizes, [4, 2, 2])
+        # یک شکست (نصف) و دو موفقیت (+1 هر کدام)
+        self.assertEqual(client.detail_batch_tuner.size, 4)
+
+
+class SaveMojavezDetailsTests(TestCase):
+    def setUp(self):
+        self.job = CrawlJob.objects.create(name='details', start_date='2026/1/1', end_date='2026/1/1')
+        save_crawl_records(self.job, [api_record(f'R{i}') for i in range(3)])
+        self.records = list(self.job.records.order_by('id'))
+
+    def details(self, records):
+        return [build_mojavez_detail(record, {'license_title': 'عنوان', 'source': 'graphql'}) for record in records]
+
+    def test_returns_rows_actually_inserted(self):
+        self.assertEqual(save_mojavez_details(self.details(self.records[:2])), 2)
+        # رکوردهایی که در این فاصله detail گرفته‌اند شمرده نمی‌شوند
+        self.assertEqual(save_mojavez_details(self.details(self.records)), 1)
+        self.assertEqual(MojavezDetail.objects.count(), 3)
+        self.assertEqual(save_mojavez_details([]), 0)
+
+    def test_licence_points_to_the_new_detail(self):
+        save_mojavez_details(self.details(self.records[:1]))
+        detail = MojavezDetail.objects.get()
+        self.assertEqual(License.objects.get(request_number='R0').detail_id, detail.id)
+        self.assertEqual(License.objects.filter(detail__isnull=True).count(), 2)
+
+
+# ----------------------------------------------------------------------
+# shardهای دریافت جزئیات
+# ----------------------------------------------------------------------
+
+class FakeShardTask:
+    """جایگزین self تسک bind‌شده برای _detail_shard_error"""
+
+    max_retries = 5
+
+    def __init__(self, retries):
+        self.request = SimpleNamespace(retries=retries)
+        self.retried = []
+
+    def retry(self, **kwargs):
+        self.retried.append(kwargs)
+        return Retry()
+
+
+class DetailShardTests(TestCase):
+    def setUp(self):
+        self.job = CrawlJob.objects.create(name='shards', start_date='2026/1/1', end_date='2026/1/1')
+        save_crawl_records(self.job, [api_record(f'R{i}') for i in range(10)])
+        self.ids = list(self.job.records.order_by('id').values_list('id', flat=True))
+
+    def test_shard_ranges_split_pending_ids_evenly(self):
+        ranges = tasks._detail_shard_ranges(self.job.records.all(), 3)
+        self.assertEqual(ranges, [
+            (self.ids[0], self.ids[3]), (self.ids[4], self.ids[7]), (self.ids[8], self.ids[9])
+        ])
+
+    def test_shard_ranges_follow_id_gaps_and_cap_shard_count(self):
+        pending = self.job.records.filter(id__in=[self.ids[0], self.ids[5], self.ids[9]])
+        self.assertEqual(tasks._detail_shard_ranges(pending, 10), [
+            (self.ids[0], self.ids[0]), (self.ids[5], self.ids[5]), (self.ids[9], self.ids[9])
+        ])
+        self.assertEqual(tasks._detail_shard_ranges(self.job.records.none(), 4), [])
+
+    def test_claims_skip_claimed_records_and_reclaim_stale_ones(self):
+        CrawlRecord.objects.filter(id=self.ids[0]).update(detail_claimed_at=timezone.now())
+        CrawlRecord.objects.filter(id=self.ids[1]).update(detail_claimed_at=timezone.now() - timedelta(days=1))
+        claimed = tasks._claim_detail_batch(self.job.id, self.ids[0], self.ids[-1], 3)
+        self.assertEqual([record.id for record in claimed], self.ids[1:4])
+        self.assertEqual(CrawlRecord.objects.filter(detail_claimed_at__isnull=False).count(), 4)
+
+    def test_records_whose_licence_has_a_fresh_detail_are_not_claimed(self):
+        record = CrawlRecord.objects.get(id=self.ids[0])
+        save_mojavez_details([build_mojavez_detail(record, {'source': 'graphql'})])
+        other = CrawlJob.objects.create(name='other', start_date='2026/1/1', end_date='2026/1/1')
+        save_crawl_records(other, [api_record('R0'), api_record('R1')])
+        claimed = tasks._claim_detail_batch(other.id, 0, self.ids[-1] + 10, 10)
+        self.assertEqual([record.request_number for record in claimed], ['R1'])
+
+    def test_failed_shard_releases_claims_and_retries(self):
+        tasks._claim_detail_batch(self.job.id, self.ids[0], self.ids[-1], 10)
+        task = FakeShardTask(retries=0)
+        with self.assertRaises(Retry):
+            tasks._detail_shard_error(task, self.job.id, self.ids[0], self.ids[-1], 0, {}, ValueError('db'))
+        self.assertEqual(len(task.retried), 1)
+        self.assertFalse(CrawlRecord.objects.filter(detail_claimed_at__isnull=False).exists())
+
+    def test_shard_out_of_retries_returns_failed_result(self):
+        task = FakeShardTask(retries=5)
+        result = tasks._detail_shard_error(
+            task, self.job.id, self.ids[0], self.ids[-1], 0, {'processed': 2}, ValueError('db')
+        )
+        self.assertEqual(task.retried, [])
+        self.assertEqual((result['status'], result['error'], result['processed']), ('failed', 'db', 2))
+
+    def test_circuit_waits_do_not_use_up_retries(self):
+        task = FakeShardTask(retries=7)
+        with self.assertRaises(Retry):
+            tasks._detail_shard_error(task, self.job.id, self.ids[0], self.ids[-1], 3, {}, ValueError('db'))
+        self.assertEqual(task.retried[0]['max_retries'], 3 + FakeShardTask.max_retries)
+
+    def test_finalize_sets_status_from_shard_results(self):
+        cases = [
+            ([{'status': 'completed', 'processed': 4}], 'completed'),
+            ([{'status': 'completed', 'processed': 3, 'errors': 1}, None], 'partial'),
+            ([{'status': 'completed', 'processed': 3}, {'status': 'failed', 'error': 'db'}], 'failed'),
+        ]
+        for results, status in cases:
+            summary = tasks.finalize_detail_job(results, self.job.id)
+            self.job.refresh_from_db()
+            self.assertEqual((summary['status'], self.job.detail_status), (status, status))
+        self.assertEqual(summary['failed_shards'], 1)
+
+
+# ----------------------------------------------------------------------
+# RecordWriter (write-behind)
+# ----------------------------------------------------------------------
+
+class RecordWriterTests(SimpleTestCase):
+    def test_checkpoints_are_written_after_their_records(self):
+        events = []
+        writer = RecordWriter(
+            save_batch=lambda records: events.append(('save', [r['n'] for r in records])) or len(records),
+            save_checkpoints=lambda checkpoints: events.append(('checkpoint', list(checkpoints))),
+            after_flush=lambda saved, progress: events.append(('progress', saved, progress)),
+            flush_interval=0.01
+        ).start()
+        writer.put([{'n': 1}, {'n': 2}], checkpoint=1)
+        writer.put([{'n': 3}], checkpoint=2)
+        writer.set_progress(3, 2)
+        writer.close()
+        saved = [item for event in events if event[0] == 'save' for item in event[1]]
+        checkpoints = [item for event in events if event[0] == 'checkpoint' for item in event[1]]
+        self.assertEqual((saved, checkpoints, writer.saved), ([1, 2, 3], [1, 2], 3))
+        for page, last_record in ((1, 2), (2, 3)):
+            save_index = next(i for i, event in enumerate(events) if event[0] == 'save' and last_record in event[1])
+            checkpoint_index = next(i for i, event in enumerate(events) if event[0] == 'checkpoint' and page in event[1])
+            self.assertLess(save_index, checkpoint_index)
+        self.assertEqual(events[-1][2], (3, 2))
+
+    def test_queued_pages_are_merged_until_max_batch_records(self):
+        batches = []
+        writer = RecordWriter(
+            save_batch=lambda records: batches.append(len(records)) or len(records),
+            max_batch_records=3,
+            flush_interval=0.01
+        )
+        for page in range(4):
+            writer.put([{'n': page}] * 2)
+        writer.start().close()
+        # صفحه‌ها تا رسیدن به max_batch_records کنار هم ذخیره می‌شوند
+        self.assertEqual(batches, [4, 4])
+
+    def test_failed_save_skips_checkpoints_and_surfaces_the_error(self):
+        checkpoints = []
+
+        def save_batch(records):
+            raise RuntimeError('database down')
+
+        writer = RecordWriter(save_batch, save_checkpoints=checkpoints.extend, flush_interval=0.01).start()
+        writer.put([{'n': 1}], checkpoint=1)
+        with self.assertRaises(RuntimeError):
+            writer.close()
+        self.assertEqual(checkpoints, [])
+        with self.assertRaises(RuntimeError):
+            writer.put([{'n': 2}])
+
+
+# ----------------------------------------------------------------------
+# RateLimiter (AIMD)
+# ----------------------------------------------------------------------
+
+class RateLimiterTests(SimpleTestCase):
+    def limiter(self, **kwargs):
+        options = {'min_rate': 1, 'max_rate': 20, 'increase': 1, 'decrease_interval': 60}
+        options.update(kwargs)
+        return RateLimiter(8, **options)
+
+    def test_burst_of_throttles_is_one_decrease(self):
+        limiter = self.limiter()
+        for _ in range(10):
+            limiter.on_response(status=429)
+        self.assertEqual(limiter.rate, 4)
+
+    def test_throttles_outside_the_window_each_decrease_down_to_min_rate(self):
+        limiter = self.limiter(decrease_interval=0)
+        limiter.on_throttle()
+        limiter.on_response(timeout=True)
+        self.assertEqual(limiter.rate, 2)
+        for _ in range(5):
+            limiter.on_throttle()
+        self.assertEqual(limiter.rate, 1)
+
+    def test_window_is_at_least_the_recent_latency(self):
+        limiter = self.limiter(decrease_interval=0)
+        limiter.on_success(latency=60)
+        limiter.on_throttle()
+        limiter.on_throttle()
+        self.assertAlmostEqual(limiter.rate, (8 + 1 / 8) / 2)
+
+    def test_success_increases_additively_up_to_max_rate(self):
+        limiter = self.limiter()
+        for _ in range(8):
+            limiter.on_response(status=200, latency=0.1)
+        self.assertAlmostEqual(limiter.rate, 9, delta=0.1)
+        for _ in range(1000):
+            limiter.on_success()
+        self.assertEqual(limiter.rate, 20)
+
+    def test_slow_response_is_a_smaller_decrease(self):
+        limiter = self.limiter(slow_latency=5)
+        limiter.on_success(latency=6)
+        self.assertEqual(limiter.rate, 6)
+
+    def test_fixed_rate_ignores_feedback(self):
+        limiter = RateLimiter(8)
+        limiter.on_throttle()
+        limiter.on_success()
+        self.assertEqual(limiter.rate, 8)
+
+    def test_reserve_schedules_requests_past_the_burst(self):
+        limiter = RateLimiter(10, burst=2)
+        waits = [limiter.reserve() for _ in range(4)]
+        self.assertEqual(waits[:2], [0.0, 0.0])
+        self.assertAlmostEqual(waits[2], 0.1, delta=0.01)
+        self.assertAlmostEqual(waits[3], 0.2, delta=0.01)
+        self.assertEqual(RateLimiter(0).reserve(), 0.0)
+
+
+# ----------------------------------------------------------------------
+# CircuitBreaker و RetryBudget
+# ----------------------------------------------------------------------
+
+class CircuitBreakerTests(SimpleTestCase):
+    def open_breaker(self):
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=0.05)
+        for _ in range(3):
+            breaker.record_failure()
+        return breaker
+
+    def test_opens_after_consecutive_failures(self):
+        breaker = CircuitBreaker(failure_threshold=3, recovery_timeout=30)
+        breaker.record_failure()
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        self.assertIsNone(breaker.before_request())
+        breaker.record_failure()
+        breaker.record_failure()
+        with self.assertRaises(CircuitOpenError) as raised:
+            breaker.before_request()
+        self.assertGreater(raised.exception.retry_after, 25)
+
+    def test_half_open_allows_a_single_probe(self):
+        breaker = self.open_breaker()
+        time.sleep(0.06)
+        probe = breaker.before_request()
+        self.assertIsNotNone(probe)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        self.assertIsNone(breaker.before_request())
+
+    def test_failed_probe_reopens(self):
+        breaker = self.open_breaker()
+        time.sleep(0.06)
+        breaker.before_request()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_released_probe_lets_the_next_request_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        probe = breaker.before_request()
+        # تسک cancel شد: نه موفقیت نه شکست
+        breaker.release_probe(probe)
+        self.assertIsNotNone(breaker.before_request())
+
+    def test_stale_release_does_not_free_a_newer_probe(self):
+        breaker = CircuitBreaker(failure_threshold=1, recovery_timeout=0.05)
+        breaker.record_failure()
+        time.sleep(0.06)
+        old_probe = breaker.before_request()
+        time.sleep(0.06)
+        # probe قدیمی‌تر از recovery_timeout رهاشده فرض می‌شود
+        self.assertIsNotNone(breaker.before_request())
+        breaker.release_probe(old_probe)
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_late_responses_while_open_are_ignored(self):
+        breaker = self.open_breaker()
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+
+class RetryBudgetTests(SimpleTestCase):
+    def test_budget_is_shared_until_exhausted(self):
+        budget = RetryBudget(2)
+        self.assertEqual([budget.consume() for _ in range(3)], [True, True, False])
+        budget.reset()
+        self.assertTrue(budget.consume())
+
+    def test_zero_total_means_unlimited(self):
+        budget = RetryBudget(0)
+        self.assertTrue(all(budget.consume() for _ in range(100)))
+
+    def test_policy_stops_at_max_attempts_or_empty_budget(self):
+        policy = RetryPolicy(max_attempts=3, budget=RetryBudget(1))
+        self.assertFalse(policy.should_retry(3))
+        self.assertTrue(policy.should_retry(1))
+        self.assertFalse(policy.should_retry(1))
+        self.assertTrue(RetryPolicy(max_attempts=3).with_budget(None).should_retry(2))
+
+    def test_delay_is_bounded_by_exponential_backoff(self):
+        policy = RetryPolicy(base_delay=1, max_delay=5)
+        for attempt, cap in ((1, 1), (2, 2), (3, 4), (6, 5)):
+            self.assertTrue(all(0 <= policy.delay(attempt) <= cap for _ in range(20)))
+
+
+# ----------------------------------------------------------------------
+# بازه‌های زیرروزی
+# ----------------------------------------------------------------------
+
+class SubdayDateTests(SimpleTestCase):
+    def test_every_subday_format_parses_back(self):
+        moment = datetime(2026, 1, 5, 13, 4, 5)
+        for template in SUBDAY_FORMATS:
+            expected = moment if '{S' in template else moment.replace(second=0)
+            self.assertEqual(parse_api_date(format_datetime_for_api(moment, template)), expected, template)
+
+    def test_day_strings_still_parse(self):
+        self.assertEqual(parse_api_date('2026/1/5'), datetime(2026, 1, 5))
+        self.assertEqual(parse_api_date('2026-01-05'), datetime(2026, 1, 5))
+        self.assertEqual(format_date_for_api(datetime(2026, 10, 5)), '2026/10/5')
+        self.assertIsNone(parse_api_date('not a date'))
+
+    def test_split_time_range_gives_disjoint_halves(self):
+        start, end = day_bounds(datetime(2026, 1, 5, 9))
+        self.assertEqual(split_time_range(start, end), [
+            (datetime(2026, 1, 5), datetime(2026, 1, 5, 11, 59, 59)),
+            (datetime(2026, 1, 5, 12), datetime(2026, 1, 5, 23, 59, 59)),
+        ])
+
+    def test_split_time_range_respects_resolution(self):
+        minute = subday_resolution('{y}/{m}/{d} {H:02d}:{M:02d}')
+        self.assertEqual(minute, timedelta(minutes=1))
+        start = datetime(2026, 1, 5, 10, 0)
+        self.assertEqual(split_time_range(start, start + minute, minute), [(start, start), (start + minute, start + minute)])
+        self.assertIsNone(split_time_range(start, start, minute))
+        self.assertIsNone(split_time_range(start, start))
+
+    def test_planner_splits_a_dense_city_day_into_hours(self):
+        def count_for(start, end, province_id, township_id, filters):
+            # 6 رکورد در هر ساعت؛ تاریخ بدون ساعت کل روز است
+            if end.time() == datetime.min.time():
+                end = day_bounds(end)[1]
+            return 6 * (int((end - start).total_seconds()) // 3600 + 1)
+
+        crawler = PlannerCrawler(count_for)
+        crawler.subday_format = SUBDAY_FORMATS[0]
+        plan = CrawlPlanner(crawler).build_plan(datetime(2026, 1, 5), datetime(2026, 1, 5), 1, 2)
+        self.assertEqual([(window['start_date'], window['end_date'], window['count']) for window in plan.windows], [
+            ('2026/1/5 00:00:00', '2026/1/5 11:59:59', 72),
+            ('2026/1/5 12:00:00', '2026/1/5 23:59:59', 72),
+        ])
+
+
+# ----------------------------------------------------------------------
+# تقسیم با کد سازمان و پیشوند عنوان
+# ----------------------------------------------------------------------
+
+def facet_count(parent, org=None, title=None, sub=None):
+    """count_for یک شهر-روز: بدون فیلتر parent، با فیلتر از دیکشنری‌های org / sub / title"""
+    def count_for(start, end, province_id, township_id, filters):
+        if 'sub_org_code' in filters:
+            return sub[filters['sub_org_code']]
+        if 'main_org_code' in filters:
+            return org[filters['main_org_code']]
+        if 'title' in filters:
+            return title(filters['title'])
+        return parent
+    return count_for
+
+
+class PartitionTests(SimpleTestCase):
+    def plan(self, count_for, partitioners):
+        crawler = PlannerCrawler(count_for)
+        planner = CrawlPlanner(crawler, partitioners=partitioners)
+        return planner, planner.build_plan(datetime(2026, 1, 5), datetime(2026, 1, 5), 1, 2)
+
+    def test_facets(self):
+        org = OrganizationPartitioner([10, 20], {10: [11, 12]})
+        self.assertEqual(org.facets({}), [{'main_org_code': 10}, {'main_org_code': 20}])
+        self.assertEqual(org.facets({'main_org_code': 10}), [
+            {'main_org_code': 10, 'sub_org_code': 11}, {'main_org_code': 10, 'sub_org_code': 12}
+        ])
+        self.assertEqual(org.facets({'main_org_code': 20}), [])
+        titles = TitlePrefixPartitioner(titles=['نان', 'نجار', 'بنا'], max_length=2)
+        self.assertEqual(titles.facets({}), [{'title': 'ب'}, {'title': 'ن'}])
+        self.assertEqual(titles.facets({'title': 'ن'}), [{'title': 'نا'}, {'title': 'نج'}])
+        self.assertEqual(titles.facets({'title': 'نا'}), [])
+        self.assertEqual([p.field for p in build_partitioners([10], titles=['نان'])], ['main_org_code', 'title', 'title'])
+
+    def test_split_is_accepted_when_facets_sum_to_parent(self):
+        _, plan = self.plan(facet_count(150, org={10: 70, 20: 80}), [OrganizationPartitioner([10, 20])])
+        self.assertEqual([(window['filters'], window['count']) for window in plan.windows], [
+            ({'main_org_code': 10}, 70), ({'main_org_code': 20}, 80)
+        ])
+        self.assertEqual(plan.total_count, 150)
+
+    def test_incomplete_facets_fall_through_to_next_partitioner(self):
+        _, plan = self.plan(
+            facet_count(150, org={10: 70, 20: 50}, title=lambda prefix: 75),
+            [OrganizationPartitioner([10, 20]), TitlePrefixPartitioner('ab')]
+        )
+        self.assertEqual([window['filters'] for window in plan.windows], [{'title': 'a'}, {'title': 'b'}])
+
+    def test_sub_org_codes_split_a_dense_main_org(self):
+        _, plan = self.plan(
+            facet_count(180, org={10: 150, 20: 30}, sub={11: 100, 12: 50}),
+            [OrganizationPartitioner([10, 20], {10: [11, 12]})]
+        )
+        self.assertEqual(sorted(window['count'] for window in plan.windows), [30, 50, 100])
+        self.assertEqual(plan.total_count, 180)
+
+    def test_overlapping_field_is_dropped_for_the_rest_of_the_plan(self):
+        # سرور فیلتر title را نادیده می‌گیرد: هر پیشوند کل 150 رکورد را برمی‌گرداند
+        planner, plan = self.plan(facet_count(150, title=lambda prefix: 150), [TitlePrefixPartitioner('ab')])
+        self.assertIn('title', planner._unusable_fields)
+        self.assertEqual(len(plan.windows), 1)
+        self.assertTrue(plan.windows[0]['overflow'])
+        self.assertEqual(plan.windows[0]['filters'], {})
+
+
+# ----------------------------------------------------------------------
+# audit کامل بودن پنجره‌ها
+# ----------------------------------------------------------------------
+
+class AuditTests(TestCase):
+    def setUp(self):
+        self.job = CrawlJob.objects.create(name='audit', start_date='2026/1/1', end_date='2026/1/1')
+
+    def window(self, expected, pages, status='completed', **fields):
+        window = CrawlWindow.objects.create(
+            crawl_job=self.job, start_date='2026/1/1', end_date='2026/1/1',
+            expected_count=expected, status=status, **fields
+        )
+        CrawlPageCheckpoint.objects.bulk_create([
+            CrawlPageCheckpoint(window=window, page=page, records_count=count) for page, count in pages.items()
+        ])
+        return window
+
+    def test_window_report(self):
+        window = self.window(50, {1: 21, 2: 15})
+        report = audit_window(window, {1: 21, 2: 15}, page_size=21, max_records=100)
+        self.assertEqual((report['received'], report['missing'], report['complete']), (36, 14, False))
+        self.assertEqual((report['missing_pages'], report['short_pages']), ([3], [2]))
+        self.assertTrue(audit_window(window, {1: 21, 2: 15}, 21, 100, tolerance=14)['complete'])
+
+    def test_overflow_beyond_api_cap_is_unreachable_not_missing(self):
+        window = self.window(150, {})
+        pages = {1: 21, 2: 21, 3: 21, 4: 21, 5: 16}
+        report = audit_window(window, pages, page_size=21, max_records=100)
+        self.assertEqual((report['unreachable'], report['missing'], report['complete']), (50, 0, True))
+
+    def test_unknown_count_is_never_complete(self):
+        window = self.window(None, {})
+        self.assertFalse(audit_window(window, {1: 5}, 21, 100)['complete'])
+
+    def test_job_report_only_lists_finished_windows_as_under_filled(self):
+        self.window(21, {1: 21})
+        short = self.window(42, {1: 21, 2: 10})
+        self.window(42, {1: 21}, status='running')
+        report = audit_job(self.job, page_size=21, max_records=100, tolerance=0)
+        self.assertEqual((report['windows'], report['complete'], report['unfinished']), (3, 1, 1))
+        self.assertEqual([item['window_id'] for item in report['under_filled']], [short.id])
+        self.assertEqual(report['missing'], 11)
+
+    def test_refetch_drops_only_short_page_checkpoints(self):
+        window = self.window(63, {1: 21, 2: 10, 3: 21})
+        report = audit_job(self.job, page_size=21, max_records=100, tolerance=0)
+        self.assertEqual(prepare_refetch(report['under_filled']), [window.id])
+        window.refresh_from_db()
+        self.assertEqual((window.status, window.refetch_count), ('pending', 1))
+        self.assertEqual(sorted(window.checkpoints.values_list('page', flat=True)), [1, 3])
+
+    def test_refetch_without_a_culprit_page_refetches_the_whole_window(self):
+        window = self.window(42, {1: 21, 2: 20})
+        item = audit_job(self.job, page_size=21, max_records=100, tolerance=0)['under_filled'][0]
+        # صفحه آخر ناقص حساب نمی‌شود؛ مقصری نیست
+        self.assertEqual((item['short_pages'], item['missing_pages']), ([], []))
+        prepare_refetch([item])
+        self.assertFalse(window.checkpoints.exists())
+
+    def test_refetch_respects_max_refetches(self):
+        self.window(42, {1: 21}, refetch_count=2)
+        report = audit_job(self.job, page_size=21, max_records=100, tolerance=0)
+        self.assertEqual(prepare_refetch(report['under_filled'], max_refetches=2), [])
+
+
+# ----------------------------------------------------------------------
+# plan افزایشی بر اساس watermark
+# ----------------------------------------------------------------------
+
+class DayCountCrawler:
+    """فقط count_many روزانه، برای _plan_incremental"""
+
+    def __init__(self, counts):
+        self.counts = counts
+        self.probed = []
+
+    def count_many(self, ranges, province_id=None, township_id=None):
+        self.probed.extend(start for start, _ in ranges)
+        return [self.counts.get(start, 0) for start, _ in ranges]
+
+
+@override_settings(CRAWLER_INCREMENTAL_LOOKBACK_DAYS=3)
+class IncrementalPlanTests(TestCase):
+    def setUp(self):
+        self.job = CrawlJob.objects.create(
+            name='incremental', start_date='2026/1/1', end_date='2026/1/12', mode='incremental', province_id=1
+        )
+        self.ranges = []
+        patcher = mock.patch.object(tasks, '_plan_range', side_effect=self.plan_range)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def plan_range(self, job, crawler, start_date, end_date, total_count=None):
+        self.ranges.append((format_date_for_api(start_date), format_date_for_api(end_date), total_count))
+        return CrawlPlan(), total_count
+
+    def run_plan(self, counts):
+        crawler = DayCountCrawler(counts)
+        _, incremental = tasks._plan_incremental(self.job, crawler, datetime(2026, 1, 1), datetime(2026, 1, 12))
+        return crawler, incremental
+
+    def test_without_watermark_the_whole_range_is_planned(self):
+        crawler, incremental = self.run_plan({'2026/1/12': 4})
+        self.assertEqual(self.ranges, [('2026/1/1', '2026/1/12', None)])
+        self.assertEqual(crawler.probed, ['2026/1/10', '2026/1/11', '2026/1/12'])
+        self.assertEqual(incremental['day_counts'], {'2026/1/10': 0, '2026/1/11': 0, '2026/1/12': 4})
+
+    def test_only_changed_recent_days_and_new_days_are_fetched(self):
+        CrawlWatermark.objects.create(
+            key=CrawlWatermark.scope_key(1, None), province_id=1, synced_until='2026/1/10',
+            day_counts={'2026/1/8': 5, '2026/1/9': 7, '2026/1/10': 2}
+        )
+        crawler, incremental = self.run_plan({'2026/1/8': 5, '2026/1/9': 8, '2026/1/10': 3})
+        # 8 بدون تغییر، 9 و 10 یک بازه پشت سر هم
+        self.assertEqual(self.ranges, [('2026/1/9', '2026/1/10', 11), ('2026/1/11', '2026/1/12', None)])
+        self.assertEqual(incremental['changed_days'], ['2026/1/9', '2026/1/10'])
+        self.assertEqual(incremental['skipped_days'], 7)
+        self.assertEqual(incremental['new_range'], ['2026/1/11', '2026/1/12'])
+        self.assertEqual(sorted(crawler.probed, key=parse_api_date), [
+            '2026/1/8', '2026/1/9', '2026/1/10', '2026/1/11', '2026/1/12'
+        ])
+
+    def test_fully_synced_unchanged_scope_fetches_nothing(self):
+        CrawlWatermark.objects.create(
+            key=CrawlWatermark.scope_key(1, None), province_id=1, synced_until='2026/1/12',
+            day_counts={'2026/1/10': 1, '2026/1/11': 1, '2026/1/12': 1}
+        )
+        _, incremental = self.run_plan({'2026/1/10': 1, '2026/1/11': 1, '2026/1/12': 1})
+        self.assertEqual(self.ranges, [])
+        self.assertIsNone(incremental['new_range'])
+        self.assertEqual(incremental['skipped_days'], 9)
+
+    def test_watermark_of_another_scope_is_ignored(self):
+        CrawlWatermark.objects.create(key=CrawlWatermark.scope_key(None, None), synced_until='2026/1/12')
+        self.run_plan({})
+        self.assertEqual(self.ranges, [('2026/1/1', '2026/1/12', None)])
+
+
+# ----------------------------------------------------------------------
+# تشخیص تغییر مجوزها با content_hash
+# ----------------------------------------------------------------------
+
+class LicenseChangeTests(TestCase):
+    def setUp(self):
+        self.job = CrawlJob.objects.create(name='changes', start_date='2026/1/1', end_date='2026/1/1')
+
+    def test_hash_ignores_crawl_scope_and_key_order(self):
+        record = api_record('R1', responded_at='2026/1/1')
+        reordered = dict(reversed(list(record.items())), province_id=3, township_id=4)
+        self.assertEqual(content_hash(record), content_hash(reordered))
+        self.assertNotEqual(content_hash(record), content_hash({**record, 'license_title': 'دیگر'}))
+
+    def test_unchanged_licence_is_not_rewritten(self):
+        upsert_licenses([api_record('R1')], job=self.job)
+        ids, changed = upsert_licenses([api_record('R1')], job=self.job)
+        self.assertEqual(changed, set())
+        self.assertEqual(list(ids), ['R1'])
+        self.assertIsNone(License.objects.get().changed_at)
+        self.assertFalse(LicenseStatusHistory.objects.exists())
+
+    def test_status_change_is_recorded_in_history(self):
+        upsert_licenses([api_record('R1', responded_at='2026/1/1')], job=self.job)
+        record = api_record('R1', responded_at='2026/1/1', status={'status_slug': 'revoked'})
+        _, changed = upsert_licenses([record], job=self.job)
+        self.assertEqual(changed, {'R1'})
+        license = License.objects.get()
+        self.assertEqual((license.status_slug, license.content_hash), ('revoked', content_hash(record)))
+        self.assertIsNotNone(license.changed_at)
+        history = LicenseStatusHistory.objects.get()
+        self.assertEqual((history.previous_status_slug, history.status_slug, history.crawl_job_id), (
+            'active', 'revoked', self.job.id
+        ))
+
+    def test_content_change_without_status_change_has_no_history(self):
+        upsert_licenses([api_record('R1')], job=self.job)
+        _, changed = upsert_licenses([api_record('R1', applicant_name='نام تازه')], job=self.job)
+        self.assertEqual(changed, {'R1'})
+        self.assertFalse(LicenseStatusHistory.objects.exists())
+
+    def test_rows_without_hash_only_count_as_changed_on_status_change(self):
+        upsert_licenses([api_record('R1')], job=self.job)
+        License.objects.update(content_hash=None)
+        _, changed = upsert_licenses([api_record('R1', applicant_name='نام')], job=self.job)
+        self.assertEqual(changed, set())
+        self.assertIsNotNone(License.objects.get().content_hash)
+
+    def test_changed_licences_are_counted_on_the_job(self):
+        save_crawl_records(self.job, [api_record('R1'), api_record('R2')])
+        later = CrawlJob.objects.create(name='later', start_date='2026/1/1', end_date='2026/1/1')
+        save_crawl_records(later, [api_record('R1', status={'status_slug': 'revoked'}), api_record('R2')])
+        later.refresh_from_db()
+        self.assertEqual(later.changed_records, 1)
+
+    def test_detail_older_than_the_change_is_fetched_again(self):
+        save_crawl_records(self.job, [api_record('R1')])
+        save_mojavez_details([build_mojavez_detail(self.job.records.get(), {'source': 'graphql'})])
+        later = CrawlJob.objects.create(name='later', start_date='2026/1/1', end_date='2026/1/1')
+        save_crawl_records(later, [api_record('R1')])
+        self.assertFalse(later.records.filter(missing_detail_filter()).exists())
+        again = CrawlJob.objects.create(name='again', start_date='2026/1/1', end_date='2026/1/1')
+        save_crawl_records(again, [api_record('R1', status={'status_slug': 'revoked'})])
+        self.assertTrue(again.records.filter(missing_detail_filter()).exists())
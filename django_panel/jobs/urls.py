@@ -3,11 +3,12 @@ URLs for jobs app
 """
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CrawlJobViewSet, CrawlRecordViewSet, index_view, events_view
+from .views import CrawlJobViewSet, CrawlRecordViewSet, ReferenceDataViewSet, index_view, events_view
 
 router = DefaultRouter()
 router.register(r'jobs', CrawlJobViewSet, basename='job')
 router.register(r'records', CrawlRecordViewSet, basename='record')
+router.register(r'reference', ReferenceDataViewSet, basename='reference')
 
 urlpatterns = [
     path('', index_view, name='index'),
@@ -18,9 +18,12 @@ from celery.result import AsyncResult
 from .models import CrawlJob, CrawlRecord
 from .serializers import (
     CrawlJobSerializer, CrawlJobCreateSerializer,
-    CrawlRecordSerializer, CrawlJobStatsSerializer
+    CrawlRecordSerializer, CrawlJobStatsSerializer, CrawlWindowSerializer
 )
-from .tasks import run_crawl_job, fetch_mojavez_details_for_job
+from .tasks import run_crawl_job, fetch_mojavez_details_for_job, refetch_incomplete_windows, refresh_reference_data
+from .audit import audit_job
+from .caches import get_shared_reference_data
+from .workers import get_workers_info
 
 
 @login_required
@@ -94,37 +97,12 @@ def events_view(request):
     return response
 
 
-def _get_workers_info():
-    inspect = current_app.control.inspect()
-    active_queues = inspect.active_queues() or {}
-    pings = inspect.ping() or {}
-    workers = []
-
-    for worker_name, queues in active_queues.items():
-        queue_names = [q.get('name') for q in (queues or []) if q.get('name')]
-        workers.append({
-            'name': worker_name,
-            'queues': queue_names,
-            'online': worker_name in pings,
-        })
-
-    for worker_name in settings.CELERY_KNOWN_WORKERS:
-        if worker_name not in active_queues:
-            workers.append({
-                'name': worker_name,
-                'queues': [settings.CELERY_DEFAULT_QUEUE],
-                'online': False,
-            })
-
-    return workers
-
-
 def _resolve_target_queue(target_worker=None, target_queue=None):
     if target_queue:
         return target_queue
 
     if target_worker:
-        workers = _get_workers_info()
+        workers = get_workers_info()
         for worker in workers:
             if worker.get('name') == target_worker:
                 queues = worker.get('queues') or []
@@ -134,6 +112,19 @@ def _resolve_target_queue(target_worker=None, target_queue=None):
     return settings.CELERY_DEFAULT_QUEUE
 
 
+def _fill_location_names(job):
+    """پر کردن نام استان/شهر از کش استان/شهر وقتی کاربر فقط شناسه داده است"""
+    reference_data = get_shared_reference_data()
+    if job.province_id and not job.province_name:
+        province = reference_data.find_province(job.province_id)
+        if province:
+            job.province_name = province.get('name')
+    if job.township_id and not job.township_name:
+        township = reference_data.find_township(job.township_id)
+        if township:
+            job.township_name = township.get('name')
+
+
 @method_decorator(csrf_exempt, name='dispatch')
 class CrawlJobViewSet(viewsets.ModelViewSet):
     """ViewSet برای مدیریت کراول جاب‌ها"""
@@ -152,6 +143,7 @@ class CrawlJobViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
 
         job = serializer.save()
+        _fill_location_names(job)
 
         target_worker = serializer.validated_data.get('target_worker')
         target_queue = serializer.validated_data.get('target_queue')
@@ -232,6 +224,49 @@ class CrawlJobViewSet(viewsets.ModelViewSet):
         serializer = CrawlRecordSerializer(records, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'])
+    def windows(self, request, pk=None):
+        """پنجره‌های برگ یک کراول جاب و وضعیت هر کدام"""
+        job = self.get_object()
+        windows = job.windows.annotate(checkpointed_pages=Count('checkpoints'))
+        status_filter = request.query_params.get('status')
+        if status_filter:
+            windows = windows.filter(status=status_filter)
+
+        page = self.paginate_queryset(windows)
+        if page is not None:
+            serializer = CrawlWindowSerializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = CrawlWindowSerializer(windows, many=True)
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def audit(self, request, pk=None):
+        """
+        گزارش کامل بودن: تعداد مورد انتظار و دریافتی هر پنجره، پنجره‌های ناقص و سرریز
+
+        گزارش همین لحظه از روی checkpointها ساخته می‌شود؛ گزارش پایان جاب در CrawlJob.audit است.
+        """
+        job = self.get_object()
+        return Response({'job_id': job.id, 'status': job.status, **audit_job(job)})
+
+    @action(detail=True, methods=['post'])
+    def refetch(self, request, pk=None):
+        """دریافت دوباره فقط صفحات ناقص پنجره‌های under-filled (نه کل جاب)"""
+        job = self.get_object()
+        if job.status in ('running', 'cancelled'):
+            return Response(
+                {'error': f'Job is {job.status}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        queue = job.target_queue or settings.CELERY_DEFAULT_QUEUE
+        task = refetch_incomplete_windows.apply_async(args=[job.id], queue=queue)
+        return Response(
+            {'message': 'Re-fetch of under-filled windows started', 'task_id': task.id, 'queue': queue},
+            status=status.HTTP_202_ACCEPTED,
+        )
+
     @action(detail=False, methods=['get'])
     def stats(self, request):
         """دریافت آمار کلی"""
@@ -305,7 +340,7 @@ class CrawlJobViewSet(viewsets.ModelViewSet):
     def requeue(self, request, pk=None):
         """
         احیا: ارسال مجدد تسک این job به صف Redis (مثلاً بعد از کرش Redis و پاک شدن صف).
-        تسک قبلی در صورت وجود لغو می‌شود؛ یک تسک جدید به صف فرستاده می‌شود و job از همان checkpoint ادامه می‌دهد.
+        تسک قبلی در صورت وجود لغو می‌شود؛ یک تسک جدید به صف فرستاده می‌شود و فقط پنجره‌هایی که completed نشده‌اند دوباره اجرا می‌شوند.
         """
         job = self.get_object()
         if job.status == 'completed':
@@ -340,7 +375,7 @@ class CrawlJobViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def workers(self, request):
         """لیست ورکرها و صف‌های فعال"""
-        workers = _get_workers_info()
+        workers = get_workers_info()
         return Response({
             'workers': workers,
             'default_queue': settings.CELERY_DEFAULT_QUEUE,
@@ -379,3 +414,35 @@ class CrawlRecordViewSet(viewsets.ReadOnlyModelViewSet):
             queryset = queryset.filter(crawl_job_id=job_id)
         
         return queryset
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ReferenceDataViewSet(viewsets.ViewSet):
+    """ViewSet برای لیست استان‌ها و شهرها (از کش مشترک استان/شهر)"""
+
+    @action(detail=False, methods=['get'])
+    def provinces(self, request):
+        """لیست استان‌ها"""
+        reference_data = get_shared_reference_data()
+        return Response({
+            'provinces': reference_data.get_provinces(),
+            'stale': reference_data.is_stale(),
+        })
+
+    @action(detail=False, methods=['get'])
+    def townships(self, request):
+        """لیست شهرهای یک استان (?province_id=)"""
+        province_id = request.query_params.get('province_id')
+        if not province_id or not province_id.isdigit():
+            return Response(
+                {'error': 'province_id is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        townships = get_shared_reference_data().get_townships(int(province_id))
+        return Response({'province_id': int(province_id), 'townships': townships or []})
+
+    @action(detail=False, methods=['post'])
+    def refresh(self, request):
+        """refresh دستی کش استان/شهر در پس‌زمینه"""
+        task = refresh_reference_data.apply_async(queue=settings.CELERY_DEFAULT_QUEUE)
+        return Response({'message': 'Reference data refresh started', 'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
@@ -0,0 +1,47 @@
+"""
+Celery worker discovery
+اطلاعات ورکرها و صف‌های فعال برای مسیریابی تسک‌ها (پنل و تقسیم کار بین ورکرها)
+"""
+from celery import current_app
+from django.conf import settings
+
+
+def get_workers_info():
+    inspect = current_app.control.inspect()
+    active_queues = inspect.active_queues() or {}
+    pings = inspect.ping() or {}
+    workers = []
+
+    for worker_name, queues in active_queues.items():
+        queue_names = [q.get('name') for q in (queues or []) if q.get('name')]
+        workers.append({
+            'name': worker_name,
+            'queues': queue_names,
+            'online': worker_name in pings,
+        })
+
+    for worker_name in settings.CELERY_KNOWN_WORKERS:
+        if worker_name not in active_queues:
+            workers.append({
+                'name': worker_name,
+                'queues': [settings.CELERY_DEFAULT_QUEUE],
+                'online': False,
+            })
+
+    return workers
+
+
+def get_online_queues(workers=None):
+    """
+    صف‌های ورکرهای آنلاین، به ازای هر ورکر یک بار (صف اول آن ورکر)
+
+    یک صف ممکن است چند بار بیاید (چند ورکر روی یک صف)؛ این تکرار عمداً حفظ می‌شود
+    تا تقسیم round-robin به نسبت تعداد ورکرهای هر صف باشد.
+    """
+    if workers is None:
+        workers = get_workers_info()
+    return [
+        worker['queues'][0]
+        for worker in workers
+        if worker.get('online') and worker.get('queues')
+    ]
@@ -0,0 +1,336 @@
+"""
+GraphQL queries and response parsers for qr.mojavez.ir
+queryها و توابع پارس پاسخ که بین کراولر sync و async مشترک هستند
+"""
+
+from typing import Dict, List, Optional, Any
+
+
+# هدرهای پیش‌فرض درخواست‌ها
+DEFAULT_HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept': 'application/json',
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+}
+
+# آدرس صفحه track هر مجوز
+TRACK_PAGE_URL = "https://qr.mojavez.ir/track/{request_number}"
+
+# استفاده از countFilteredLicenses بر اساس schema واقعی
+COUNT_QUERY = """
+query CountFilteredLicenses($input: filterLicensesInput!) {
+    countFilteredLicenses(input: $input) {
+        total
+    }
+}
+"""
+
+# استفاده از filterLicenses بر اساس schema واقعی
+FILTER_LICENSES_QUERY = """
+query FilterLicenses($input: filterLicensesInput!) {
+    filterLicenses(input: $input) {
+        license {
+            request_number
+            applicant_name
+            user_image
+            license_title
+            organization_title
+            province_title
+            township_title
+            responded_at
+            status {
+                status_id
+                status_title
+                status_slug
+            }
+        }
+        pagination {
+            total
+            per_page
+            current_page
+        }
+    }
+}
+"""
+
+PROVINCES_QUERY = """
+query GetProvinces {
+    provinceTownship {
+        provinces {
+            id
+            name
+        }
+    }
+}
+"""
+
+TOWNSHIPS_QUERY = """
+query GetTownships($provinceId: Int!) {
+    provinceTownship {
+        townships(provinceId: $provinceId) {
+            id
+            name
+        }
+    }
+}
+"""
+
+# زیرانتخاب‌های licenseRequestDetails؛ $id در query دسته‌ای با $id0, $id1, ... جایگزین می‌شود
+LICENSE_DETAILS_SELECTION = """
+        license(id: $id) {
+            license_title
+            organization_title
+            isic_code
+            issue_type
+            responded_at
+            old_license_responded_at
+            expires_at
+            status {
+                status_id
+                status_title
+                status_slug
+            }
+        }
+        location(id: $id) {
+            province
+            township
+            postal_code
+            address
+            map
+        }
+        applicant(id: $id) {
+            applicant_name
+            user_type
+            company_name
+            father_name
+            code
+            user_image
+            work_mobile
+        }
+        approval(id: $id) {
+            approval_title
+            respondent_organization
+            receiver_gateway
+            approval_type
+            request_type
+        }
+        history(id: $id) {
+            license_operation
+            operation_reasons
+            created_at
+            status
+        }
+        note(id: $id) {
+            foot_notes
+            aside_notes
+        }
+"""
+
+LICENSE_DETAILS_QUERY = (
+    "query LicenseRequestDetails($id: String!) {\n"
+    "    licenseRequestDetails {" + LICENSE_DETAILS_SELECTION + "    }\n"
+    "}\n"
+)
+
+EMPTY_PAGINATION = {'total': 0, 'per_page': 0, 'current_page': 0, 'total_pages': 0}
+
+# فیلدهای filterLicensesInput که برای تقسیم پنجره‌های پرتراکم استفاده می‌شوند (partitioning.py)
+PARTITION_FILTER_FIELDS = ('main_org_code', 'sub_org_code', 'title')
+
+
+def build_filter_input(
+    start_date: str,
+    end_date: str,
+    province_id: Optional[int] = None,
+    township_id: Optional[int] = None,
+    page: Optional[int] = None,
+    filters: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    ساخت input object برای filterLicensesInput بر اساس ساختار واقعی
+
+    Args:
+        start_date: تاریخ شروع (فرمت: YYYY/M/D)
+        end_date: تاریخ پایان (فرمت: YYYY/M/D)
+        province_id: شناسه استان (اختیاری)
+        township_id: شناسه شهر (اختیاری)
+        page: شماره صفحه (فقط برای filterLicenses)
+        filters: مقدار فیلدهای PARTITION_FILTER_FIELDS (main_org_code، sub_org_code، title)
+
+    Returns:
+        دیکشنری input
+    """
+    input_obj = {
+        "title": "",
+        "name": "",
+        "issue_start_date": "",
+        "issue_end_date": "",
+        "last_op_start_date": start_date,
+        "last_op_end_date": end_date,
+        "main_org_code": None,
+        "sub_org_code": None
+    }
+
+    if page is not None:
+        # page باید String باشد
+        # Note: pageSize is not in the schema, API uses default page size
+        input_obj["page"] = str(page)
+
+    # اضافه کردن فیلترهای اختیاری
+    if province_id:
+        input_obj["province_id"] = province_id
+    if township_id:
+        input_obj["township_id"] = township_id
+    for field, value in (filters or {}).items():
+        if field in PARTITION_FILTER_FIELDS:
+            input_obj[field] = value
+
+    return input_obj
+
+
+def parse_count_response(result: Dict[str, Any]) -> int:
+    """
+    استخراج total از پاسخ countFilteredLicenses
+
+    Raises:
+        ValueError: اگر پاسخ شامل errors باشد
+    """
+    if 'errors' in result:
+        raise ValueError(f"GraphQL errors: {result['errors']}")
+
+    # Response path: data.countFilteredLicenses.total
+    count_result = (result.get('data') or {}).get('countFilteredLicenses') or {}
+    return count_result.get('total', 0) or 0
+
+
+def parse_pagination(pagination: Optional[Dict[str, Any]]) -> Dict[str, int]:
+    """تبدیل pagination خام سرور به دیکشنری با total_pages محاسبه‌شده"""
+    pagination_info = dict(EMPTY_PAGINATION)
+    if not pagination:
+        return pagination_info
+
+    pagination_info['total'] = pagination.get('total') or 0
+    pagination_info['per_page'] = pagination.get('per_page') or 0
+    pagination_info['current_page'] = pagination.get('current_page') or 0
+    if pagination_info['per_page'] and pagination_info['per_page'] > 0:
+        pagination_info['total_pages'] = (pagination_info['total'] + pagination_info['per_page'] - 1) // pagination_info['per_page']
+    return pagination_info
+
+
+def parse_filter_response(result: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    استخراج رکوردها و pagination از پاسخ filterLicenses
+
+    Raises:
+        ValueError: اگر پاسخ شامل errors باشد
+
+    Returns:
+        {'records': [...], 'pagination': {...}, 'has_pagination': bool}
+    """
+    if 'errors' in result:
+        raise ValueError(f"GraphQL errors: {result['errors']}")
+
+    # مسیر پاسخ: data.filterLicenses.license
+    filter_response = (result.get('data') or {}).get('filterLicenses') or {}
+    licenses = filter_response.get('license') or []
+    pagination = filter_response.get('pagination')
+
+    return {
+        'records': licenses,
+        'pagination': parse_pagination(pagination),
+        'has_pagination': bool(pagination),
+    }
+
+
+def parse_reference_list(result: Dict[str, Any], key: str) -> list:
+    """استخراج provinces یا townships از پاسخ provinceTownship"""
+    province_township = (result.get('data') or {}).get('provinceTownship') or {}
+    return province_township.get(key) or []
+
+
+def parse_detail_payload(request_number: str, details: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    تبدیل خروجی licenseRequestDetails به دیکشنری مناسب جدول mojavez_detail
+
+    Args:
+        request_number: کد رهگیری
+        details: مقدار data.licenseRequestDetails
+
+    Returns:
+        دیکشنری داده‌ها یا None اگر جزئیاتی نباشد
+    """
+    if not details:
+        return None
+
+    info = details.get("license") or {}
+    location = details.get("location") or {}
+    status = info.get("status") if isinstance(info.get("status"), dict) else {}
+
+    return {
+        "request_number": request_number,
+        "license_title": info.get("license_title"),
+        "organization_title": info.get("organization_title"),
+        "isic_code": info.get("isic_code"),
+        "issue_type": info.get("issue_type"),
+        "issued_at": info.get("responded_at") or info.get("old_license_responded_at"),
+        "expires_at": info.get("expires_at"),
+        "province_title_detail": location.get("province"),
+        "township_title_detail": location.get("township"),
+        "postal_code": location.get("postal_code"),
+        "business_address": location.get("address"),
+        "status_title": status.get("status_title"),
+        "status_slug": status.get("status_slug"),
+        "raw_graphql": details,
+        "source": "graphql",
+    }
+
+
+def build_details_batch_query(count: int) -> str:
+    """
+    query چند مجوز در یک درخواست با alias: r0: licenseRequestDetails {...}, r1: ...
+
+    متغیرها $id0 .. $id{count-1} هستند (details_batch_variables).
+    """
+    params = ", ".join(f"$id{i}: String!" for i in range(count))
+    blocks = "".join(
+        f"    r{i}: licenseRequestDetails {{" + LICENSE_DETAILS_SELECTION.replace("$id", f"$id{i}") + "    }\n"
+        for i in range(count)
+    )
+    return f"query LicenseRequestDetailsBatch({params}) {{\n{blocks}}}\n"
+
+
+def details_batch_variables(request_numbers: List[str]) -> Dict[str, str]:
+    return {f"id{i}": request_number for i, request_number in enumerate(request_numbers)}
+
+
+def parse_details_batch_response(
+    result: Dict[str, Any],
+    request_numbers: List[str]
+) -> List[Optional[Dict[str, Any]]]:
+    """
+    پارس پاسخ build_details_batch_query
+
+    خطاهای جزئی با path (مثلاً ["r3", "license"]) به همان alias نسبت داده می‌شوند و فقط آن
+    مجوز None می‌شود؛ بقیه پاسخ‌ها با parse_detail_payload تبدیل می‌شوند.
+
+    Returns:
+        لیست به ترتیب request_numbers
+    """
+    data = result.get("data") or {}
+    failed_aliases = set()
+    for error in result.get("errors") or []:
+        path = error.get("path") or []
+        if path and isinstance(path[0], str):
+            failed_aliases.add(path[0])
+        else:
+            # خطای بدون path به کل query مربوط است
+            return [None] * len(request_numbers)
+
+    details = []
+    for i, request_number in enumerate(request_numbers):
+        alias = f"r{i}"
+        if alias in failed_aliases:
+            details.append(None)
+        else:
+            details.append(parse_detail_payload(request_number, data.get(alias)))
+    return details
@@ -0,0 +1,133 @@
+"""
+Extra partition dimensions for overflowing crawl windows
+وقتی یک شهر در یک روز (یا کوچک‌ترین بازه زیرروزی) هنوز بیش از سقف 2100 رکورد دارد،
+CrawlPlanner آن را با فیلدهای دیگر filterLicensesInput تقسیم می‌کند: کد سازمان صادرکننده
+(main_org_code / sub_org_code) و پیشوند عنوان مجوز (title).
+
+هر Partitioner برای فیلترهای فعلی یک گره، فیلترهای فرزندان (facetها) را برمی‌گرداند. planner
+تقسیمی را فقط وقتی می‌پذیرد که جمع count فرزندان دقیقاً برابر count والد باشد؛ پس لیست ناقص
+(کدی که در لیست نیست، عنوانی که با حرف دیگری شروع می‌شود) یا facetهای همپوشان (اگر سرور
+title را «شامل» تطبیق دهد) هیچ رکوردی را بی‌صدا حذف نمی‌کنند.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+
+# حروف الفبای فارسی؛ برای عنوان‌هایی که هنوز در دیتابیس نیستند
+DEFAULT_TITLE_ALPHABET = 'آابپتثجچحخدذرزژسشصضطظعغفقکگلمنوهی'
+
+
+class Partitioner:
+    """پایه partitionerها؛ name در لاگ و plan استفاده می‌شود، field فیلد filterLicensesInput که تقسیم می‌کند"""
+
+    name = ''
+    field = ''
+
+    def facets(self, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """
+        فیلترهای فرزندان یک گره
+
+        Args:
+            filters: فیلترهای partition فعلی گره ({} برای گره بدون فیلتر)
+
+        Returns:
+            لیست فیلترها (هر کدام شامل filters به علاوه یک مقدار جدید)؛ خالی اگر این محور
+            برای این گره قابل استفاده نیست
+        """
+        raise NotImplementedError
+
+
+class OrganizationPartitioner(Partitioner):
+    """تقسیم بر اساس main_org_code و سپس (اگر کدهای زیرمجموعه معلوم باشند) sub_org_code"""
+
+    name = 'organization'
+    field = 'main_org_code'
+
+    def __init__(self, org_codes: Iterable[Any], sub_org_codes: Optional[Dict[Any, List[Any]]] = None):
+        """
+        Args:
+            org_codes: کدهای سازمان اصلی
+            sub_org_codes: {main_org_code: لیست sub_org_code} (اختیاری)
+        """
+        self.org_codes = list(org_codes)
+        self.sub_org_codes = sub_org_codes or {}
+
+    def facets(self, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        if 'main_org_code' not in filters:
+            return [{**filters, 'main_org_code': code} for code in self.org_codes]
+        if 'sub_org_code' not in filters:
+            sub_codes = self.sub_org_codes.get(filters['main_org_code']) or []
+            return [{**filters, 'sub_org_code': code} for code in sub_codes]
+        return []
+
+
+class TitlePrefixPartitioner(Partitioner):
+    """
+    تقسیم بر اساس پیشوند عنوان مجوز؛ هر سطح یک حرف به پیشوند اضافه می‌کند
+
+    با titles، حرف بعدی فقط از عنوان‌های شناخته‌شده با همان پیشوند انتخاب می‌شود (probeهای
+    کمتر)؛ بدون آن همه حروف alphabet امتحان می‌شوند.
+    """
+
+    field = 'title'
+
+    def __init__(
+        self,
+        alphabet: str = DEFAULT_TITLE_ALPHABET,
+        titles: Optional[Iterable[str]] = None,
+        max_length: int = 3,
+        name: str = 'title'
+    ):
+        """
+        Args:
+            alphabet: حروف قابل استفاده در پیشوند (وقتی titles داده نشده)
+            titles: عنوان‌های شناخته‌شده (مثلاً از دیتابیس)
+            max_length: حداکثر طول پیشوند
+            name: نام در لاگ و plan
+        """
+        self.alphabet = alphabet
+        self.max_length = max_length
+        self.name = name
+        self._next_chars: Optional[Dict[str, List[str]]] = None
+        if titles is not None:
+            next_chars: Dict[str, set] = {}
+            for title in titles:
+                title = (title or '').strip()
+                for i in range(min(len(title), max_length)):
+                    next_chars.setdefault(title[:i], set()).add(title[i])
+            self._next_chars = {prefix: sorted(chars) for prefix, chars in next_chars.items()}
+
+    def facets(self, filters: Dict[str, Any]) -> List[Dict[str, Any]]:
+        prefix = filters.get('title') or ''
+        if len(prefix) >= self.max_length:
+            return []
+        if self._next_chars is not None:
+            chars = self._next_chars.get(prefix) or []
+        else:
+            chars = list(self.alphabet)
+        return [{**filters, 'title': prefix + char} for char in chars]
+
+
+def build_partitioners(
+    org_codes: Optional[Iterable[Any]] = None,
+    sub_org_codes: Optional[Dict[Any, List[Any]]] = None,
+    titles: Optional[Iterable[str]] = None,
+    title_alphabet: str = DEFAULT_TITLE_ALPHABET,
+    title_max_length: int = 3
+) -> List[Partitioner]:
+    """
+    لیست partitionerها برای CrawlPlanner از لیست‌های مرجع موجود
+
+    planner برای هر گره ابتدا partitioner با کمترین facet را امتحان می‌کند و اگر جمع فرزندان
+    برابر والد نبود سراغ بعدی می‌رود.
+    """
+    partitioners: List[Partitioner] = []
+    org_codes = list(org_codes or [])
+    if org_codes:
+        partitioners.append(OrganizationPartitioner(org_codes, sub_org_codes))
+    if titles:
+        partitioners.append(TitlePrefixPartitioner(titles=titles, max_length=title_max_length))
+    if title_alphabet:
+        partitioners.append(TitlePrefixPartitioner(
+            title_alphabet, max_length=title_max_length, name='title_alphabet'
+        ))
+    return partitioners
@@ -0,0 +1,533 @@
+"""
+Count-first crawl planner
+قبل از دریافت هر رکوردی، کل درخت تقسیم (تاریخ ← استان ← شهر ← ساعت ← partitionerها) را با probeهای count
+می‌سازد و یک plan قابل سریال‌سازی از پنجره‌های برگ (هر کدام ≤ MAX_RECORDS_PER_REQUEST) برمی‌گرداند.
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Any
+
+from count_cache import count_cache_key
+from date_utils import (
+    day_bounds,
+    format_date_for_api,
+    format_datetime_for_api,
+    parse_api_date,
+    split_time_range,
+    subday_resolution,
+)
+from partitioning import Partitioner
+
+logger = logging.getLogger(__name__)
+
+
+class CrawlPlan:
+    """
+    خروجی planner: لیست پنجره‌های برگ به همراه تخمین تعداد درخواست
+
+    هر پنجره یک دیکشنری است:
+        start_date / end_date: رشته تاریخ API (YYYY/M/D)
+        province_id / township_id: فیلتر موقعیت (یا None)
+        filters: فیلترهای partition (main_org_code / sub_org_code / title)؛ {} اگر لازم نبود
+        count: تعداد رکورد طبق countFilteredLicenses؛ None اگر probe حتی بعد از تکرار خطا داد
+        overflow: True اگر پنجره قابل تقسیم بیشتر نبود و هنوز از سقف بیشتر است
+        probe_failed: True اگر count نامعلوم است (executor آن را از total صفحه اول می‌گیرد)
+    """
+
+    def __init__(
+        self,
+        windows: Optional[List[Dict[str, Any]]] = None,
+        probe_count: int = 0,
+        page_size: int = 21,
+        avg_request_seconds: float = 0.0,
+        concurrency: int = 1
+    ):
+        self.windows = windows or []
+        self.probe_count = probe_count
+        self.page_size = page_size
+        self.avg_request_seconds = avg_request_seconds
+        self.concurrency = max(1, concurrency)
+
+    @property
+    def total_count(self) -> int:
+        return sum(w['count'] or 0 for w in self.windows)
+
+    @property
+    def estimated_pages(self) -> int:
+        return sum(self.window_pages(w) for w in self.windows)
+
+    @property
+    def estimated_requests(self) -> int:
+        """تعداد درخواست‌های دریافت صفحه که executor خواهد زد"""
+        return self.estimated_pages
+
+    @property
+    def estimated_seconds(self) -> int:
+        """تخمین زمان اجرا بر اساس میانگین latency probeها و تعداد درخواست همزمان"""
+        return int(self.estimated_requests * self.avg_request_seconds / self.concurrency)
+
+    @property
+    def overflow_windows(self) -> List[Dict[str, Any]]:
+        return [w for w in self.windows if w.get('overflow')]
+
+    def window_pages(self, window: Dict[str, Any]) -> int:
+        if window['count'] is None:
+            # count نامعلوم: حداقل صفحه اول درخواست می‌شود
+            return 1
+        return (window['count'] + self.page_size - 1) // self.page_size
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'windows': self.windows,
+            'probe_count': self.probe_count,
+            'page_size': self.page_size,
+            'avg_request_seconds': self.avg_request_seconds,
+            'concurrency': self.concurrency,
+            'total_count': self.total_count,
+            'estimated_requests': self.estimated_requests,
+            'estimated_seconds': self.estimated_seconds,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'CrawlPlan':
+        return cls(
+            windows=data.get('windows') or [],
+            probe_count=data.get('probe_count', 0),
+            page_size=data.get('page_size', 21),
+            avg_request_seconds=data.get('avg_request_seconds', 0.0),
+            concurrency=data.get('concurrency', 1),
+        )
+
+
+class CrawlPlanner:
+    """
+    ساخت CrawlPlan با probeهای count موازی
+
+    تقسیم به همان ترتیب crawl_date_range انجام می‌شود: تکه‌های تاریخ ← استان‌ها ← شهرها ← بازه‌های ساعتی
+    (فقط اگر API فرمت زیرروزی را بپذیرد؛ MojavezCrawler.get_subday_format) ← partitionerها
+    (partitioning.py: کد سازمان، پیشوند عنوان). از بین partitionerها آن که facet کمتری دارد اول
+    امتحان می‌شود و تقسیم فقط اگر جمع فرزندان دقیقاً برابر والد باشد پذیرفته می‌شود. اگر در سطح اول
+    یک محور جمع فرزندان از والد بیشتر شود (سرور آن فیلد را نادیده می‌گیرد یا «شامل» تطبیق می‌دهد)
+    آن محور برای بقیه plan کنار گذاشته می‌شود.
+    بازه‌های تاریخ با split_date_range_by_density مستقیماً به تکه‌های زیر سقف بریده می‌شوند.
+    probeهای هر سطح درخت همزمان (با سقف max_concurrency کراولر) ارسال می‌شوند. probe ناموفق
+    PROBE_RETRY_ROUNDS بار دوباره ارسال می‌شود؛ گره‌ای که count آن هنوز نامعلوم است بدون count
+    تقسیم می‌شود (تاریخ / استان / شهر) یا برگ با count=None و probe_failed می‌شود.
+    """
+
+    PROBE_RETRY_ROUNDS = 1
+
+    def __init__(
+        self,
+        crawler,
+        daily_density: Optional[Dict[Any, float]] = None,
+        partitioners: Optional[List[Partitioner]] = None
+    ):
+        """
+        Args:
+            crawler: نمونه MojavezCrawler (برای کلاینت async و تنظیمات)
+            daily_density: {date: تعداد رکورد} تاریخی برای تقسیم تراکم‌محور (اختیاری)
+            partitioners: محورهای تقسیم بعد از شهر و ساعت (partitioning.build_partitioners)
+        """
+        self.crawler = crawler
+        self.daily_density = daily_density or {}
+        self.partitioners = partitioners or []
+        self._unusable_fields: set = set()
+        self.max_records = crawler.MAX_RECORDS_PER_REQUEST
+        self._provinces: Optional[asyncio.Future] = None
+        self._cities: Dict[int, asyncio.Future] = {}
+        self._probe_count = 0
+        self._probe_seconds = 0.0
+
+    def build_plan(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        province_id: Optional[int] = None,
+        township_id: Optional[int] = None,
+        total_count: Optional[int] = None
+    ) -> CrawlPlan:
+        """
+        ساخت plan برای یک بازه
+
+        Args:
+            start_date: تاریخ شروع
+            end_date: تاریخ پایان
+            province_id: شناسه استان (اختیاری)
+            township_id: شناسه شهر (اختیاری)
+            total_count: تعداد کل اگر از قبل معلوم است (یک probe کمتر)
+
+        Returns:
+            CrawlPlan
+        """
+        windows = self.crawler._submit_async(
+            self._build(start_date, end_date, province_id, township_id, total_count)
+        ).result()
+
+        # اگر همه countها از کش آمدند latency اندازه‌گیری نشده؛ یک ثانیه فرض می‌شود
+        avg_seconds = self._probe_seconds / self._probe_count if self._probe_count else 1.0
+        plan = CrawlPlan(
+            windows=windows,
+            probe_count=self._probe_count,
+            page_size=self.crawler.PAGE_SIZE,
+            avg_request_seconds=round(avg_seconds, 3),
+            concurrency=self.crawler.max_concurrency,
+        )
+        logger.info(
+            f"🗺️ Plan ready: {len(plan.windows)} windows, {plan.total_count} records, "
+            f"~{plan.estimated_requests} page requests, {plan.probe_count} count probes, "
+            f"{len(plan.overflow_windows)} overflow windows"
+        )
+        return plan
+
+    def _node(self, start_date, end_date, province_id, township_id, count=None, filters=None) -> Dict[str, Any]:
+        return {
+            'start': start_date,
+            'end': end_date,
+            'province_id': province_id,
+            'township_id': township_id,
+            'filters': filters or {},
+            'count': count,
+        }
+
+    def _dates(self, node: Dict[str, Any]):
+        """رشته‌های API شروع و پایان گره (روزی یا زیرروزی)"""
+        template = node.get('subday')
+        if template:
+            return format_datetime_for_api(node['start'], template), format_datetime_for_api(node['end'], template)
+        return format_date_for_api(node['start']), format_date_for_api(node['end'])
+
+    def _to_window(self, node: Dict[str, Any], overflow: bool = False) -> Dict[str, Any]:
+        start_date, end_date = self._dates(node)
+        return {
+            'start_date': start_date,
+            'end_date': end_date,
+            'province_id': node['province_id'],
+            'township_id': node['township_id'],
+            'filters': node['filters'],
+            'count': node['count'],
+            'overflow': overflow,
+            'probe_failed': node.get('probe_failed', False),
+        }
+
+    async def _count(self, node: Dict[str, Any]) -> Optional[int]:
+        """probe تعداد یک پنجره؛ None در صورت خطا"""
+        client = self.crawler._get_async_client()
+        started = time.monotonic()
+        count = await client.get_records_count(
+            *self._dates(node),
+            node['province_id'],
+            node['township_id'],
+            default=None,
+            filters=node['filters'] or None
+        )
+        self._probe_seconds += time.monotonic() - started
+        self._probe_count += 1
+        return count
+
+    async def _count_many(self, nodes: List[Dict[str, Any]]):
+        """
+        پر کردن count گره‌ها: ابتدا از count_cache کراولر (یک جستجوی دسته‌ای)، بقیه با probe همزمان
+        """
+        cache = self.crawler.count_cache
+        keys = [
+            count_cache_key(*self._dates(node), node['province_id'], node['township_id'], node['filters'])
+            for node in nodes
+        ]
+
+        cached: Dict[str, int] = {}
+        if cache is not None:
+            # کش ممکن است sync و مبتنی بر دیتابیس باشد؛ بیرون از event loop اجرا می‌شود
+            cached = await asyncio.to_thread(cache.get_many, keys)
+
+        to_probe = []
+        for node, key in zip(nodes, keys):
+            if key in cached:
+                node['count'] = cached[key]
+            else:
+                to_probe.append(node)
+
+        counts = await asyncio.gather(*[self._count(node) for node in to_probe])
+        failed = [index for index, count in enumerate(counts) if count is None]
+        for _ in range(self.PROBE_RETRY_ROUNDS):
+            if not failed:
+                break
+            logger.warning(f"⚠️ {len(failed)} count probes failed; probing them again")
+            retried = await asyncio.gather(*[self._count(to_probe[index]) for index in failed])
+            for index, count in zip(failed, retried):
+                counts[index] = count
+            failed = [index for index in failed if counts[index] is None]
+        fresh = []
+        for node, count in zip(to_probe, counts):
+            if count is None:
+                # count نامعلوم (نه صفر): _build گره را بدون count تقسیم می‌کند یا برگ probe_failed می‌سازد
+                node['count'] = None
+                node['probe_failed'] = True
+                continue
+            node['count'] = count
+            start_date, end_date = self._dates(node)
+            fresh.append({
+                'start_date': start_date,
+                'end_date': end_date,
+                'province_id': node['province_id'],
+                'township_id': node['township_id'],
+                'filters': node['filters'],
+                'total': count,
+            })
+
+        if cache is not None and fresh:
+            await asyncio.to_thread(cache.set_many, fresh)
+
+    async def _get_provinces(self) -> List[Dict[str, Any]]:
+        # Task مشترک تا probeهای همزمان لیست را دوبار دریافت نکنند
+        if self._provinces is None:
+            self._provinces = asyncio.ensure_future(self._load_provinces())
+        return await self._provinces
+
+    async def _get_cities(self, province_id: int) -> List[Dict[str, Any]]:
+        if province_id not in self._cities:
+            self._cities[province_id] = asyncio.ensure_future(self._load_cities(province_id))
+        return await self._cities[province_id]
+
+    async def _load_provinces(self) -> List[Dict[str, Any]]:
+        reference_data = self.crawler.reference_data
+        if reference_data is not None:
+            provinces = await asyncio.to_thread(reference_data.get_provinces)
+            if provinces:
+                return provinces
+        provinces = await self.crawler._get_async_client().get_provinces()
+        if reference_data is not None and provinces:
+            await asyncio.to_thread(reference_data.set_provinces, provinces)
+        return provinces
+
+    async def _load_cities(self, province_id: int) -> List[Dict[str, Any]]:
+        reference_data = self.crawler.reference_data
+        if reference_data is not None:
+            cities = await asyncio.to_thread(reference_data.get_townships, province_id)
+            if cities is not None:
+                return cities
+        cities = await self.crawler._get_async_client().get_cities(province_id)
+        if reference_data is not None and cities:
+            await asyncio.to_thread(reference_data.set_townships, province_id, cities)
+        return cities
+
+    def _splittable_without_count(self, node: Dict[str, Any]) -> bool:
+        """گره‌ای که count آن نامعلوم است هنوز با تاریخ / استان / شهر قابل تقسیم است؟"""
+        if node['filters'] or node.get('subday'):
+            return False
+        return (node['end'] - node['start']).days > 0 or not node['province_id'] or not node['township_id']
+
+    async def _split(self, node: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """
+        فرزندان یک گره پرتراکم؛ None اگر محور دیگری برای تقسیم نباشد
+        """
+        if not node['filters']:
+            children = await self._split_range(node)
+            if children:
+                return children
+        return await self._partition(node)
+
+    async def _split_range(self, node: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """تقسیم بر اساس تاریخ، استان، شهر و بازه زیرروزی"""
+        start, end = node['start'], node['end']
+        province_id, township_id = node['province_id'], node['township_id']
+
+        if (end - start).days > 0 and not node.get('subday'):
+            # تکه‌ای که از حدس تراکم آمده و باز هم سرریز کرده، نصف می‌شود؛
+            # بقیه مستقیماً به تکه‌های پیش‌بینی‌شده زیر سقف بریده می‌شوند.
+            if node.get('density_guess'):
+                ranges = self.crawler.split_date_range(start, end)
+            else:
+                ranges = self.crawler.split_date_range_by_density(
+                    start, end, node['count'], self.daily_density
+                )
+            children = [
+                self._node(range_start, range_end, province_id, township_id)
+                for range_start, range_end in ranges
+            ]
+            for child in children:
+                child['density_guess'] = not node.get('density_guess')
+            return children
+        if not province_id:
+            provinces = await self._get_provinces()
+            return [self._node(start, end, prov.get('id'), None) for prov in provinces]
+        if not township_id:
+            cities = await self._get_cities(province_id)
+            return [self._node(start, end, province_id, city.get('id')) for city in cities]
+
+        # یک روز از یک شهر: نصف کردن بازه زمانی (اگر API ساعت را بپذیرد)
+        template = node.get('subday') or await asyncio.to_thread(
+            self.crawler.get_subday_format, start, node['count'], province_id, township_id
+        )
+        if not template:
+            return None
+        resolution = subday_resolution(template)
+        bounds = (start, end) if node.get('subday') else day_bounds(start, resolution)
+        halves = split_time_range(*bounds, resolution)
+        if not halves:
+            return None
+        children = [self._node(half_start, half_end, province_id, township_id) for half_start, half_end in halves]
+        for child in children:
+            child['subday'] = template
+        return children
+
+    async def _partition(self, node: Dict[str, Any]) -> Optional[List[Dict[str, Any]]]:
+        """
+        تقسیم با partitionerها (فرزندان همین‌جا شمرده می‌شوند)
+
+        facetهای هر partitioner شمرده می‌شوند و تقسیم فقط وقتی پذیرفته می‌شود که جمع فرزندان
+        دقیقاً برابر count والد باشد؛ وگرنه partitioner بعدی امتحان می‌شود.
+        """
+        candidates = [
+            (partitioner, partitioner.facets(node['filters'])) for partitioner in self.partitioners
+            if partitioner.field not in self._unusable_fields
+        ]
+        candidates = sorted([c for c in candidates if c[1]], key=lambda c: len(c[1]))
+        for partitioner, facets in candidates:
+            if partitioner.field in self._unusable_fields:
+                continue
+            children = [
+                self._node(node['start'], node['end'], node['province_id'], node['township_id'], filters=facet)
+                for facet in facets
+            ]
+            for child in children:
+                child['subday'] = node.get('subday')
+            await self._count_many(children)
+            covered = sum(child['count'] or 0 for child in children)
+            if covered == node['count'] and not any(child.get('probe_failed') for child in children):
+                logger.info(
+                    f"🧩 Window {self._dates(node)[0]} - township {node['township_id']} {node['filters'] or ''} "
+                    f"split by {partitioner.name} into {len(children)} facets"
+                )
+                return children
+            logger.warning(
+                f"⚠️ {partitioner.name} facets cover {covered} of {node['count']} records for "
+                f"{self._dates(node)[0]} - township {node['township_id']} {node['filters'] or ''}; trying next partitioner"
+            )
+            if covered > node['count'] and partitioner.field not in node['filters']:
+                # facetهای سطح اول همپوشان‌اند: این فیلد روی این سرور تقسیم نمی‌کند
+                logger.warning(f"⚠️ {partitioner.field} does not partition counts; skipping it for the rest of the plan")
+                self._unusable_fields.add(partitioner.field)
+        return None
+
+    async def _build(self, start_date, end_date, province_id, township_id, total_count) -> List[Dict[str, Any]]:
+        root = self._node(start_date, end_date, province_id, township_id, total_count)
+        if root['count'] is None:
+            await self._count_many([root])
+
+        windows: List[Dict[str, Any]] = []
+        frontier = [root]
+        depth = 0
+
+        while frontier:
+            overflowing = []
+            for node in frontier:
+                if node.get('probe_failed'):
+                    if self._splittable_without_count(node):
+                        # بازه چندروزه نصف می‌شود (نه تقسیم تراکم‌محور که به count نیاز دارد)
+                        node['density_guess'] = True
+                        overflowing.append(node)
+                    else:
+                        windows.append(self._to_window(node))
+                elif node['count'] <= self.max_records:
+                    # پنجره‌های خالی نیازی به دریافت ندارند
+                    if node['count'] > 0:
+                        windows.append(self._to_window(node))
+                else:
+                    overflowing.append(node)
+
+            if not overflowing:
+                break
+
+            splits = await asyncio.gather(*[self._split(node) for node in overflowing])
+            children = []
+            for node, node_children in zip(overflowing, splits):
+                if not node_children:
+                    logger.warning(
+                        f"⚠️ Window {self._dates(node)[0]} - province {node['province_id']} "
+                        f"- township {node['township_id']} {node['filters'] or ''} cannot be split further "
+                        f"({node['count']} records)"
+                    )
+                    windows.append(self._to_window(node, overflow=True))
+                    continue
+                children.extend(node_children)
+
+            # فرزندان partitionerها از قبل شمرده شده‌اند
+            await self._count_many([child for child in children if child['count'] is None])
+
+            depth += 1
+            logger.info(f"🌳 Plan depth {depth}: probed {len(children)} windows")
+            frontier = children
+
+        windows.sort(key=lambda w: (
+            parse_api_date(w['start_date']), w['province_id'] or 0, w['township_id'] or 0
+        ))
+        return windows
+
+
+def iter_plan(
+    crawler,
+    plan: CrawlPlan,
+    should_stop: Optional[callable] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    نسخه streaming اجرای plan: صفحات همه پنجره‌های برگ به ترتیب yield می‌شوند
+
+    Yields:
+        آیتم‌های MojavezCrawler.iter_pages
+    """
+    for index, window in enumerate(plan.windows, start=1):
+        if should_stop and should_stop():
+            logger.warning(f"⚠️ Plan execution stopped at window {index}/{len(plan.windows)}")
+            return
+
+        logger.info(
+            f"🪟 Window {index}/{len(plan.windows)}: {window['start_date']} to {window['end_date']} "
+            f"- Province ID: {window['province_id'] or 'All'} - Township ID: {window['township_id'] or 'All'} "
+            f"({window['count']} records)"
+        )
+        yield from crawler.iter_pages(
+            window['start_date'],
+            window['end_date'],
+            window['province_id'],
+            window['township_id'],
+            expected_count=window['count'],
+            should_stop=should_stop,
+            filters=window.get('filters') or None
+        )
+
+
+def execute_plan(
+    crawler,
+    plan: CrawlPlan,
+    save_callback: Optional[callable] = None,
+    progress_callback: Optional[callable] = None,
+    should_stop: Optional[callable] = None
+) -> int:
+    """
+    اجرای plan: دریافت همه صفحات هر پنجره برگ
+
+    رکوردها بعد از save_callback نگه داشته نمی‌شوند.
+
+    Args:
+        crawler: نمونه MojavezCrawler
+        plan: خروجی CrawlPlanner.build_plan
+        save_callback: ذخیره رکوردهای هر صفحه
+        progress_callback: progress_callback(fetched_count, page, total_pages)
+        should_stop: اگر True برگرداند اجرا متوقف می‌شود
+
+    Returns:
+        تعداد رکوردهای دریافت‌شده
+    """
+    fetched = 0
+    for item in iter_plan(crawler, plan, should_stop=should_stop):
+        records = item['records']
+        fetched += len(records)
+        if save_callback and records:
+            save_callback(records)
+        if progress_callback:
+            progress_callback(fetched, item['page'], item['total_pages'])
+    return fetched
@@ -0,0 +1,308 @@
+"""
+Process-wide / fleet-wide request rate limiter
+سقف تعداد درخواست در ثانیه به سرور mojavez (token bucket) به جای sleepهای ثابت
+
+نرخ به روش AIMD با رفتار سرور تنظیم می‌شود: هر پاسخ موفق و سریع نرخ را کمی بالا می‌برد و
+هر timeout، 429 یا 5xx آن را ضربدری کم می‌کند. با Redis، سطل و نرخ بین همه ورکرها مشترک است.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def is_throttle_status(status: Optional[int]) -> bool:
+    """آیا کد HTTP نشانه فشار روی سرور است؟ (429 یا 5xx)"""
+    return status is not None and (status == 429 or status >= 500)
+
+
+class RateLimiter:
+    """
+    Token bucket امن برای thread و asyncio
+
+    هر درخواست یک توکن مصرف می‌کند؛ توکن‌ها با نرخ rate در ثانیه پر می‌شوند و تا burst
+    انباشته می‌شوند. reserve() توکن را فوراً رزرو می‌کند و مدت انتظار را برمی‌گرداند، پس
+    درخواست‌های همزمان به ترتیب پشت هم زمان‌بندی می‌شوند.
+
+    اگر adaptive باشد، on_success / on_throttle نرخ را بین min_rate و max_rate جابه‌جا می‌کنند:
+    افزایش جمعی (حدود increase درخواست/ثانیه به ازای هر ثانیه ترافیک موفق) و کاهش ضربی.
+    کاهش حداکثر یک بار در هر پنجره (decrease_interval یا زمان پاسخ اخیر، هر کدام بیشتر) انجام
+    می‌شود تا timeoutهای همزمان یک رخداد فشار نرخ را یکباره به min_rate نرسانند.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: Optional[int] = None,
+        min_rate: Optional[float] = None,
+        max_rate: Optional[float] = None,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        slow_latency: Optional[float] = None,
+        decrease_interval: float = 1.0
+    ):
+        """
+        Args:
+            rate: تعداد درخواست مجاز در ثانیه (0 یا کمتر = بدون محدودیت)
+            burst: حداکثر توکن انباشته (پیش‌فرض: max(1, rate))
+            min_rate: کف نرخ در حالت adaptive (None = نرخ ثابت)
+            max_rate: سقف نرخ در حالت adaptive (None = نرخ ثابت)
+            increase: افزایش نرخ (درخواست/ثانیه) به ازای هر ثانیه ترافیک موفق
+            decrease_factor: ضریب کاهش نرخ بعد از timeout / 429 / 5xx
+            slow_latency: پاسخ کندتر از این (ثانیه) هم مثل فشار روی سرور حساب می‌شود (None = نادیده)
+            decrease_interval: حداقل فاصله دو کاهش ضربی (ثانیه)
+        """
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.slow_latency = slow_latency
+        self.decrease_interval = decrease_interval
+        self._last_decrease = float('-inf')
+        self._latency = 0.0
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    @property
+    def adaptive(self) -> bool:
+        return self.enabled and self.min_rate is not None and self.max_rate is not None
+
+    def reserve(self) -> float:
+        """رزرو یک توکن؛ تعداد ثانیه‌ای که باید قبل از ارسال صبر کرد"""
+        if not self.enabled:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self):
+        """انتظار (blocking) تا مجاز شدن درخواست بعدی"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """نسخه asyncio از acquire"""
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    # ------------------------------------------------------------------
+    # AIMD feedback
+    # ------------------------------------------------------------------
+
+    def on_success(self, latency: Optional[float] = None):
+        """ثبت پاسخ موفق؛ پاسخ کند (بیش از slow_latency) نرخ را کم می‌کند"""
+        if not self.adaptive:
+            return
+        if latency is not None:
+            self._latency = latency if not self._latency else 0.8 * self._latency + 0.2 * latency
+        if self.slow_latency and latency is not None and latency > self.slow_latency:
+            self._decrease((1 + self.decrease_factor) / 2)
+            return
+        # افزایش increase/rate به ازای هر درخواست ≈ increase در هر ثانیه
+        self._adjust(add=self.increase / max(self.rate, 1.0))
+
+    def on_throttle(self):
+        """ثبت timeout / 429 / 5xx: کاهش ضربی نرخ"""
+        if not self.adaptive:
+            return
+        before = self.rate
+        if self._decrease(self.decrease_factor) and self.rate < before:
+            logger.warning(f"🐢 Rate limit lowered to {self.rate:.2f} req/s")
+
+    def on_response(self, status: Optional[int] = None, latency: Optional[float] = None, timeout: bool = False):
+        """ثبت نتیجه یک درخواست HTTP بر اساس کد وضعیت / timeout"""
+        if timeout or is_throttle_status(status):
+            self.on_throttle()
+        elif status is None or status < 400:
+            self.on_success(latency)
+
+    def _decrease_window(self) -> float:
+        return max(self.decrease_interval, self._latency)
+
+    def _decrease(self, factor: float) -> bool:
+        """کاهش ضربی، مگر اینکه در پنجره کاهش قبلی باشیم (همان رخداد فشار)"""
+        now = time.monotonic()
+        with self._lock:
+            if now - self._last_decrease < self._decrease_window():
+                return False
+            self._last_decrease = now
+        self._adjust(factor=factor)
+        return True
+
+    def _clamp(self, rate: float) -> float:
+        return max(self.min_rate, min(self.max_rate, rate))
+
+    def _adjust(self, factor: float = 1.0, add: float = 0.0):
+        with self._lock:
+            self.rate = self._clamp(self.rate * factor + add)
+
+
+class RedisRateLimiter(RateLimiter):
+    """
+    Token bucket مشترک بین همه ورکرها در Redis
+
+    رزرو توکن و تغییر نرخ هر کدام با یک اسکریپت Lua اتمیک انجام می‌شوند، پس rate سقف کل
+    ناوگان است نه هر پروسه. کاهش‌ها با کلید decreased در پنجره کاهش فقط یک بار برای کل ناوگان
+    اعمال می‌شوند. افزایش‌های جمعی در حافظه جمع و حداکثر هر sync_interval ثانیه
+    یک بار نوشته می‌شوند؛ کاهش‌ها فوراً. اگر Redis در دسترس نباشد تا retry_after ثانیه
+    همان سطل محلی پروسه (RateLimiter) استفاده می‌شود.
+    """
+
+    RESERVE_SCRIPT = """
+local rate = tonumber(redis.call('GET', KEYS[2])) or tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local now = tonumber(ARGV[1])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate) - 1
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], 3600)
+if tokens >= 0 then
+    return {'0', tostring(rate)}
+end
+return {tostring(-tokens / rate), tostring(rate)}
+"""
+
+    ADJUST_SCRIPT = """
+local rate = tonumber(redis.call('GET', KEYS[1])) or tonumber(ARGV[1])
+local factor = tonumber(ARGV[2])
+if factor < 1 and not redis.call('SET', KEYS[2], '1', 'NX', 'PX', ARGV[6]) then
+    factor = 1
+end
+rate = rate * factor + tonumber(ARGV[3])
+rate = math.max(tonumber(ARGV[4]), math.min(tonumber(ARGV[5]), rate))
+redis.call('SET', KEYS[1], tostring(rate), 'EX', 86400)
+return tostring(rate)
+"""
+
+    def __init__(
+        self,
+        redis_client,
+        rate: float,
+        key: str = 'mojavez:rate_limit',
+        sync_interval: float = 1.0,
+        retry_after: float = 30.0,
+        **kwargs
+    ):
+        """
+        Args:
+            redis_client: کلاینت redis
+            rate: نرخ اولیه کل ناوگان (درخواست در ثانیه)
+            key: پیشوند کلیدهای Redis
+            sync_interval: حداکثر فاصله نوشتن افزایش‌های جمعی در Redis (ثانیه)
+            retry_after: بعد از خطای Redis تا این مدت (ثانیه) فقط سطل محلی استفاده می‌شود
+            **kwargs: بقیه پارامترهای RateLimiter
+        """
+        super().__init__(rate, **kwargs)
+        self.redis_client = redis_client
+        self.bucket_key = f'{key}:bucket'
+        self.rate_key = f'{key}:rate'
+        self.decrease_key = f'{key}:decreased'
+        self.sync_interval = sync_interval
+        self.retry_after = retry_after
+        self._redis_down_until = 0.0
+        self._pending_add = 0.0
+        self._last_sync = time.monotonic()
+        self._reserve_script = redis_client.register_script(self.RESERVE_SCRIPT)
+        self._adjust_script = redis_client.register_script(self.ADJUST_SCRIPT)
+
+    def reserve(self) -> float:
+        if not self.enabled:
+            return 0.0
+        if time.monotonic() < self._redis_down_until:
+            return super().reserve()
+        try:
+            wait, rate = self._reserve_script(
+                keys=[self.bucket_key, self.rate_key],
+                args=[repr(time.time()), repr(self.rate), self.burst]
+            )
+        except Exception as e:
+            self._redis_unavailable(e)
+            return super().reserve()
+        self.rate = float(rate)
+        return float(wait)
+
+    async def acquire_async(self):
+        # اسکریپت Lua یک رفت‌وبرگشت بلاک‌کننده به Redis است؛ در thread جدا اجرا می‌شود تا event loop بلاک نشود
+        if not self.enabled:
+            return
+        if time.monotonic() < self._redis_down_until:
+            wait = super().reserve()
+        else:
+            wait = await asyncio.to_thread(self.reserve)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _redis_unavailable(self, error: Exception):
+        logger.warning(f"⚠️ Shared rate limiter unavailable for {self.retry_after:.0f}s, using local bucket: {error}")
+        self._redis_down_until = time.monotonic() + self.retry_after
+
+    def _adjust(self, factor: float = 1.0, add: float = 0.0):
+        # تغییر همیشه فوراً روی نرخ محلی اعمال می‌شود؛ Redis فقط با تأخیر sync_interval همگام می‌شود
+        with self._lock:
+            self.rate = self._clamp(self.rate * factor + add)
+            self._pending_add += add
+            if factor == 1.0 and time.monotonic() - self._last_sync < self.sync_interval:
+                return
+            add, self._pending_add = self._pending_add, 0.0
+            self._last_sync = time.monotonic()
+        if time.monotonic() < self._redis_down_until:
+            return
+        try:
+            rate = self._adjust_script(
+                keys=[self.rate_key, self.decrease_key],
+                args=[
+                    repr(self.rate), repr(factor), repr(add), repr(self.min_rate), repr(self.max_rate),
+                    max(1, int(max(self._decrease_window(), self.sync_interval) * 1000))
+                ]
+            )
+            self.rate = float(rate)
+        except Exception as e:
+            self._redis_unavailable(e)
+
+
+_rate_limiter: Optional[RateLimiter] = None
+_rate_limiter_lock = threading.Lock()
+
+
+def configure_rate_limiter(rate: float, burst: Optional[int] = None, redis_client=None, **kwargs) -> RateLimiter:
+    """
+    ساخت (یا جایگزینی) محدودکننده مشترک پروسه
+
+    Args:
+        rate: نرخ (اولیه) درخواست در ثانیه
+        burst: ظرفیت سطل
+        redis_client: اگر داده شود سطل و نرخ بین همه ورکرها مشترک است (RedisRateLimiter)
+        **kwargs: پارامترهای AIMD (min_rate، max_rate، increase، decrease_factor، slow_latency، decrease_interval)
+    """
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if redis_client is not None:
+            _rate_limiter = RedisRateLimiter(redis_client, rate, burst=burst, **kwargs)
+        else:
+            _rate_limiter = RateLimiter(rate, burst, **kwargs)
+        return _rate_limiter
+
+
+def get_rate_limiter() -> Optional[RateLimiter]:
+    """محدودکننده مشترک پروسه (None اگر configure نشده باشد)"""
+    return _rate_limiter
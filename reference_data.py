@@ -0,0 +1,220 @@
+"""
+Province / township reference data cache
+کش سلسله‌مراتب استان ← شهر که بین کراولر و پنل مشترک است
+
+سه لایه دارد: حافظه پروسه، فایل JSON محلی و (در صورت تنظیم) یک کلید Redis مشترک بین ورکرها.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Any
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceDataCache:
+    """
+    کش لیست استان‌ها و شهرهای هر استان
+
+    داده به شکل {'provinces': [...], 'townships': {'<province_id>': [...]}, 'updated_at': ts}
+    نگه داشته می‌شود؛ کلیدهای townships رشته هستند تا JSON بدون تغییر رفت‌وبرگشت کند.
+    مقادیر محورهای partition (کد سازمان‌ها، الفبای پیشوند عنوان) هم زیر 'facets' با زمان
+    به‌روزرسانی جداگانه نگه داشته می‌شوند.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        ttl: int = 24 * 60 * 60,
+        redis_client=None,
+        redis_key: str = 'mojavez:reference_data'
+    ):
+        """
+        Args:
+            path: مسیر فایل JSON محلی (اختیاری)
+            ttl: بعد از این مدت (ثانیه) داده کهنه حساب می‌شود و refresh لازم است
+            redis_client: کلاینت redis برای اشتراک بین ورکرها (اختیاری)
+            redis_key: کلید Redis
+        """
+        self.path = path
+        self.ttl = ttl
+        self.redis_client = redis_client
+        self.redis_key = redis_key
+        self._data: Optional[Dict[str, Any]] = None
+        self._lock = threading.RLock()
+
+    # ------------------------------------------------------------------
+    # Lookup API
+    # ------------------------------------------------------------------
+
+    def get_provinces(self) -> List[Dict[str, Any]]:
+        """لیست استان‌ها (خالی اگر هنوز بارگذاری نشده)"""
+        return list(self._get_data().get('provinces') or [])
+
+    def get_townships(self, province_id: int) -> Optional[List[Dict[str, Any]]]:
+        """لیست شهرهای یک استان؛ None اگر در کش نیست"""
+        townships = self._get_data().get('townships') or {}
+        value = townships.get(str(province_id))
+        return list(value) if value is not None else None
+
+    def find_province(self, province_id: int) -> Optional[Dict[str, Any]]:
+        for province in self.get_provinces():
+            if province.get('id') == province_id:
+                return province
+        return None
+
+    def find_township(self, township_id: int) -> Optional[Dict[str, Any]]:
+        """جستجوی شهر در همه استان‌ها؛ province_id استان را هم اضافه می‌کند"""
+        townships = self._get_data().get('townships') or {}
+        for province_id, items in townships.items():
+            for township in items or []:
+                if township.get('id') == township_id:
+                    return {**township, 'province_id': int(province_id)}
+        return None
+
+    def get_facets(self, name: str) -> Optional[List[Any]]:
+        """مقادیر کش‌شده یک محور partition؛ None اگر نیست یا کهنه شده"""
+        entry = (self._get_data().get('facets') or {}).get(name)
+        if not entry or time.time() - (entry.get('updated_at') or 0) > self.ttl:
+            return None
+        return list(entry.get('values') or [])
+
+    def is_stale(self) -> bool:
+        data = self._get_data()
+        if not data.get('provinces'):
+            return True
+        return time.time() - (data.get('updated_at') or 0) > self.ttl
+
+    # ------------------------------------------------------------------
+    # Updates
+    # ------------------------------------------------------------------
+
+    def set_provinces(self, provinces: List[Dict[str, Any]]):
+        with self._lock:
+            data = self._get_data()
+            data['provinces'] = provinces
+            data['updated_at'] = time.time()
+            self._persist(data)
+
+    def set_townships(self, province_id: int, townships: List[Dict[str, Any]]):
+        with self._lock:
+            data = self._get_data()
+            data.setdefault('townships', {})[str(province_id)] = townships
+            self._persist(data)
+
+    def set_facets(self, name: str, values: List[Any]):
+        with self._lock:
+            data = self._get_data()
+            data.setdefault('facets', {})[name] = {'values': list(values), 'updated_at': time.time()}
+            self._persist(data)
+
+    def refresh(self, crawler) -> Dict[str, Any]:
+        """
+        دریافت دوباره کل سلسله‌مراتب از سرور
+
+        شهرهای همه استان‌ها همزمان با fetch_cities_many کراولر دریافت می‌شوند.
+
+        Args:
+            crawler: نمونه MojavezCrawler
+        """
+        provinces = crawler.get_provinces(use_cache=False)
+        if not provinces:
+            logger.warning("⚠️ Reference data refresh returned no provinces; keeping cached data")
+            return self._get_data()
+
+        townships = crawler.fetch_cities_many([p.get('id') for p in provinces])
+        data = {
+            'provinces': provinces,
+            'townships': {
+                str(province_id): items
+                for province_id, items in townships.items()
+                if items
+            },
+            'updated_at': time.time(),
+        }
+        with self._lock:
+            # شهرهایی که این بار خطا دادند از داده قبلی حفظ می‌شوند
+            previous = (self._get_data().get('townships') or {})
+            for province_id, items in previous.items():
+                data['townships'].setdefault(province_id, items)
+            data['facets'] = self._get_data().get('facets') or {}
+            self._persist(data)
+        logger.info(f"🗂️ Reference data refreshed: {len(provinces)} provinces, {len(data['townships'])} township lists")
+        return data
+
+    def load(self) -> Dict[str, Any]:
+        """بارگذاری (warm-load) از Redis یا فایل محلی بدون درخواست شبکه"""
+        with self._lock:
+            self._data = None
+            return self._get_data()
+
+    # ------------------------------------------------------------------
+    # Storage layers
+    # ------------------------------------------------------------------
+
+    def _get_data(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._data is None:
+                self._data = self._read_redis() or self._read_file() or {'provinces': [], 'townships': {}}
+            return self._data
+
+    def _persist(self, data: Dict[str, Any]):
+        self._data = data
+        payload = json.dumps(data, ensure_ascii=False)
+        if self.path:
+            try:
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    f.write(payload)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                logger.warning(f"⚠️ Could not write reference data file {self.path}: {e}")
+        if self.redis_client is not None:
+            try:
+                self.redis_client.set(self.redis_key, payload)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not write reference data to Redis: {e}")
+
+    def _read_file(self) -> Optional[Dict[str, Any]]:
+        if not self.path or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"⚠️ Could not read reference data file {self.path}: {e}")
+            return None
+
+    def _read_redis(self) -> Optional[Dict[str, Any]]:
+        if self.redis_client is None:
+            return None
+        try:
+            payload = self.redis_client.get(self.redis_key)
+            return json.loads(payload) if payload else None
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read reference data from Redis: {e}")
+            return None
+
+
+_reference_data: Optional[ReferenceDataCache] = None
+_reference_data_lock = threading.Lock()
+
+
+def configure_reference_data(**kwargs) -> ReferenceDataCache:
+    """ساخت (یا جایگزینی) کش مشترک پروسه با تنظیمات داده‌شده"""
+    global _reference_data
+    with _reference_data_lock:
+        _reference_data = ReferenceDataCache(**kwargs)
+        return _reference_data
+
+
+def get_reference_data() -> ReferenceDataCache:
+    """کش مشترک پروسه (اگر configure نشده باشد، فقط در حافظه)"""
+    global _reference_data
+    with _reference_data_lock:
+        if _reference_data is None:
+            _reference_data = ReferenceDataCache()
+        return _reference_data
@@ -0,0 +1,295 @@
+"""
+Retry policy and circuit breaker for requests to mojavez
+سیاست retry مشترک (backoff با jitter و سقف کل retry هر جاب) و circuit breaker برای endpoint
+
+وقتی سرور پشت سر هم خطا می‌دهد، circuit باز می‌شود و تا recovery_timeout هیچ درخواستی
+فرستاده نمی‌شود (CircuitOpenError)؛ بعد از آن یک درخواست آزمایشی اجازه می‌یابد و در صورت
+موفقیت circuit دوباره بسته می‌شود. با Redis، باز بودن circuit بین همه ورکرها مشترک است.
+"""
+
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(Exception):
+    """circuit باز است؛ درخواست فرستاده نشد"""
+
+    def __init__(self, retry_after: float):
+        self.retry_after = max(0.0, retry_after)
+        super().__init__(f"Circuit open, retry after {self.retry_after:.1f}s")
+
+
+class RetryBudget:
+    """
+    سقف کل retry برای یک جاب
+
+    با redis_client شمارنده در Redis است تا همه تسک‌های پنجره یک جاب از یک بودجه مصرف کنند؛
+    در غیر این صورت (یا در صورت خطای Redis) شمارنده محلی پروسه استفاده می‌شود.
+    """
+
+    def __init__(self, total: int, redis_client=None, key: Optional[str] = None, ttl: int = 7 * 24 * 60 * 60):
+        """
+        Args:
+            total: تعداد کل retry مجاز (0 یا کمتر = بدون سقف)
+            redis_client: کلاینت redis (اختیاری)
+            key: کلید شمارنده در Redis
+            ttl: عمر کلید Redis (ثانیه)
+        """
+        self.total = total
+        self.redis_client = redis_client if key else None
+        self.key = key
+        self.ttl = ttl
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def consume(self) -> bool:
+        """برداشتن یک retry از بودجه؛ False اگر بودجه تمام شده باشد"""
+        if self.total <= 0:
+            return True
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline()
+                pipe.incr(self.key)
+                pipe.expire(self.key, self.ttl)
+                used, _ = pipe.execute()
+                return used <= self.total
+            except Exception as e:
+                logger.warning(f"⚠️ Shared retry budget unavailable, using local counter: {e}")
+        with self._lock:
+            self._used += 1
+            return self._used <= self.total
+
+    def reset(self):
+        """شروع دوباره بودجه (مثلاً در احیای جاب)"""
+        with self._lock:
+            self._used = 0
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(self.key)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not reset shared retry budget: {e}")
+
+
+class RetryPolicy:
+    """
+    سیاست retry: حداکثر تعداد تلاش، exponential backoff با full jitter و بودجه اختیاری
+
+    تأخیر تلاش n یک عدد تصادفی بین 0 و min(max_delay, base_delay × 2^(n-1)) است تا ورکرهایی
+    که همزمان خطا گرفته‌اند همزمان دوباره درخواست نزنند.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+        budget: Optional[RetryBudget] = None
+    ):
+        """
+        Args:
+            max_attempts: حداکثر تعداد تلاش برای هر درخواست (شامل تلاش اول)
+            base_delay: تأخیر پایه (ثانیه)
+            max_delay: سقف تأخیر هر بار (ثانیه)
+            budget: بودجه کل retry (اختیاری، معمولاً یکی برای هر جاب)
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+
+    def should_retry(self, attempt: int, max_attempts: Optional[int] = None) -> bool:
+        """آیا بعد از شکست تلاش شماره attempt دوباره تلاش شود؟ (از بودجه کم می‌کند)"""
+        if attempt >= (max_attempts or self.max_attempts):
+            return False
+        if self.budget is not None and not self.budget.consume():
+            logger.error("❌ Retry budget exhausted")
+            return False
+        return True
+
+    def delay(self, attempt: int) -> float:
+        """تأخیر قبل از تلاش بعد از attempt (ثانیه)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+    def with_budget(self, budget: Optional[RetryBudget]) -> 'RetryPolicy':
+        """کپی همین سیاست با بودجه دیگر"""
+        return RetryPolicy(self.max_attempts, self.base_delay, self.max_delay, budget)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker سه‌حالته (closed / open / half-open)
+
+    failure_threshold خطای پشت سر هم circuit را برای recovery_timeout ثانیه باز می‌کند. بعد از آن
+    فقط یک درخواست آزمایشی (half-open) فرستاده می‌شود: موفقیتش circuit را می‌بندد و شکستش آن را
+    دوباره باز می‌کند. درخواست آزمایشی که بدون نتیجه تمام شود (cancel) با release_probe آزاد
+    می‌شود و probe قدیمی‌تر از recovery_timeout رهاشده فرض می‌شود. با redis_client زمان باز بودن
+    در Redis نوشته می‌شود تا همه ورکرها مکث کنند.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(
+        self,
+        failure_threshold: int = 10,
+        recovery_timeout: float = 30.0,
+        redis_client=None,
+        key: str = 'mojavez:circuit',
+        sync_interval: float = 1.0
+    ):
+        """
+        Args:
+            failure_threshold: تعداد خطای پشت سر هم برای باز شدن circuit
+            recovery_timeout: مدت باز ماندن circuit قبل از درخواست آزمایشی (ثانیه)
+            redis_client: کلاینت redis برای اشتراک وضعیت بین ورکرها (اختیاری)
+            key: کلید Redis
+            sync_interval: حداکثر فاصله خواندن وضعیت از Redis (ثانیه)
+        """
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.redis_client = redis_client
+        self.key = key
+        self.sync_interval = sync_interval
+        self.state = self.CLOSED
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = False
+        self._probe_started = 0.0
+        self._last_sync = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> float:
+        """چند ثانیه تا مجاز شدن درخواست بعدی (0 = مجاز)"""
+        self._sync_from_redis()
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            return max(0.0, self._open_until - time.time())
+
+    def before_request(self) -> Optional[float]:
+        """
+        قبل از هر درخواست؛ اگر circuit باز باشد CircuitOpenError
+
+        Returns:
+            token درخواست آزمایشی (برای release_probe) یا None اگر درخواست عادی است
+        """
+        self._sync_from_redis()
+        return self._check()
+
+    async def before_request_async(self) -> Optional[float]:
+        """نسخه asyncio از before_request؛ GET روی Redis در thread جدا اجرا می‌شود تا event loop بلاک نشود"""
+        if self._sync_due():
+            await asyncio.to_thread(self._sync_from_redis)
+        return self._check()
+
+    def _check(self) -> Optional[float]:
+        with self._lock:
+            if self.state == self.CLOSED:
+                return None
+            now = time.time()
+            if now < self._open_until:
+                raise CircuitOpenError(self._open_until - now)
+            if self._probing and now - self._probe_started < self.recovery_timeout:
+                # فقط یک درخواست آزمایشی در هر لحظه
+                raise CircuitOpenError(min(self.recovery_timeout, 1.0))
+            if self._probing:
+                logger.warning("⚠️ Circuit probe abandoned; sending a new probe request")
+            self.state = self.HALF_OPEN
+            self._probing = True
+            self._probe_started = now
+            logger.info("🔌 Circuit half-open: sending probe request")
+            return now
+
+    def release_probe(self, token: Optional[float]):
+        """آزاد کردن درخواست آزمایشی که بدون record_success / record_failure تمام شد (cancel، timeout تسک)"""
+        if token is None:
+            return
+        with self._lock:
+            if self._probing and self._probe_started == token:
+                self._probing = False
+
+    def record_success(self):
+        with self._lock:
+            self._probing = False
+            if self.state == self.OPEN:
+                # پاسخ دیرِ درخواستی که قبل از باز شدن فرستاده شده بود؛ مثل record_failure نادیده گرفته می‌شود
+                return
+            self._failures = 0
+            if self.state == self.CLOSED:
+                return
+            self.state = self.CLOSED
+            self._open_until = 0.0
+        logger.info("✅ Circuit closed: upstream recovered")
+        self._write_redis(0.0)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self.state == self.OPEN:
+                # پاسخ درخواست‌هایی که قبل از باز شدن فرستاده شده بودند
+                return
+            if self.state != self.HALF_OPEN and self._failures < self.failure_threshold:
+                return
+            self.state = self.OPEN
+            self._open_until = time.time() + self.recovery_timeout
+            open_until = self._open_until
+        logger.error(f"🔌 Circuit opened for {self.recovery_timeout:.0f}s after {self._failures} consecutive failures")
+        self._write_redis(open_until)
+
+    def _write_redis(self, open_until: float):
+        if self.redis_client is None:
+            return
+        try:
+            if open_until:
+                ttl_ms = max(1, int((open_until - time.time()) * 1000))
+                self.redis_client.set(self.key, repr(open_until), px=ttl_ms)
+            else:
+                self.redis_client.delete(self.key)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not share circuit state: {e}")
+
+    def _sync_due(self) -> bool:
+        return self.redis_client is not None and time.time() - self._last_sync >= self.sync_interval
+
+    def _sync_from_redis(self):
+        """باز شدن circuit توسط ورکر دیگر (حداکثر هر sync_interval ثانیه یک بار خوانده می‌شود)"""
+        if not self._sync_due():
+            return
+        self._last_sync = time.time()
+        try:
+            value = self.redis_client.get(self.key)
+        except Exception as e:
+            logger.warning(f"⚠️ Could not read circuit state: {e}")
+            return
+        if not value:
+            return
+        open_until = float(value)
+        with self._lock:
+            if open_until > self._open_until:
+                self.state = self.OPEN
+                self._open_until = open_until
+
+
+_circuit_breaker: Optional[CircuitBreaker] = None
+_circuit_breaker_lock = threading.Lock()
+
+
+def configure_circuit_breaker(**kwargs) -> CircuitBreaker:
+    """ساخت (یا جایگزینی) circuit breaker مشترک پروسه"""
+    global _circuit_breaker
+    with _circuit_breaker_lock:
+        _circuit_breaker = CircuitBreaker(**kwargs)
+        return _circuit_breaker
+
+
+def get_circuit_breaker() -> Optional[CircuitBreaker]:
+    """circuit breaker مشترک پروسه (None اگر configure نشده باشد)"""
+    return _circuit_breaker
@@ -0,0 +1,164 @@
+"""
+Shared HTTP transport for the sync and async crawlers
+یک connection pool مشترک در هر پروسه ورکر تا handshake و گرم شدن pool در هر تسک تکرار نشود
+
+requests.Session (با HTTPAdapter و pool قابل تنظیم) و aiohttp.ClientSession (با TCPConnector و
+keep-alive قابل تنظیم) یک بار ساخته و بین همه نمونه‌های کراولر پروسه استفاده می‌شوند.
+stats() نسبت استفاده دوباره از اتصال‌ها (connection reuse) را گزارش می‌کند.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import make_headers
+
+from graphql_queries import DEFAULT_HEADERS
+
+logger = logging.getLogger(__name__)
+
+
+class HttpTransport:
+    """
+    Session های sync و async مشترک با pool، keep-alive و فشرده‌سازی قابل تنظیم
+
+    HTTP/2 پشتیبانی نمی‌شود: نه requests/urllib3 و نه aiohttp کلاینت HTTP/2 ندارند.
+    """
+
+    def __init__(
+        self,
+        pool_size: int = 50,
+        keepalive_timeout: float = 30.0,
+        compression: bool = True
+    ):
+        """
+        Args:
+            pool_size: حداکثر اتصال باز به ازای هر host (sync و async جداگانه)
+            keepalive_timeout: مدت باز ماندن اتصال بیکار در pool aiohttp (ثانیه)
+            compression: درخواست پاسخ فشرده (gzip/deflate و br اگر پکیج brotli نصب باشد)
+        """
+        self.pool_size = pool_size
+        self.keepalive_timeout = keepalive_timeout
+        self.compression = compression
+        self.headers = dict(DEFAULT_HEADERS)
+        # Accept-Encoding فقط شامل الگوریتم‌هایی است که urllib3 / aiohttp می‌توانند باز کنند
+        self.headers['Accept-Encoding'] = (
+            make_headers(accept_encoding=True)['accept-encoding'] if compression else 'identity'
+        )
+        self._session: Optional[requests.Session] = None
+        self._async_session: Optional[aiohttp.ClientSession] = None
+        self._async_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_stats = {'requests': 0, 'connections': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        """requests.Session مشترک (thread-safe برای درخواست‌های همزمان)"""
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                session.headers.update(self.headers)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def get_async_session(self) -> aiohttp.ClientSession:
+        """
+        aiohttp.ClientSession مشترک (باید داخل event loop صدا زده شود)
+
+        اگر loop عوض شده باشد (مثلاً thread loop پس‌زمینه دوباره ساخته شده) session جدید ساخته می‌شود.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_session is None or self._async_session.closed or self._async_loop is not loop:
+            trace = aiohttp.TraceConfig()
+            trace.on_request_start.append(self._on_async_request)
+            trace.on_connection_create_end.append(self._on_async_connection)
+            connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._async_session = aiohttp.ClientSession(
+                headers=self.headers,
+                connector=connector,
+                trace_configs=[trace]
+            )
+            self._async_loop = loop
+        return self._async_session
+
+    async def _on_async_request(self, session, context, params):
+        self._async_stats['requests'] += 1
+
+    async def _on_async_connection(self, session, context, params):
+        self._async_stats['connections'] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        آمار تجمعی پروسه: تعداد درخواست، تعداد اتصال جدید و نسبت استفاده دوباره از اتصال
+
+        Returns:
+            {'requests', 'connections', 'reuse_ratio', 'sync': {...}, 'async': {...}}
+        """
+        sync = {'requests': 0, 'connections': 0}
+        if self._session is not None:
+            for adapter in set(self._session.adapters.values()):
+                pools = adapter.poolmanager.pools
+                for key in list(pools.keys()):
+                    pool = pools.get(key)
+                    if pool is not None:
+                        sync['requests'] += pool.num_requests
+                        sync['connections'] += pool.num_connections
+        async_ = dict(self._async_stats)
+        requests_total = sync['requests'] + async_['requests']
+        connections_total = sync['connections'] + async_['connections']
+        return {
+            'requests': requests_total,
+            'connections': connections_total,
+            'reuse_ratio': round(1 - connections_total / requests_total, 3) if requests_total else 0.0,
+            'sync': sync,
+            'async': async_,
+        }
+
+    def log_stats(self, label: str = ''):
+        stats = self.stats()
+        if stats['requests']:
+            logger.info(
+                f"🔗 {label}HTTP: {stats['requests']} requests over {stats['connections']} connections "
+                f"(reuse {stats['reuse_ratio']:.0%})"
+            )
+
+    async def close_async(self):
+        """بستن session async (داخل همان event loop)"""
+        if self._async_session is not None and not self._async_session.closed:
+            await self._async_session.close()
+        self._async_session = None
+
+    def close(self):
+        """بستن session sync؛ session async با close_async بسته می‌شود"""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+
+
+_transport: Optional[HttpTransport] = None
+_transport_lock = threading.Lock()
+
+
+def configure_transport(**kwargs) -> HttpTransport:
+    """ساخت (یا جایگزینی) transport مشترک پروسه"""
+    global _transport
+    with _transport_lock:
+        _transport = HttpTransport(**kwargs)
+        return _transport
+
+
+def get_transport() -> Optional[HttpTransport]:
+    """transport مشترک پروسه (None اگر configure نشده باشد)"""
+    return _transport